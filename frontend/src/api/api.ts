@@ -13,14 +13,49 @@ export interface User {
 export interface WaitDetail {
     per_line_single: number[]; // minutes wait to join each individual line as size 1
     per_span: Record<number, number>; // span_size -> minutes wait
+    per_line_single_p90?: number[]; // same as per_line_single, but a wait 9 in 10 parties stay under
+    per_span_p90?: Record<number, number>;
 }
 
 export interface QueueState {
     queue: User[];
     wait_time: number; // legacy aggregate
     wait_detail?: WaitDetail;
+    seq?: number; // broadcast sequence number the snapshot corresponds to
 }
 
+export interface QueueDelta {
+    seq: number;
+    base_seq: number; // seq the delta applies on top of
+    added: User[];
+    removed: number[];
+    moved: Pick<User, 'id' | 'line_number' | 'place_in_queue'>[];
+    wait_time: number;
+    wait_detail?: WaitDetail;
+}
+
+export interface PartyPosition {
+    id?: number;
+    queued: boolean; // false once the party has been admitted or removed
+    line_number?: number;
+    place_in_queue?: number;
+    ready_at?: number; // POSIX seconds its turn is projected to start
+    wait_minutes?: number;
+    wait_minutes_p90?: number; // only from getPosition
+    seq?: number;
+}
+
+export const getPosition = async (token: string): Promise<PartyPosition> => {
+    const response = await fetch(`${QUEUE_API_URL}/position/${encodeURIComponent(token)}`);
+    if (response.status === 404) {
+        return { queued: false };
+    }
+    if (!response.ok) {
+        throw new Error('Failed to fetch position');
+    }
+    return response.json();
+};
+
 export const getQueue = async (): Promise<QueueState> => {
     const response = await fetch(`${QUEUE_API_URL}/queue`);
     if (!response.ok) {
@@ -43,58 +78,55 @@ export const joinQueue = async (name: string, email: string, emailConsent: boole
     return response.json();
 };
 
-export const checkAdminPassword = async (password: string): Promise<any> => {
-    const response = await fetch(`${QUEUE_API_URL}/admin/check_password`, {
+export interface AdminSession {
+    token: string;
+    expires_in: number;
+}
+
+// Thrown by admin calls whose token was refused (expired or invalid); log in again
+export class AdminAuthError extends Error {}
+
+// Exchanges the admin password for a short-lived token sent with every admin call
+export const adminLogin = async (password: string): Promise<AdminSession> => {
+    const response = await fetch(`${QUEUE_API_URL}/admin/login`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ password }),
     });
+    if (response.status === 429) {
+        throw new Error('Too many failed logins, try again later');
+    }
     if (!response.ok) {
         throw new Error('Incorrect password');
     }
     return response.json();
 };
 
-export const getNext = async (password: string, lineNumber: number): Promise<any> => {
-    const response = await fetch(`${QUEUE_API_URL}/admin/next`, {
+const adminPost = async (path: string, token: string, body: object, failure: string): Promise<any> => {
+    const response = await fetch(`${QUEUE_API_URL}${path}`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            'Authorization': `Bearer ${token}`,
         },
-        body: JSON.stringify({ password, line_number: lineNumber }),
+        body: JSON.stringify(body),
     });
-    if (!response.ok) {
-        throw new Error('Failed to get next in queue');
+    if (response.status === 401) {
+        throw new AdminAuthError('Admin session expired');
     }
-    return response.json();
-};
-
-export const removeFromQueue = async (password: string, userId: number): Promise<any> => {
-    const response = await fetch(`${QUEUE_API_URL}/admin/remove`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ password, user_id: userId }),
-    });
     if (!response.ok) {
-        throw new Error('Failed to remove from queue');
+        throw new Error(failure);
     }
     return response.json();
 };
 
-export const getAdminQueue = async (password: string): Promise<QueueState> => {
-    const response = await fetch(`${QUEUE_API_URL}/admin/queue`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ password }),
-    });
-    if (!response.ok) {
-        throw new Error('Failed to fetch admin queue');
-    }
-    return response.json();
-};
+export const getNext = async (token: string, lineNumber: number): Promise<any> =>
+    adminPost('/admin/next', token, { line_number: lineNumber }, 'Failed to get next in queue');
+
+export const removeFromQueue = async (token: string, userId: number): Promise<any> =>
+    adminPost('/admin/remove', token, { user_id: userId }, 'Failed to remove from queue');
+
+export const getAdminQueue = async (token: string): Promise<QueueState> =>
+    adminPost('/admin/queue', token, {}, 'Failed to fetch admin queue');
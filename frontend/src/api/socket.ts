@@ -4,9 +4,9 @@ import API_URL from './config';
 // Connect specifically to the queue namespace so server-side isolation works
 export const socket: Socket = io(`${API_URL}/queue`);
 
-// Helper to request admin elevation
-export function connectAsAdmin(password: string) {
-	socket.emit('admin_connect', { password });
+// Helper to request admin elevation, with a token from adminLogin
+export function connectAsAdmin(token: string) {
+	socket.emit('admin_connect', { token });
 }
 
 // Helper to downgrade back to public room
@@ -1,11 +1,11 @@
-import React, { createContext, useState, useEffect, useContext, ReactNode, useCallback } from 'react';
-import { User, QueueState, WaitDetail } from '../api/api';
+import React, { createContext, useState, useEffect, useContext, ReactNode, useCallback, useRef } from 'react';
+import { User, QueueState, QueueDelta, WaitDetail } from '../api/api';
 import { socket } from '../api/socket';
 
 interface QueueContextType {
     queue: User[];
     waitDetail: WaitDetail | undefined;
-    connectAdmin: (password: string) => void;
+    connectAdmin: (token: string) => void;
 }
 
 const QueueContext = createContext<QueueContextType | undefined>(undefined);
@@ -14,14 +14,44 @@ export const QueueProvider: React.FC<{ children: ReactNode }> = ({ children }) =
     const [queue, setQueue] = useState<User[]>([]);
     const [waitDetail, setWaitDetail] = useState<WaitDetail | undefined>(undefined);
 
+    // Sequence number of the last snapshot/delta applied; null until the first full snapshot
+    const seqRef = useRef<number | null>(null);
+
     useEffect(() => {
         const handleQueueUpdate = (data: QueueState) => {
             console.log(data);
+            seqRef.current = data.seq ?? null;
             setQueue(data.queue);
             setWaitDetail(data.wait_detail);
         };
 
+        const handleQueueDelta = (delta: QueueDelta) => {
+            if (seqRef.current === null || delta.seq <= seqRef.current) {
+                return; // waiting for a snapshot, or already covered by one
+            }
+            if (delta.base_seq !== seqRef.current) {
+                seqRef.current = null;
+                socket.emit('resync');
+                return;
+            }
+            seqRef.current = delta.seq;
+            setQueue(prev => {
+                const byId = new Map(prev.map(u => [u.id, u]));
+                delta.removed.forEach(id => byId.delete(id));
+                delta.added.forEach(u => byId.set(u.id, u));
+                delta.moved.forEach(m => {
+                    const u = byId.get(m.id);
+                    if (u) byId.set(m.id, { ...u, line_number: m.line_number, place_in_queue: m.place_in_queue });
+                });
+                return Array.from(byId.values()).sort(
+                    (a, b) => (a.line_number ?? 0) - (b.line_number ?? 0) || a.place_in_queue - b.place_in_queue
+                );
+            });
+            setWaitDetail(delta.wait_detail);
+        };
+
         socket.on('queue_update', handleQueueUpdate);
+        socket.on('queue_delta', handleQueueDelta);
         socket.emit('get_queue'); // Initial fetch
 
         // Re-join public room on connect to ensure user gets updates
@@ -31,12 +61,13 @@ export const QueueProvider: React.FC<{ children: ReactNode }> = ({ children }) =
 
         return () => {
             socket.off('queue_update', handleQueueUpdate);
+            socket.off('queue_delta', handleQueueDelta);
             socket.off('connect');
         };
     }, []);
 
-    const connectAdmin = useCallback((password: string) => {
-        socket.emit('admin_connect', { password });
+    const connectAdmin = useCallback((token: string) => {
+        socket.emit('admin_connect', { token });
     }, []);
 
     return (
@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useMemo, useCallback } from 'react';
-import { removeFromQueue, getNext, checkAdminPassword } from '../api/api';
+import { removeFromQueue, getNext, adminLogin, AdminAuthError } from '../api/api';
 import { User } from '../api/api';
 import { useQueue } from '../context/QueueContext';
 // import './AdminView.css';
@@ -9,6 +9,8 @@ const AdminView: React.FC = () => {
     const { queue: adminQueue, connectAdmin, waitDetail } = useQueue();
     const [error, setError] = useState<string | null>(null);
     const [password, setPassword] = useState<string | null>(null);
+    // Short-lived token from /admin/login, sent with every admin call instead of the password
+    const [token, setToken] = useState<string | null>(null);
 
     useEffect(() => {
         if (!password) {
@@ -23,40 +25,51 @@ const AdminView: React.FC = () => {
 
             return () => clearTimeout(timer);
         } else {
-            connectAdmin(password);
-
-            const checkPassword = async () => {
+            const login = async () => {
                 try {
-                    await checkAdminPassword(password);
+                    const session = await adminLogin(password);
+                    setToken(session.token);
+                    connectAdmin(session.token);
                     setError(null);
                 } catch (error) {
                     console.error(error);
-                    setError('Failed to fetch queue. Incorrect password?');
+                    setError(`Failed to log in. ${(error as Error).message}`);
                 }
             };
-            checkPassword();
+            login();
         }
     }, [password, connectAdmin]);
 
+    // Runs an admin call, logging in again once if the token has expired
+    const withToken = useCallback(async (call: (token: string) => Promise<any>) => {
+        if (!password || !token) return;
+        try {
+            await call(token);
+        } catch (error) {
+            if (!(error instanceof AdminAuthError)) throw error;
+            const session = await adminLogin(password);
+            setToken(session.token);
+            await call(session.token);
+        }
+    }, [password, token]);
+
     const handleRemove = useCallback(async (userId: number) => {
-        if (!password) return;
         try {
-            await removeFromQueue(password, userId);
+            await withToken(t => removeFromQueue(t, userId));
         } catch (error) {
             console.error(error);
             alert('Failed to remove user.');
         }
-    }, [password]);
+    }, [withToken]);
 
     const handleNext = useCallback(async (lineNumber: number) => {
-        if (!password) return;
         try {
-            await getNext(password, lineNumber);
+            await withToken(t => getNext(t, lineNumber));
         } catch (error) {
             console.error(error);
             alert('Failed to advance queue.');
         }
-    }, [password]);
+    }, [withToken]);
 
     // Stable display line count: never shrink once a higher count known.
     const [displayLineCount, setDisplayLineCount] = useState<number>(2);
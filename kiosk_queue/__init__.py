@@ -1,11 +1,112 @@
+import threading
+import click
 from .db import db
+from .schema import ensure_schema
+from .queue_logic import _get_grid, _get_queue, create_queue_logic
 from .routes import create_blueprint
-from .cli import init_db_command, reset_db_command
-from .sockets import create_socket_namespace
-from flask_cors import CORS
-from cors_helpers import configure_cors  # absolute import
+from .workers import DbWorkerPool
+from .storage import create_store
+from .metrics import Metrics
+from .auth import create_auth
+
+# The CLI commands, event archive, notifications, Socket.IO namespace and broadcaster
+# (python-socketio) and CORS (flask_cors) are imported in init_app or on first use, and
+# only when used, so importing the package stays light
+
+# Flask CLI commands: name -> attribute of kiosk_queue.cli
+CLI_COMMANDS = {
+    "kiosk-init-db": "init_db_command",
+    "kiosk-reset-db": "reset_db_command",
+    "kiosk-upgrade-db": "upgrade_db_command",
+    "kiosk-create-queue": "create_queue_command",
+    "kiosk-export-events": "export_events_command",
+    "kiosk-replay-events": "replay_events_command",
+    "kiosk-hash-password": "hash_password_command",
+}
+
+
+class _LazyCommand(click.Command):
+    """Stands in for a command of kiosk_queue.cli, which is only imported once the command
+    runs or ``flask --help`` lists it."""
+
+    def __init__(self, name, attribute):
+        super().__init__(name)
+        self._attribute = attribute
+
+    def _command(self):
+        from . import cli
+        return getattr(cli, self._attribute)
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # The context carries the real command, so parsing, --help and invoke all use it
+        return self._command().make_context(info_name, args, parent=parent, **extra)
+
+    def get_short_help_str(self, limit=45):
+        return self._command().get_short_help_str(limit)
+
+
+class _Cors:
+    """CORS of the queue routes (``configure_cors`` from cors_helpers) and the allowed
+    origins it returns, also checked by Socket.IO handshakes.
+
+    ``origins`` configures it on first call. In lazy mode that is the first HTTP request
+    (``wrap`` runs ahead of Flask's dispatch, while handlers can still be registered) or
+    Socket.IO handshake, whichever comes first.
+    """
+
+    def __init__(self, app, url_prefix):
+        self.app = app
+        self.url_prefix = url_prefix
+        self._origins = None
+        self._configured = False
+        self._lock = threading.Lock()
+
+    def origins(self):
+        if not self._configured:
+            with self._lock:
+                if not self._configured:
+                    from cors_helpers import configure_cors  # absolute import
+                    self._origins = configure_cors(
+                        self.app,
+                        url_prefix=self.url_prefix,
+                        origins_config_key="KIOSK_QUEUE_CORS_ORIGINS",
+                        creds_config_key="KIOSK_QUEUE_CORS_SUPPORTS_CREDENTIALS",
+                    )
+                    self._configured = True
+        return self._origins
+
+    def allows(self, origin):
+        """Socket.IO's ``cors_allowed_origins`` check."""
+        origins = self.origins()
+        if origins is None or isinstance(origins, str):
+            origins = [origins or "*"]
+        return "*" in origins or origin in origins
+
+    def wrap(self, wsgi_app):
+        def cors_on_first_request(environ, start_response):
+            if not self._configured:
+                self.origins()
+            return wsgi_app(environ, start_response)
+        return cors_on_first_request
+
+    def attach(self, socketio):
+        """Check Socket.IO handshakes against these origins, unless `socketio` was given
+        origins of its own (anything but the default or ``"*"``)."""
+        server = getattr(socketio, "server", None)
+        if server is not None:
+            if server.eio.cors_allowed_origins in (None, "*"):
+                server.eio.cors_allowed_origins = self.allows
+        elif socketio.server_options.get("cors_allowed_origins") in (None, "*"):
+            # Read when socketio.init_app creates the server
+            socketio.server_options["cors_allowed_origins"] = self.allows
+
 
 class KioskQueue:
+    """Flask extension hosting any number of independent queues.
+
+    Queues are keyed by ``Queue.id``; requests without a queue id use the default (lowest
+    id) queue, so single-attraction setups work unchanged.
+    """
     def __init__(self, app=None, *, url_prefix="/api/kiosk", register_cli=True):
         self.url_prefix = url_prefix
         self._namespace = None
@@ -17,39 +118,133 @@ class KioskQueue:
         app.config.setdefault("KIOSK_QUEUE_MAX_ACTIVE", 1)
         app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
         app.config.setdefault("KIOSK_QUEUE_CORS_ORIGINS", "*")
+        # Seconds over which queue updates are merged into one Socket.IO emit (0 = emit immediately)
+        app.config.setdefault("KIOSK_QUEUE_BROADCAST_DELAY", 0.05)
+        # Times a mutation is retried after losing the DB write lock to another worker
+        app.config.setdefault("KIOSK_QUEUE_WRITE_RETRIES", 3)
+        # Where queue state lives: "sqlalchemy" (the DB tables) or "memory" (in-process,
+        # logged to KIOSK_QUEUE_STORE_PATH; single worker only)
+        app.config.setdefault("KIOSK_QUEUE_STORE", "sqlalchemy")
+        app.config.setdefault("KIOSK_QUEUE_STORE_PATH", None)
+        app.config.setdefault("KIOSK_QUEUE_STORE_FSYNC", False)
+        app.config.setdefault("KIOSK_QUEUE_STORE_SNAPSHOT_EVERY", 1000)
+        # How joins are placed: "greedy" (first fit, parties only ever move up their own lines)
+        # or "optimized" (best fit, and the first KIOSK_QUEUE_REPACK_DEPTH rows are re-packed
+        # across lines after every admit or removal; nobody is ever moved later)
+        app.config.setdefault("KIOSK_QUEUE_PLACEMENT", "greedy")
+        app.config.setdefault("KIOSK_QUEUE_REPACK_DEPTH", 50)
+        # Weight of each new admit in the rolling per-line service-time estimates behind
+        # wait_detail (0.1 follows roughly the last 20 admits of a line)
+        app.config.setdefault("KIOSK_QUEUE_SERVICE_ALPHA", 0.1)
+        # Directory of the append-only event history (None = keep no history), see archive.py
+        app.config.setdefault("KIOSK_QUEUE_ARCHIVE_PATH", None)
+        app.config.setdefault("KIOSK_QUEUE_ARCHIVE_FLUSH_INTERVAL", 0.5)
+        app.config.setdefault("KIOSK_QUEUE_ARCHIVE_FSYNC", False)
+        # Record timings, SQL counts and broadcast sizes, served at /admin/metrics (off: the
+        # hooks cost one dict lookup each)
+        app.config.setdefault("KIOSK_QUEUE_METRICS", False)
+        # "You're up soon" messages, see notifications.py: a Transport, "memory" or
+        # "file:<path>" (None = send nothing). Parties that gave an address and consent
+        # are messaged once on coming within KIOSK_QUEUE_NOTIFY_WITHIN slots of the front
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_TRANSPORT", None)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_WITHIN", 3)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_WORKERS", 4)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_BATCH", 50)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_MAX_ATTEMPTS", 5)
+        # Seconds before the first retry of a failed message; doubles with each attempt
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_BACKOFF", 2.0)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_POLL_INTERVAL", 1.0)
+        # Text of the message, with {place} for the party's place (None = DEFAULT_MESSAGE)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_MESSAGE", None)
+        # Shared secret of POST /notifications/inbound, where the provider relays replies
+        # (a CANCEL removes the sender's parties); None disables the endpoint
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_WEBHOOK_SECRET", None)
+        # Seconds an X-Webhook-Timestamp may differ from now (clock skew plus delivery delay)
+        app.config.setdefault("KIOSK_QUEUE_NOTIFY_WEBHOOK_TOLERANCE", 300)
+        # Admin login (see auth.py): a werkzeug hash of the admin password, e.g. from
+        # `flask kiosk-hash-password` (None = hash ADMIN_PASSWORD on the first login)
+        app.config.setdefault("KIOSK_QUEUE_ADMIN_PASSWORD_HASH", None)
+        # Seconds an admin token from /admin/login stays valid
+        app.config.setdefault("KIOSK_QUEUE_ADMIN_TOKEN_TTL", 3600)
+        # Failed logins in a row before a client is locked out, and the first lockout in
+        # seconds (doubling with each further failure)
+        app.config.setdefault("KIOSK_QUEUE_LOGIN_MAX_FAILURES", 5)
+        app.config.setdefault("KIOSK_QUEUE_LOGIN_LOCKOUT", 30)
+        # Most parties/lines/users accepted by one /batch request
+        app.config.setdefault("KIOSK_QUEUE_MAX_BATCH", 100)
+        # Threads running DB work off the Socket.IO event loop (0 = run it inline)
+        app.config.setdefault("KIOSK_QUEUE_DB_WORKERS", 4)
         # Optional: whether to allow credentials (cookies/auth headers) in CORS
         app.config.setdefault("KIOSK_QUEUE_CORS_SUPPORTS_CREDENTIALS", False)
 
-        # Derive CORS origins list
-        effective_prefix = url_prefix or self.url_prefix
-        origins_list = configure_cors(
-            app,
-            url_prefix=effective_prefix,
-            origins_config_key="KIOSK_QUEUE_CORS_ORIGINS",
-            creds_config_key="KIOSK_QUEUE_CORS_SUPPORTS_CREDENTIALS",
-        )
+        # Skip the start-up work nothing needs yet: the default queue and the occupancy grids
+        # are created on first use, and CORS on the first request
+        app.config.setdefault("KIOSK_QUEUE_LAZY_INIT", False)
+        lazy = app.config["KIOSK_QUEUE_LAZY_INIT"]
+
+        cors = _Cors(app, url_prefix or self.url_prefix)
+        if lazy:
+            app.wsgi_app = cors.wrap(app.wsgi_app)
+        else:
+            cors.origins()
 
+        app.extensions['kiosk_queue_auth'] = create_auth(app)
+        store = app.extensions['kiosk_queue_store'] = create_store(app)
+        if app.config["KIOSK_QUEUE_ARCHIVE_PATH"]:
+            from .archive import create_archive
+            app.extensions['kiosk_queue_archive'] = create_archive(app)
+        metrics = None
+        if app.config["KIOSK_QUEUE_METRICS"]:
+            metrics = app.extensions['kiosk_queue_metrics'] = Metrics()
         with app.app_context():
             db.init_app(app)
-            db.create_all()
+            if metrics is not None:
+                metrics.track_queries(db.engine)
+            # One SELECT when the DB already has the current schema
+            if app.config["KIOSK_QUEUE_STORE"] == "sqlalchemy":
+                ensure_schema()
+            if not lazy:
+                # Make sure the default queue exists, then warm the in-memory occupancy grids
+                # so the first join doesn't pay for the rebuild
+                _get_queue()
+                for queue in store.list_queues():
+                    _get_grid(queue)
 
         bp = create_blueprint()
         app.register_blueprint(bp, url_prefix=url_prefix or self.url_prefix)
 
         if register_cli:
-            app.cli.add_command(init_db_command)
-            app.cli.add_command(reset_db_command)
+            for name, attribute in CLI_COMMANDS.items():
+                app.cli.add_command(_LazyCommand(name, attribute))
+
+        if app.config["KIOSK_QUEUE_NOTIFY_TRANSPORT"]:
+            from .notifications import create_notifier
+            app.extensions['kiosk_queue_notifier'] = create_notifier(app)
+
+        if app.config["KIOSK_QUEUE_DB_WORKERS"] > 0:
+            app.extensions['kiosk_queue_db_pool'] = DbWorkerPool(
+                app, size=app.config["KIOSK_QUEUE_DB_WORKERS"], socketio=socketio
+            )
 
         if socketio:
-            # Set socket.io CORS if still default / permissive
-            if getattr(socketio, "cors_allowed_origins", None) in (None, "*"):
-                socketio.cors_allowed_origins = origins_list
+            # The namespace has to be registered now: Flask-SocketIO answers its requests
+            # in middleware outside app.wsgi_app, so there is no first request to defer to
+            from .sockets import create_socket_namespace
+            from .broadcast import QueueBroadcaster
+            cors.attach(socketio)
             # attach Socket.IO namespace with DI of logic/services
-            self._namespace = create_socket_namespace(socketio)
+            self._namespace = app.extensions['kiosk_queue_namespace'] = create_socket_namespace(socketio)
             app.extensions['socketio'] = socketio
+            app.extensions['kiosk_queue_broadcaster'] = QueueBroadcaster(
+                socketio, app, delay=app.config["KIOSK_QUEUE_BROADCAST_DELAY"]
+            )
 
         # Optional: store extension reference
         if not hasattr(app, 'extensions'):
             app.extensions = {}
         app.extensions["kiosk_queue"] = self
 
+    def create_queue(self, name=None, line_count=None, slot_time=None, reset_time=None):
+        """Create another queue (call inside an app context); returns the ``Queue`` row."""
+        return create_queue_logic(name=name, line_count=line_count, slot_time=slot_time, reset_time=reset_time)
+
@@ -0,0 +1,257 @@
+import atexit
+import collections
+import csv
+import glob
+import heapq
+import json
+import os
+from datetime import datetime, timezone
+from .workers import native_rlock, native_sleep, start_native_thread
+
+# Event kinds and the fields each stores after (ts, queue_id, kind)
+EVENT_FIELDS = {
+    'join': ('user_id', 'name', 'party_size'),
+    'place': ('user_id', 'line_number', 'place_in_queue'),
+    # A party moved up, in optimized placement possibly to other lines (logs from before
+    # parties could change lines have no line_number)
+    'compact': ('user_id', 'place_in_queue', 'line_number'),
+    'admit': ('user_id',),
+    'remove': ('user_id',),
+}
+# Columns of a normalized event (see read_events), also the CSV export header
+EVENT_COLUMNS = ('ts', 'queue_id', 'kind', 'user_id', 'name', 'party_size', 'line_number', 'place_in_queue')
+STATE_COLUMNS = ('queue_id', 'user_id', 'name', 'party_size', 'line_number', 'place_in_queue')
+DAY_SECONDS = 86400  # POSIX days are exactly this long, so files roll over at UTC midnight
+_ROW_KEYS = {kind: ('ts', 'queue_id', 'kind') + fields for kind, fields in EVENT_FIELDS.items()}
+_BLANK_EVENT = dict.fromkeys(EVENT_COLUMNS)
+_encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+
+class EventArchive:
+    """Append-only history of every queue change, written off the request path.
+
+    Each committed mutation hands its events to ``record``, which only appends them to an
+    in-memory deque (O(1), no I/O, no lock). A background OS thread drains the deque every
+    ``flush_interval`` seconds and appends them, one compact JSON array per line, e.g.
+    ``[1760745600.123456,1,"place",42,0,3]``, to a file per UTC day and process:
+    ``<path>/events-2026-10-18.<pid>.jsonl``. Per-process files let several workers share
+    one directory; readers merge them by timestamp (see ``read_events``).
+
+    Events are timestamped before their transaction commits, while the queue's write lock is
+    held, so one queue's events are in commit order by timestamp even across workers. Each
+    flush is sorted, but a mutation that records its events after a later one was flushed
+    lands behind it in the file; readers sort such files (see ``_read_file``).
+    """
+
+    def __init__(self, path, flush_interval=0.5, fsync=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._pending = collections.deque()
+        self._write_lock = native_rlock()
+        self._file = None
+        self._file_day = None
+        self._closed = False
+        os.makedirs(path, exist_ok=True)
+        start_native_thread(self._run)
+        atexit.register(self.close)
+
+    def record(self, queue_id, ts, events):
+        """Queue ``events`` (tuples ``(kind, *EVENT_FIELDS[kind])``) of one mutation made at `ts`."""
+        self._pending.append((ts, queue_id, events))
+
+    def _run(self):
+        while not self._closed:
+            native_sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write every recorded event to disk now."""
+        with self._write_lock:
+            batch = []
+            pending = self._pending
+            while pending:
+                batch.append(pending.popleft())
+            if not batch:
+                return
+            # Concurrent mutations of different queues can be appended slightly out of order
+            batch.sort(key=lambda item: item[0])
+            lines = []
+            for ts, queue_id, events in batch:
+                day = int(ts // DAY_SECONDS)
+                if day != self._file_day:
+                    self._write(lines)
+                    lines = []
+                    self._open(day)
+                head = (round(ts, 6), queue_id)
+                for event in events:
+                    lines.append(_encode(head + event))
+            self._write(lines)
+
+    def _open(self, day):
+        if self._file is not None:
+            self._file.close()
+        # Unbuffered append: each flush is one write() of whole lines, so a crash never
+        # leaves half a batch from the middle of the file
+        self._file = open(os.path.join(self.path, f'events-{_day(day * DAY_SECONDS)}.{os.getpid()}.jsonl'), 'ab', buffering=0)
+        self._file_day = day
+
+    def _write(self, lines):
+        if lines:
+            lines.append('')
+            self._file.write('\n'.join(lines).encode('utf-8'))
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """Flush what is left and stop the writer thread."""
+        self._closed = True
+        with self._write_lock:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_day = None
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _timestamps(f):
+    """The timestamp of each line of the open file `f`, read without decoding the line."""
+    for line in f:
+        try:
+            yield float(line[1:line.index(b',')]), line
+        except ValueError:
+            return  # torn write at the tail
+
+
+def _in_order(filename):
+    with open(filename, 'rb') as f:
+        last = float('-inf')
+        for ts, _ in _timestamps(f):
+            if ts < last:
+                return False
+            last = ts
+    return True
+
+
+def _parse(filename, since):
+    with open(filename, 'rb') as f:
+        for ts, line in _timestamps(f):
+            if since is not None and ts < since:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def _read_file(filename, since):
+    """Parsed events of one file in timestamp order, skipping those before `since` without
+    decoding them. A file is streamed if it is in order (checked by a first pass over the
+    timestamps only); one with events flushed out of order is loaded and sorted, stably so
+    a mutation's events keep their order."""
+    if _in_order(filename):
+        return _parse(filename, since)
+    return iter(sorted(_parse(filename, since), key=lambda row: row[0]))
+
+
+def _rows(path, since=None, until=None, queue_id=None):
+    """Raw ``[ts, queue_id, kind, ...]`` rows in timestamp order (see read_events)."""
+    days = collections.defaultdict(list)
+    for filename in glob.glob(os.path.join(path, 'events-*.jsonl')):
+        days[os.path.basename(filename)[len('events-'):].split('.', 1)[0]].append(filename)
+    first_day = _day(since) if since is not None else None
+    last_day = _day(until) if until is not None else None
+    for day in sorted(days):
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        streams = [_read_file(filename, since) for filename in sorted(days[day])]
+        for row in heapq.merge(*streams, key=lambda row: row[0]):
+            if until is not None and row[0] > until:
+                continue
+            if queue_id is not None and row[1] != queue_id:
+                continue
+            yield row
+
+
+def read_events(path, since=None, until=None, queue_id=None):
+    """Stream the archived events in `path`, oldest first, as dicts keyed by EVENT_COLUMNS.
+
+    Only day files that can hold events in ``[since, until]`` are opened, and a day's
+    per-process files are merged lazily, so memory stays flat however long the log is
+    (short of one day file, for a file that has to be sorted).
+    """
+    for row in _rows(path, since, until, queue_id):
+        event = _BLANK_EVENT.copy()
+        event.update(zip(_ROW_KEYS[row[2]], row))
+        yield event
+
+
+def replay(path, at=None, queue_id=None):
+    """Rebuild the queues as they were at time `at` (default: the end of the log).
+
+    Returns ``{queue_id: {user_id: party}}`` where each party dict has the STATE_COLUMNS
+    fields; only the parties queued at `at` are held in memory. A party that joined before
+    the log starts (the archive was enabled later, or old files were removed) is picked up
+    from its first ``place`` or ``compact`` event, with no name or party size.
+    """
+    queues = collections.defaultdict(dict)
+    for row in _rows(path, until=at, queue_id=queue_id):
+        parties = queues[row[1]]
+        kind = row[2]
+        user_id = row[3]
+        if kind == 'join':
+            parties[user_id] = _state(row[1], user_id, row[4], row[5])
+        elif kind == 'place' or kind == 'compact':
+            party = parties.get(user_id)
+            if party is None:
+                party = parties[user_id] = _state(row[1], user_id)
+            if kind == 'place':
+                party['line_number'] = row[4]
+                party['place_in_queue'] = row[5]
+            else:
+                party['place_in_queue'] = row[4]
+                if len(row) > 5:
+                    party['line_number'] = row[5]
+        else:
+            parties.pop(user_id, None)
+    return dict(queues)
+
+
+def _state(queue_id, user_id, name=None, party_size=None):
+    return {'queue_id': queue_id, 'user_id': user_id, 'name': name,
+            'party_size': party_size, 'line_number': None, 'place_in_queue': None}
+
+
+def write_rows(rows, columns, fmt, out):
+    """Write dict rows to the text stream `out` as JSON lines or CSV (with a header)."""
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            out.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+
+def parse_time(value):
+    """POSIX seconds from a CLI argument: a number, or an ISO 8601 date/time (local time if naive)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def create_archive(app):
+    """The app's EventArchive, or None when ``KIOSK_QUEUE_ARCHIVE_PATH`` is unset."""
+    path = app.config.get('KIOSK_QUEUE_ARCHIVE_PATH')
+    if not path:
+        return None
+    return EventArchive(
+        path,
+        flush_interval=app.config.get('KIOSK_QUEUE_ARCHIVE_FLUSH_INTERVAL', 0.5),
+        fsync=app.config.get('KIOSK_QUEUE_ARCHIVE_FSYNC', False),
+    )
@@ -0,0 +1,171 @@
+import base64
+import functools
+import hashlib
+import hmac
+import secrets
+import time
+from flask import current_app, jsonify, request
+from werkzeug.security import check_password_hash, generate_password_hash
+from .workers import native_rlock
+
+MAX_LOCKOUT = 3600  # seconds; longest a client is ever locked out for
+MAX_TRACKED = 10000  # clients with failed logins remembered before expired lockouts are dropped
+
+
+class AdminAuth:
+    """Admin login: a slow salted hash checked once per login, then a signed token per request.
+
+    ``login`` checks the password against a werkzeug scrypt hash (about 0.1 s by design) and
+    returns a token ``<expiry>.<signature>``, an HMAC-SHA256 of the expiry time under a key
+    derived from ``SECRET_KEY``. Checking a token is one HMAC and a constant-time compare,
+    with no lookup, so it works on any worker that shares ``SECRET_KEY``. Tokens can't be
+    revoked one by one; changing ``SECRET_KEY`` revokes them all.
+
+    Failed logins are counted per client address. After ``max_failures`` in a row, the
+    client is locked out for ``lockout`` seconds, doubling with every further failure (up to
+    MAX_LOCKOUT); a locked-out client is refused without hashing. Each attempt is counted
+    before its hash runs and forgiven if it succeeds. Counts are per process.
+
+    Once the password has been verified, an HMAC of it is kept, so presenting it again (a
+    metrics scraper's Basic auth on every scrape) costs one HMAC and isn't counted.
+    """
+
+    def __init__(self, password=None, password_hash=None, secret_key=None, ttl=3600, max_failures=5, lockout=30.0):
+        if password_hash is None and not password:
+            raise ValueError('An admin password or password hash is required')
+        self._password = password
+        self._password_hash = password_hash
+        # Without SECRET_KEY, tokens are only valid on the worker that issued them
+        secret = secret_key.encode('utf-8') if secret_key else secrets.token_bytes(32)
+        self._key = hmac.new(secret, b'kiosk-queue-admin-token', hashlib.sha256).digest()
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self._failures = {}  # client -> (failed logins in a row, locked out until)
+        self._verified = None  # _digest of the password once it has been checked
+        self._lock = native_rlock()
+
+    def _stored_hash(self):
+        # Hashing ADMIN_PASSWORD costs as much as a login, so it waits for the first one
+        with self._lock:
+            if self._password_hash is None:
+                self._password_hash = generate_password_hash(self._password)
+                self._password = None
+            return self._password_hash
+
+    def retry_after(self, client, now=None):
+        """Seconds until `client` may try to log in again (0: now)."""
+        failures = self._failures.get(client)
+        if failures is None:
+            return 0
+        return max(0, failures[1] - (time.time() if now is None else now))
+
+    def login(self, password, client):
+        """``(token, 0)`` if `password` is right, else ``(None, seconds before `client` may
+        try again)``."""
+        ok, wait = self.check(password, client)
+        return (self.issue(), 0) if ok else (None, wait)
+
+    def check(self, password, client):
+        """``(True, 0)`` if `password` is right, else ``(False, seconds before `client` may
+        try again)``. Like ``login``, without issuing a token."""
+        with self._lock:
+            wait = self.retry_after(client)
+            if wait:
+                return False, wait
+            if not isinstance(password, str):
+                return False, self._failed(client)
+            digest = self._digest(password)
+            if self._verified is not None and hmac.compare_digest(digest, self._verified):
+                self._failures.pop(client, None)
+                return True, 0
+            # Counted as a failure before hashing, so concurrent attempts can't all pass the
+            # check above: at most max_failures hashes run for a client before its lockout
+            wait = self._failed(client)
+        if not check_password_hash(self._stored_hash(), password):
+            return False, wait
+        with self._lock:
+            self._failures.pop(client, None)
+            self._verified = digest
+        return True, 0
+
+    def _failed(self, client):
+        now = time.time()
+        with self._lock:
+            if len(self._failures) >= MAX_TRACKED:
+                self._failures = {key: value for key, value in self._failures.items() if value[1] > now}
+            count = self._failures.get(client, (0, 0))[0] + 1
+            wait = 0
+            if count >= self.max_failures:
+                wait = min(MAX_LOCKOUT, self.lockout * 2 ** (count - self.max_failures))
+            self._failures[client] = (count, now + wait)
+        return wait
+
+    def issue(self, now=None):
+        """A new token, valid for ``ttl`` seconds."""
+        expires = str(int((time.time() if now is None else now) + self.ttl))
+        return f'{expires}.{self._sign(expires)}'
+
+    def verify(self, token):
+        """Whether `token` was issued by ``issue`` (with the same key) and hasn't expired."""
+        if not isinstance(token, str):
+            return False
+        expires, _, signature = token.partition('.')
+        # isdigit() alone passes other scripts' digits, which int() reads but encode('ascii') can't
+        if not (expires.isascii() and expires.isdigit()) or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(signature.encode('utf-8'), self._sign(expires).encode('ascii'))
+
+    def _digest(self, password):
+        return hmac.new(self._key, b'password:' + password.encode('utf-8'), hashlib.sha256).digest()
+
+    def _sign(self, expires):
+        digest = hmac.new(self._key, expires.encode('ascii'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def get_auth():
+    return current_app.extensions['kiosk_queue_auth']
+
+
+def presented_token():
+    """The admin token of the current HTTP request (``Authorization: Bearer <token>``) or
+    Socket.IO event (a ``token`` field in its first argument)."""
+    event = getattr(request, 'event', None)
+    if event is not None:
+        args = event.get('args') or ()
+        return args[0].get('token') if args and isinstance(args[0], dict) else None
+    auth = request.authorization
+    if auth is not None and auth.type == 'bearer':
+        return auth.token
+    return None
+
+
+def admin_required(fn):
+    """Refuse an HTTP view or Socket.IO handler unless it comes with a valid admin token.
+
+    HTTP callers get a 401; Socket.IO clients get an ``admin_error`` event and the handler
+    doesn't run.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if get_auth().verify(presented_token()):
+            return fn(*args, **kwargs)
+        if getattr(request, 'event', None) is not None:
+            from flask_socketio import emit  # only reached from a Socket.IO handler
+            emit('admin_error', {'error': 'Invalid or expired token'})
+            return None
+        return jsonify({'error': 'Invalid or expired token'}), 401, {'WWW-Authenticate': 'Bearer realm="kiosk-queue"'}
+    return wrapper
+
+
+def create_auth(app):
+    """The app's AdminAuth, from ``KIOSK_QUEUE_ADMIN_PASSWORD_HASH`` if set, else ``ADMIN_PASSWORD``."""
+    return AdminAuth(
+        password=app.config.get('ADMIN_PASSWORD'),
+        password_hash=app.config['KIOSK_QUEUE_ADMIN_PASSWORD_HASH'],
+        secret_key=app.config.get('SECRET_KEY'),
+        ttl=app.config['KIOSK_QUEUE_ADMIN_TOKEN_TTL'],
+        max_failures=app.config['KIOSK_QUEUE_LOGIN_MAX_FAILURES'],
+        lockout=app.config['KIOSK_QUEUE_LOGIN_LOCKOUT'],
+    )
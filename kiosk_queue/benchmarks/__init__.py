@@ -0,0 +1,100 @@
+"""Benchmarks for kiosk_queue.
+
+Each module is runnable on its own, e.g. ``python -m kiosk_queue.benchmarks.connect``,
+and builds an in-process app against an in-memory SQLite DB unless told otherwise.
+"""
+import random
+import time
+from flask import Flask
+from flask_socketio import SocketIO
+from sqlalchemy import event
+from .. import KioskQueue
+from ..occupancy import OccupancyGrid
+from ..queue_logic import join_queue_logic, queue_settings, _get_queue
+
+
+def make_app(line_count=2, database_uri="sqlite://", async_mode=None, **config):
+    """Return ``(app, socketio)`` wired up the same way as ``main.py``."""
+    app = Flask("kiosk_queue_bench")
+    app.config.update(
+        SECRET_KEY="bench",
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        LINE_COUNT=line_count,
+        SLOT_TIME=5,
+        RESET_TIME=3,
+        ADMIN_PASSWORD="admin",
+        KIOSK_QUEUE_BROADCAST_DELAY=0,
+    )
+    app.config.update(config)
+    socketio = SocketIO(async_mode=async_mode)
+    KioskQueue().init_app(app, socketio=socketio)
+    socketio.init_app(app)
+    return app, socketio
+
+
+def seed_queue(app, parties, party_size=1, queue_id=None):
+    """Join `parties` parties of `party_size` through the real join path."""
+    with app.app_context():
+        for i in range(parties):
+            join_queue_logic(f"party {i}", None, party_size, None, False, queue_id=queue_id)
+
+
+def seed_layout(app, parties, seed=0, queue_id=None):
+    """Bulk-insert `parties` mixed-size parties in a first-fit layout.
+
+    Much faster than `seed_queue` for large queues; written straight to the store, and the
+    in-memory grid picks the change up through the version bump like any other writer's.
+    """
+    with app.app_context():
+        queue = _get_queue(queue_id)
+        line_count = queue_settings(queue)["line_count"]
+        rnd = random.Random(seed)
+        grid = OccupancyGrid(line_count)
+        rows = []
+        for i in range(parties):
+            party_size = min(line_count, rnd.choice((1, 1, 1, 2, 2, 3)))
+            line_number, depth = grid.find_position(party_size)
+            grid.place(i, line_number, party_size, depth)
+            rows.append({"name": f"party {i}", "email": None, "party_size": party_size, "line_number": line_number,
+                         "place_in_queue": depth, "email_consent": False})
+        store = app.extensions["kiosk_queue_store"]
+        store.begin_write(queue)
+        if rows:
+            store.add_parties(queue.id, rows)
+        store.commit()
+
+
+class QueryCounter:
+    """Counts SQL statements executed on the kiosk DB engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def timed(fn, repeat):
+    """Run `fn` `repeat` times; returns the per-call durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,142 @@
+"""Cost of the event archive: recording on the request path, and reading back a day's log.
+
+Drives the real ``queue_logic`` functions (in-memory store, so the store doesn't dominate)
+with the archive on and off until about `events` events are logged, then streams the log,
+replays it to the end and to the middle of the run, and checks both replays match the
+queue as it actually was at those times.
+
+    python -m kiosk_queue.benchmarks.archive [--events 50000] [--lines 4]
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from . import make_app
+from ..archive import EventArchive, read_events, replay
+from ..queue_logic import get_admin_queue_data, join_queue_logic, next_in_queue_logic, remove_from_queue_logic
+
+
+def _layout(parties, id_field="id"):
+    return sorted((p[id_field], p["line_number"], p["place_in_queue"]) for p in parties)
+
+
+def _workload(app, events, line_count, seed):
+    """Run joins/admits/removals until about `events` events are recorded (or, without an
+    archive, `events` operations). Returns (elapsed, ops, (time, layout) halfway, final layout)."""
+    rnd = random.Random(seed)
+    archive = app.extensions.get("kiosk_queue_archive")
+    recorded = [0]
+    if archive is not None:
+        record = archive.record
+
+        def counting_record(queue_id, ts, batch):
+            recorded[0] += len(batch)
+            record(queue_id, ts, batch)
+        archive.record = counting_record
+    ops = 0
+    checkpoint = None
+    elapsed = 0.0
+    with app.app_context():
+        while recorded[0] < events if archive is not None else ops < events:
+            start = time.perf_counter()
+            roll = rnd.random()
+            if roll < 0.55:
+                join_queue_logic(f"party {ops}", None, min(line_count, rnd.choice((1, 1, 1, 2, 2, 3))), None, False)
+            elif roll < 0.9:
+                next_in_queue_logic(rnd.randrange(line_count))
+            else:
+                grid = next(iter(app.extensions["kiosk_queue_grids"].values()))
+                if len(grid):
+                    remove_from_queue_logic(rnd.choice(list(grid._parties)))
+            elapsed += time.perf_counter() - start
+            ops += 1
+            if checkpoint is None and recorded[0] >= events // 2:
+                checkpoint = (time.time(), _layout(get_admin_queue_data()))
+        final = _layout(get_admin_queue_data())
+    return elapsed, ops, checkpoint, final
+
+
+def _measure(fn):
+    """(seconds, peak traced bytes, result) of fn(); timed on a separate, untraced run,
+    since tracemalloc slows allocation-heavy code several times over."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def record_cost(calls=100000):
+    """Microseconds per EventArchive.record call as seen by the caller (writer idle)."""
+    workdir = tempfile.mkdtemp()
+    try:
+        archive = EventArchive(workdir, flush_interval=3600)
+        event = [("admit", 1)]
+        start = time.perf_counter()
+        for i in range(calls):
+            archive.record(1, 1.0 + i, event)
+        elapsed = time.perf_counter() - start
+        archive.close()
+    finally:
+        shutil.rmtree(workdir)
+    return elapsed / calls * 1e6
+
+
+def run(events=50000, line_count=4, seed=0):
+    workdir = tempfile.mkdtemp()
+    try:
+        plain, _ = make_app(line_count=line_count, KIOSK_QUEUE_STORE="memory")
+        plain.extensions.pop("kiosk_queue_broadcaster")
+        app, _ = make_app(line_count=line_count, KIOSK_QUEUE_STORE="memory", KIOSK_QUEUE_ARCHIVE_PATH=workdir)
+        app.extensions.pop("kiosk_queue_broadcaster")
+
+        elapsed, ops, checkpoint, final = _workload(app, events, line_count, seed)
+        app.extensions["kiosk_queue_archive"].close()
+        base_elapsed, _, _, _ = _workload(plain, ops, line_count, seed)
+
+        read_s, read_peak, count = _measure(lambda: sum(1 for _ in read_events(workdir)))
+        end_s, end_peak, at_end = _measure(lambda: replay(workdir))
+        mid_s, mid_peak, at_mid = _measure(lambda: replay(workdir, at=checkpoint[0]))
+        ok = _layout(at_end[1].values(), "user_id") == final
+        ok = ok and _layout(at_mid[1].values(), "user_id") == checkpoint[1]
+        return {
+            "ops": ops,
+            "events": count,
+            "us_per_op_archive": elapsed / ops * 1e6,
+            "us_per_op_plain": base_elapsed / ops * 1e6,
+            "us_per_record": record_cost(),
+            "read_s": read_s,
+            "read_peak_kb": read_peak / 1024,
+            "replay_end_s": end_s,
+            "replay_end_peak_kb": end_peak / 1024,
+            "replay_mid_s": mid_s,
+            "replay_mid_peak_kb": mid_peak / 1024,
+        }, ok
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--lines", type=int, default=4)
+    args = parser.parse_args(argv)
+    result, ok = run(args.events, args.lines)
+    print(f"{result['ops']} operations logged {result['events']} events")
+    print(f"mutation: {result['us_per_op_plain']:.0f} us without archive, {result['us_per_op_archive']:.0f} us with")
+    print(f"record(): {result['us_per_record']:.2f} us per call")
+    print(f"stream all events: {result['read_s'] * 1000:.0f} ms, peak {result['read_peak_kb']:.0f} KiB")
+    print(f"replay to end:     {result['replay_end_s'] * 1000:.0f} ms, peak {result['replay_end_peak_kb']:.0f} KiB")
+    print(f"replay to middle:  {result['replay_mid_s'] * 1000:.0f} ms, peak {result['replay_mid_peak_kb']:.0f} KiB")
+    if not ok:
+        raise SystemExit("FAIL: replayed queue differs from the live one")
+    print("OK: replays match the live queue")
+
+
+if __name__ == "__main__":
+    main()
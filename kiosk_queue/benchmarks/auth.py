@@ -0,0 +1,96 @@
+"""Cost of admin authentication per request, per login, and to a password guesser.
+
+Measures, on an in-process app, how long checking an admin token takes (what every admin
+request and ``admin_connect`` pays) next to the old plaintext compare, how long a login
+takes (the salted scrypt hash, paid once per session), and how fast a refused request
+with a bad token is. Then sends wrong passwords from one client address until it is
+locked out, and works out from the lockout schedule how many guesses such a client gets
+in an hour and in a day.
+
+    python -m kiosk_queue.benchmarks.auth [--repeat 100000] [--logins 5]
+"""
+import argparse
+import hmac
+import time
+from ..auth import MAX_LOCKOUT
+from . import make_app, percentile, timed
+
+
+def guesses_allowed(max_failures, lockout, seconds, max_lockout):
+    """Wrong guesses a single client can make in `seconds` under the lockout schedule."""
+    guesses = max_failures
+    elapsed = 0.0
+    while True:
+        wait = min(max_lockout, lockout * 2 ** (guesses - max_failures))
+        if elapsed + wait > seconds:
+            return guesses
+        elapsed += wait
+        guesses += 1
+
+
+def run(repeat=100000, logins=5):
+    app, _ = make_app()
+    auth = app.extensions["kiosk_queue_auth"]
+    client = app.test_client()
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        auth.verify(token)
+    verify_us = (time.perf_counter() - start) / repeat * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hmac.compare_digest("admin", "admin")
+    plaintext_us = (time.perf_counter() - start) / repeat * 1e6
+
+    login = timed(lambda: client.post("/api/kiosk/admin/login", json={"password": "admin"}), logins)
+    good = {"Authorization": f"Bearer {token}"}
+    bad = {"Authorization": f"Bearer {token[:-4]}AAAA"}
+    admin_ok = timed(lambda: client.get("/api/kiosk/admin/queue", headers=good), 200)
+    admin_refused = timed(lambda: client.get("/api/kiosk/admin/queue", headers=bad), 200)
+
+    statuses = []
+    guess_times = []
+    while not statuses or statuses[-1] != 429:
+        start = time.perf_counter()
+        statuses.append(client.post("/api/kiosk/admin/login", json={"password": "wrong"}).status_code)
+        guess_times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    locked = client.post("/api/kiosk/admin/login", json={"password": "admin"})
+    locked_ms = (time.perf_counter() - start) * 1000
+    if locked.status_code != 429:
+        raise SystemExit("FAIL: a locked-out client could still log in")
+    if client.get("/api/kiosk/admin/queue", headers=bad).status_code != 401:
+        raise SystemExit("FAIL: a forged token was accepted")
+
+    return {
+        "verify_us": verify_us,
+        "plaintext_compare_us": plaintext_us,
+        "login_ms": percentile(login, 50) * 1000,
+        "admin_request_ms": percentile(admin_ok, 50) * 1000,
+        "refused_request_ms": percentile(admin_refused, 50) * 1000,
+        "guesses_before_lockout": statuses.index(429) + 1,
+        "guess_ms": percentile(guess_times, 50) * 1000,
+        "locked_out_request_ms": locked_ms,
+        "guesses_per_hour": guesses_allowed(auth.max_failures, auth.lockout, 3600, MAX_LOCKOUT),
+        "guesses_per_day": guesses_allowed(auth.max_failures, auth.lockout, 86400, MAX_LOCKOUT),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100000, help="token checks to time")
+    parser.add_argument("--logins", type=int, default=5, help="logins to time")
+    args = parser.parse_args(argv)
+    r = run(args.repeat, args.logins)
+    print(f"token check:        {r['verify_us']:8.2f} us  (plaintext compare {r['plaintext_compare_us']:.2f} us)")
+    print(f"admin request:      {r['admin_request_ms']:8.2f} ms  with a valid token, "
+          f"{r['refused_request_ms']:.2f} ms refused")
+    print(f"login:              {r['login_ms']:8.2f} ms  (salted scrypt, once per session)")
+    print(f"wrong guess:        {r['guess_ms']:8.2f} ms  each; locked out after {r['guesses_before_lockout']}, "
+          f"then refused in {r['locked_out_request_ms']:.2f} ms without hashing")
+    print(f"guesses per client: {r['guesses_per_hour']} in an hour, {r['guesses_per_day']} in a day")
+
+
+if __name__ == "__main__":
+    main()
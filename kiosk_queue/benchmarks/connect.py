@@ -0,0 +1,50 @@
+"""Cost of a new /queue connection as the number of already-connected clients grows.
+
+The new client should receive a cached snapshot to its own sid only, so the cost stays
+flat; before the snapshot cache every connect recomputed the queue and pushed it to
+every existing client.
+
+    python -m kiosk_queue.benchmarks.connect [--parties 200] [--repeat 20]
+"""
+import argparse
+from . import make_app, seed_queue, timed, percentile
+
+CLIENT_COUNTS = (0, 10, 100, 500)
+
+
+def run(parties=200, repeat=20, client_counts=CLIENT_COUNTS):
+    app, socketio = make_app()
+    seed_queue(app, parties)
+    clients = []
+    results = []
+    for count in client_counts:
+        while len(clients) < count:
+            clients.append(socketio.test_client(app, namespace="/queue"))
+
+        def connect_one():
+            client = socketio.test_client(app, namespace="/queue")
+            client.disconnect(namespace="/queue")
+
+        durations = timed(connect_one, repeat)
+        results.append({
+            "connected_clients": count,
+            "p50_ms": percentile(durations, 50) * 1000,
+            "p99_ms": percentile(durations, 99) * 1000,
+        })
+    for client in clients:
+        client.disconnect(namespace="/queue")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    print(f"{'clients':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in run(args.parties, args.repeat):
+        print(f"{row['connected_clients']:>8} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Per-endpoint latency and SQL query counts at different queue sizes.
+
+Runs every HTTP endpoint against a temporary SQLite file seeded with 10, 1k and 10k
+queued parties, recording query count per call alongside p50/p99 latency. Mutating
+calls include the (synchronous, KIOSK_QUEUE_BROADCAST_DELAY=0) broadcast they trigger.
+
+    python -m kiosk_queue.benchmarks.endpoints [--sizes 10 1000 10000] [--repeat 20]
+"""
+import argparse
+import os
+import tempfile
+from ..db import db
+from ..models import User
+from . import make_app, seed_layout, timed, percentile, QueryCounter
+
+SIZES = (10, 1000, 10000)
+
+
+def _endpoints(client, app):
+    line_count = app.config["LINE_COUNT"]
+    calls = {"n": 0}
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    admin = {"Authorization": f"Bearer {token}"}
+
+    def next_line():
+        calls["n"] += 1
+        return calls["n"] % line_count
+
+    def newest_user_id():
+        with app.app_context():
+            return db.session.query(db.func.max(User.id)).scalar()
+
+    return {
+        "GET /queue": lambda: client.get("/api/kiosk/queue"),
+        "POST /admin/queue": lambda: client.post("/api/kiosk/admin/queue", headers=admin),
+        "POST /join": lambda: client.post("/api/kiosk/join", json={"name": "bench", "party_size": 1}),
+        "POST /admin/next": lambda: client.post("/api/kiosk/admin/next", json={"line_number": next_line()}, headers=admin),
+        "POST /admin/remove": lambda: client.post("/api/kiosk/admin/remove", json={"user_id": newest_user_id()}, headers=admin),
+    }
+
+
+def run(sizes=SIZES, repeat=20, line_count=4):
+    results = []
+    for size in sizes:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            app, _ = make_app(line_count=line_count, database_uri=f"sqlite:///{path}")
+            seed_layout(app, size)
+            client = app.test_client()
+            with app.app_context():
+                engine = db.engine
+            for name, call in _endpoints(client, app).items():
+                with QueryCounter(engine) as counter:
+                    durations = timed(call, repeat)
+                results.append({
+                    "parties": size,
+                    "endpoint": name,
+                    "queries_per_call": counter.count / repeat,
+                    "p50_ms": percentile(durations, 50) * 1000,
+                    "p99_ms": percentile(durations, 99) * 1000,
+                })
+            with app.app_context():
+                db.engine.dispose()
+        finally:
+            os.remove(path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    print(f"{'parties':>8} {'endpoint':<20} {'queries':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in run(args.sizes, args.repeat):
+        print(f"{row['parties']:>8} {row['endpoint']:<20} {row['queries_per_call']:>8.1f} "
+              f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
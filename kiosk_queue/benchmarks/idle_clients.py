@@ -0,0 +1,161 @@
+"""p99 join latency against a real server while many idle websocket clients stay connected.
+
+The server runs in its own process (``socketio.run``, so eventlet if it is installed and
+selected); the parent opens the idle Socket.IO connections over real websockets, then
+times sequential ``POST /join`` requests. Every join fans a queue_delta out to all of
+them. With DB work on the bounded pool, the event loop keeps serving sockets while a
+commit runs, so join latency should barely move as clients are added.
+
+    python -m kiosk_queue.benchmarks.idle_clients [--clients 1000] [--joins 200] [--async-mode eventlet]
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+import simple_websocket
+from . import make_app, percentile
+
+
+def _serve(database_uri, port, async_mode, db_workers):
+    if async_mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    app, socketio = make_app(
+        line_count=4,
+        database_uri=database_uri,
+        async_mode=async_mode,
+        KIOSK_QUEUE_BROADCAST_DELAY=0.05,
+        KIOSK_QUEUE_DB_WORKERS=db_workers,
+    )
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    socketio.run(app, host="127.0.0.1", port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/kiosk/queues")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+class _DaemonThread(threading.Thread):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, daemon=True, **kwargs)
+
+
+class IdleClient:
+    """A Socket.IO client on /queue that only answers the server's pings."""
+
+    def __init__(self, port):
+        self.ws = simple_websocket.Client(f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket",
+                                           thread_class=_DaemonThread)
+        # Engine.IO accepts packets straight away; its open packet is read by drain()
+        self.ws.send("40/queue,")
+        self.received = 0
+
+    def drain(self):
+        while True:
+            packet = self.ws.receive(timeout=0)
+            if packet is None:
+                return
+            if packet == "2":
+                self.ws.send("3")
+            else:
+                self.received += 1
+
+    def close(self):
+        self.ws.close()
+
+
+def _keep_alive(clients, stop):
+    while not stop.is_set():
+        for client in clients:
+            client.drain()
+        stop.wait(0.5)
+
+
+def _time_joins(port, joins):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    durations = []
+    for i in range(joins):
+        body = json.dumps({"name": f"bench {i}", "party_size": 1 + i % 3})
+        start = time.perf_counter()
+        conn.request("POST", "/api/kiosk/join", body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        durations.append(time.perf_counter() - start)
+        if response.status != 201:
+            raise RuntimeError(f"join failed: {response.status}")
+    conn.close()
+    return durations
+
+
+def run(clients=1000, joins=200, async_mode=None, db_workers=4):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    port = _free_port()
+    ctx = multiprocessing.get_context("spawn")
+    server = ctx.Process(target=_serve, args=(f"sqlite:///{path}", port, async_mode, db_workers), daemon=True)
+    server.start()
+    results = []
+    idle = []
+    stop = threading.Event()
+    pinger = threading.Thread(target=_keep_alive, args=(idle, stop), daemon=True)
+    try:
+        _wait_until_up(port)
+        for count in sorted({0, clients}):
+            while len(idle) < count:
+                idle.append(IdleClient(port))
+            if not pinger.is_alive() and idle:
+                pinger.start()
+            durations = _time_joins(port, joins)
+            results.append({
+                "idle_clients": count,
+                "joins": joins,
+                "p50_ms": percentile(durations, 50) * 1000,
+                "p99_ms": percentile(durations, 99) * 1000,
+            })
+    finally:
+        stop.set()
+        if pinger.is_alive():
+            pinger.join()
+        for client in idle:
+            client.close()
+        server.terminate()
+        server.join()
+        os.remove(path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--joins", type=int, default=200)
+    parser.add_argument("--async-mode", default=None, help="threading, eventlet or gevent (default: auto)")
+    parser.add_argument("--db-workers", type=int, default=4, help="KIOSK_QUEUE_DB_WORKERS (0 = inline)")
+    args = parser.parse_args(argv)
+    print(f"{'idle clients':>12} {'joins':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in run(args.clients, args.joins, args.async_mode, args.db_workers):
+        print(f"{row['idle_clients']:>12} {row['joins']:>6} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
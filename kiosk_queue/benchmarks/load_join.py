@@ -0,0 +1,96 @@
+"""Multi-worker load test: N processes hammer POST /join on one shared SQLite file.
+
+Each worker is a separate process with its own app, in-memory occupancy grid and DB
+connection, like gunicorn workers. Afterwards the layout is checked for overlapping
+(line, depth) cells, which racing placements would produce.
+
+    python -m kiosk_queue.benchmarks.load_join [--workers 4] [--joins 100] [--lines 4]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from . import make_app, percentile
+
+
+def _worker(database_uri, line_count, joins, seed, results):
+    app, _ = make_app(
+        line_count=line_count,
+        database_uri=database_uri,
+        # Wait on the SQLite write lock instead of failing fast; retries cover the rest
+        SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"timeout": 30}},
+    )
+    client = app.test_client()
+    rnd = random.Random(seed)
+    durations = []
+    failures = 0
+    for i in range(joins):
+        party_size = min(line_count, rnd.choice((1, 1, 1, 2, 2, 3)))
+        start = time.perf_counter()
+        response = client.post("/api/kiosk/join", json={"name": f"w{seed}-{i}", "party_size": party_size})
+        durations.append(time.perf_counter() - start)
+        if response.status_code != 201:
+            failures += 1
+    results.put((durations, failures))
+
+
+def find_overlaps(app):
+    """Return the (line, depth) cells claimed by more than one party."""
+    from ..models import User
+    with app.app_context():
+        owners = {}
+        for user in User.query.all():
+            for ln in range(user.line_number, user.line_number + user.party_size):
+                owners.setdefault((user.queue_id, ln, user.place_in_queue), []).append(user.id)
+    return {cell: ids for cell, ids in owners.items() if len(ids) > 1}
+
+
+def run(workers=4, joins=100, line_count=4):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    database_uri = f"sqlite:///{path}"
+    try:
+        app, _ = make_app(line_count=line_count, database_uri=database_uri)  # creates the schema
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(database_uri, line_count, joins, seed, results))
+                 for seed in range(workers)]
+        start = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        outcomes = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - start
+        durations = [d for worker_durations, _ in outcomes for d in worker_durations]
+        return {
+            "workers": workers,
+            "joins": len(durations),
+            "failures": sum(f for _, f in outcomes),
+            "joins_per_s": len(durations) / elapsed,
+            "p50_ms": percentile(durations, 50) * 1000,
+            "p99_ms": percentile(durations, 99) * 1000,
+            "overlaps": find_overlaps(app),
+        }
+    finally:
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--joins", type=int, default=100, help="joins per worker")
+    parser.add_argument("--lines", type=int, default=4)
+    args = parser.parse_args(argv)
+    result = run(args.workers, args.joins, args.lines)
+    print(f"{result['workers']} workers, {result['joins']} joins ({result['failures']} failed), "
+          f"{result['joins_per_s']:.0f} joins/s, p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+    if result["overlaps"]:
+        raise SystemExit(f"FAIL: {len(result['overlaps'])} overlapping cells: {result['overlaps']}")
+    print("OK: no overlapping cells")
+
+
+if __name__ == "__main__":
+    main()
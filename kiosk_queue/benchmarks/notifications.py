@@ -0,0 +1,119 @@
+"""Queue throughput with "you're up soon" messages on, against provider latency.
+
+Joins ``--parties`` parties (most with an address and consent) and then admits them all
+through the real ``queue_logic`` functions, against a temporary SQLite file, once without
+notifications and once per ``--latency`` (milliseconds a MemoryTransport sleeps per send,
+like a provider round trip). ``--fail`` makes that share of sends fail, to exercise retries.
+
+Reports, per run, admit latency percentiles and throughput (which should not depend on
+the provider's latency: admits only add outbox rows), then how long the dispatcher took to
+deliver everything after the last admit, and its sends and retries. Every consenting party
+must get exactly one message.
+
+    python -m kiosk_queue.benchmarks.notifications [--parties 2000] [--lines 4] [--latency 0 200] [--fail 0.1]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from ..db import db
+from . import make_app, percentile
+from ..notifications import MemoryTransport
+from ..queue_logic import join_queue_logic, next_in_queue_logic
+
+
+def run_one(latency_ms, parties, line_count, within, fail, seed=0):
+    """One run; `latency_ms` None runs without notifications."""
+    rnd = random.Random(seed)
+    fail_rnd = random.Random(seed + 1)
+    transport = None
+    config = {}
+    if latency_ms is not None:
+        transport = MemoryTransport(latency=latency_ms / 1000,
+                                    fail=(lambda message: "provider error" if fail_rnd.random() < fail else None))
+        config = dict(KIOSK_QUEUE_NOTIFY_TRANSPORT=transport, KIOSK_QUEUE_NOTIFY_WITHIN=within,
+                      KIOSK_QUEUE_NOTIFY_BACKOFF=0.05)
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        app, _ = make_app(line_count=line_count, database_uri=f"sqlite:///{path}", **config)
+        app.extensions.pop("kiosk_queue_broadcaster")
+        notifier = app.extensions.get("kiosk_queue_notifier")
+        consenting = set()
+        latencies = []
+        with app.app_context():
+            for i in range(parties):
+                consent = rnd.random() < 0.8
+                if consent:
+                    consenting.add(f"party{i}@example.com")
+                join_queue_logic(f"party {i}", f"party{i}@example.com", 1, None, consent)
+            for i in range(parties):
+                start = time.perf_counter()
+                next_in_queue_logic(i % line_count)
+                latencies.append(time.perf_counter() - start)
+            last_admit = time.perf_counter()
+            drained = None
+            if transport is not None:
+                deadline = last_admit + 120
+                while len(transport.sent) < len(consenting) and time.perf_counter() < deadline:
+                    time.sleep(0.005)
+                drained = time.perf_counter() - last_admit
+                notifier.close()
+            db.engine.dispose()
+    finally:
+        os.remove(path)
+
+    row = {
+        "latency_ms": latency_ms,
+        "admits": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "ops_per_s": len(latencies) / sum(latencies),
+    }
+    if transport is not None:
+        addresses = [message["address"] for message in transport.sent]
+        row.update(
+            expected=len(consenting),
+            delivered=len(addresses),
+            duplicates=len(addresses) - len(set(addresses)),
+            missing=len(consenting - set(addresses)),
+            drain_s=drained,
+            sends=transport.calls,
+            retried=notifier.retried,
+            failed=notifier.failed,
+        )
+    return row
+
+
+def run(parties=2000, line_count=4, latencies=(0, 200), within=3, fail=0.0, seed=0):
+    return [run_one(None, parties, line_count, within, fail, seed)] + [
+        run_one(latency, parties, line_count, within, fail, seed) for latency in latencies]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=4)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0, 200], help="provider latency per send, ms")
+    parser.add_argument("--within", type=int, default=3, help="slots from the front at which parties are messaged")
+    parser.add_argument("--fail", type=float, default=0.0, help="share of sends that fail and are retried")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    results = run(args.parties, args.lines, args.latency, args.within, args.fail, args.seed)
+    print(f"{'provider':<10} {'admits':>7} {'p50 ms':>8} {'p95 ms':>8} {'admits/s':>9} {'delivered':>10} "
+          f"{'drain s':>8} {'sends':>6} {'retried':>8}")
+    for row in results:
+        label = "off" if row["latency_ms"] is None else f"{row['latency_ms']:g} ms"
+        line = f"{label:<10} {row['admits']:>7} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['ops_per_s']:>9.0f}"
+        if "delivered" in row:
+            line += (f" {row['delivered']:>4}/{row['expected']:<5} {row['drain_s']:>8.2f} {row['sends']:>6} "
+                     f"{row['retried']:>8}")
+        print(line)
+    bad = [row for row in results if row.get("missing") or row.get("duplicates") or row.get("failed")]
+    if bad:
+        raise SystemExit(f"FAIL: messages missing, duplicated or given up on: {bad}")
+
+
+if __name__ == "__main__":
+    main()
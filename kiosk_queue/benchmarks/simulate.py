@@ -0,0 +1,233 @@
+"""Discrete-event load simulation of an operating day, with machine-readable results.
+
+Plays a day at the attraction on a simulated clock and drives the real ``queue_logic``
+functions (join, next, remove) against an in-process app and a temporary SQLite file:
+
+* parties arrive as a Poisson process whose rate rises from opening to a midday peak
+  (``--peak`` times the opening rate) and falls again, with the party-size mix below;
+* a share of them (``--cancel``) give up after an exponentially distributed patience
+  and are removed if they are still queued;
+* each line's operator presses "next" once per ride, every slot time or so (lognormal),
+  and checks back every ``--poll`` seconds while the line is empty.
+
+Only the logic calls are timed (the broadcaster is detached). Reports, per operation,
+throughput, latency percentiles and SQL queries per call; and for the simulated day,
+visitor waits and the queue's shape (parties, deepest slot, empty slots above the back
+of each line). The run is deterministic for a seed, so the simulated figures only change
+when queue behaviour does.
+
+``--output`` writes the scenario and results as JSON; ``--compare`` checks a run against
+such a file and fails if any operation's p95 latency or query count regressed by more
+than ``--tolerance``.
+
+    python -m kiosk_queue.benchmarks.simulate [--parties 2000] [--hours 12] [--lines 8] [--slot 2]
+        [--output results.json] [--compare baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+from ..db import db
+from ..queue_logic import _get_queue, join_queue_logic, next_in_queue_logic, remove_from_queue_logic
+from . import make_app, percentile, QueryCounter
+from .placement import SIZE_MIX
+
+OPERATIONS = ("join", "next", "remove")
+
+
+def arrivals(parties, hours, peak, rnd):
+    """Sorted arrival times (seconds) of `parties` parties over the day, drawn by rejection
+    from a rate that goes from 1 at opening to `peak` at midday and back."""
+    day = hours * 3600
+    times = []
+    while len(times) < parties:
+        t = rnd.uniform(0, day)
+        if rnd.uniform(0, peak) <= 1 + (peak - 1) * math.sin(math.pi * t / day) ** 2:
+            times.append(t)
+    times.sort()
+    return times
+
+
+def simulate(parties=2000, hours=12, peak=3.0, line_count=8, slot_minutes=2, cancel=0.15, patience=30,
+             poll=30, sample_minutes=5, seed=0, database_uri=None):
+    rnd = random.Random(seed)
+    path = None
+    if database_uri is None:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        database_uri = f"sqlite:///{path}"
+    try:
+        app, _ = make_app(line_count=line_count, database_uri=database_uri, SLOT_TIME=slot_minutes)
+        app.extensions.pop("kiosk_queue_broadcaster")
+        slot = slot_minutes * 60
+        # (sim time, tie-break, kind, argument)
+        events = [(t, i, "join", min(line_count, rnd.choice(SIZE_MIX))) for i, t in enumerate(arrivals(parties, hours, peak, rnd))]
+        events += [(rnd.uniform(0, slot), parties + ln, "next", ln) for ln in range(line_count)]
+        events += [(t * 60, -1 - i, "sample", None) for i, t in enumerate(range(0, hours * 60 + 1, sample_minutes))]
+        heapq.heapify(events)
+        seq = parties + line_count
+        latencies = {kind: [] for kind in OPERATIONS}
+        queries = dict.fromkeys(OPERATIONS, 0)
+        joined = {}  # user id -> sim join time
+        waits = []
+        shape = []
+        cancelled = 0
+        day = hours * 3600
+        with app.app_context():
+            engine = db.engine
+            grid = None
+            started = time.perf_counter()
+            with QueryCounter(engine) as counter:
+                while events:
+                    now, _, kind, arg = heapq.heappop(events)
+                    if kind == "next" and now > day and not joined:
+                        continue  # closing time and nobody left to admit
+                    if kind == "sample":
+                        if grid is not None:
+                            lines = grid.shape()
+                            shape.append((len(grid), sum(grid.party(uid)[1] for uid in joined),
+                                          max(depth for depth, _ in lines), sum(holes for _, holes in lines)))
+                        continue
+                    if kind == "next":
+                        head = grid.head(arg) if grid is not None else None
+                        if head is None:
+                            seq += 1
+                            heapq.heappush(events, (now + poll, seq, "next", arg))
+                            continue
+                    elif kind == "remove" and arg not in joined:
+                        continue  # admitted before giving up
+                    before = counter.count
+                    start = time.perf_counter()
+                    if kind == "join":
+                        result, _ = join_queue_logic(f"party {seq}", None, arg, None, False)
+                    elif kind == "next":
+                        next_in_queue_logic(arg)
+                    else:
+                        remove_from_queue_logic(arg)
+                    latencies[kind].append(time.perf_counter() - start)
+                    queries[kind] += counter.count - before
+                    if grid is None:
+                        grid = app.extensions["kiosk_queue_grids"][_get_queue().id]
+                    seq += 1
+                    if kind == "join":
+                        user_id = grid.at(result["line_number"], result["place_in_queue"])
+                        joined[user_id] = now
+                        if rnd.random() < cancel:
+                            heapq.heappush(events, (now + rnd.expovariate(1 / (patience * 60)), seq, "remove", user_id))
+                    elif kind == "next":
+                        waits.append((now - joined.pop(head)) / 60)
+                        heapq.heappush(events, (now + rnd.lognormvariate(math.log(slot), 0.25), seq, "next", arg))
+                    else:
+                        del joined[arg]
+                        cancelled += 1
+            elapsed = time.perf_counter() - started
+            engine.dispose()
+    finally:
+        if path is not None:
+            os.remove(path)
+
+    ops = sum(len(durations) for durations in latencies.values())
+    return {
+        "operations": {
+            kind: {
+                "calls": len(durations),
+                "p50_ms": percentile(durations, 50) * 1000,
+                "p95_ms": percentile(durations, 95) * 1000,
+                "p99_ms": percentile(durations, 99) * 1000,
+                "max_ms": max(durations, default=0.0) * 1000,
+                "queries_per_call": queries[kind] / len(durations) if durations else 0.0,
+            }
+            for kind, durations in latencies.items()
+        },
+        "ops_per_s": ops / sum(sum(durations) for durations in latencies.values()),
+        "wall_s": elapsed,
+        "admitted": len(waits),
+        "cancelled": cancelled,
+        "wait_mean_min": sum(waits) / len(waits) if waits else 0.0,
+        "wait_p50_min": percentile(waits, 50),
+        "wait_p90_min": percentile(waits, 90),
+        "queue_parties_max": max((s[0] for s in shape), default=0),
+        "queue_people_max": max((s[1] for s in shape), default=0),
+        "queue_depth_max": max((s[2] for s in shape), default=0),
+        "queue_holes_mean": sum(s[3] for s in shape) / len(shape) if shape else 0.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against a `baseline` results dict, as messages."""
+    failures = []
+    for kind, row in results["operations"].items():
+        base = baseline["operations"].get(kind)
+        if not base or not row["calls"]:
+            continue
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{kind}: p95 {base['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+        if row["queries_per_call"] > base["queries_per_call"] * (1 + tolerance):
+            failures.append(f"{kind}: {base['queries_per_call']:.2f} -> {row['queries_per_call']:.2f} queries per call")
+    return failures
+
+
+def _delta(value, base):
+    return f"{(value - base) / base:+.0%}" if base else ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=2000, help="parties arriving over the day")
+    parser.add_argument("--hours", type=int, default=12)
+    parser.add_argument("--peak", type=float, default=3.0, help="midday arrival rate relative to opening")
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--slot", type=int, default=2, help="minutes per ride")
+    parser.add_argument("--cancel", type=float, default=0.15, help="share of parties that give up if kept waiting")
+    parser.add_argument("--patience", type=float, default=30, help="mean minutes before such a party gives up")
+    parser.add_argument("--poll", type=int, default=30, help="seconds between an operator's checks of an empty line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-uri", help="run against this database instead of a temporary SQLite file")
+    parser.add_argument("--output", help="write the scenario and results to this JSON file")
+    parser.add_argument("--compare", help="results JSON of a previous run to check this one against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/query regression against --compare")
+    args = parser.parse_args(argv)
+    scenario = {"parties": args.parties, "hours": args.hours, "peak": args.peak, "lines": args.lines,
+                "slot_minutes": args.slot, "cancel": args.cancel, "patience_minutes": args.patience,
+                "poll_seconds": args.poll, "seed": args.seed}
+    results = simulate(args.parties, args.hours, args.peak, args.lines, args.slot, args.cancel, args.patience,
+                       args.poll, seed=args.seed, database_uri=args.database_uri)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["scenario"] != scenario:
+            print(f"warning: baseline scenario differs: {baseline['scenario']}")
+        baseline = baseline["results"]
+
+    print(f"{'operation':<10} {'calls':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'queries':>8}"
+          + (f" {'p95 vs base':>12}" if baseline else ""))
+    for kind, row in results["operations"].items():
+        line = (f"{kind:<10} {row['calls']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                f"{row['max_ms']:>8.2f} {row['queries_per_call']:>8.2f}")
+        if baseline and kind in baseline["operations"]:
+            line += f" {_delta(row['p95_ms'], baseline['operations'][kind]['p95_ms']):>12}"
+        print(line)
+    print(f"throughput: {results['ops_per_s']:.0f} ops/s in queue logic, {results['wall_s']:.1f} s wall")
+    print(f"visitors: {results['admitted']} admitted, {results['cancelled']} gave up; wait mean "
+          f"{results['wait_mean_min']:.1f} min, p50 {results['wait_p50_min']:.0f}, p90 {results['wait_p90_min']:.0f}")
+    print(f"queue: up to {results['queue_parties_max']} parties / {results['queue_people_max']} people, "
+          f"{results['queue_depth_max']} slots deep, {results['queue_holes_mean']:.1f} empty slots on average")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenario": scenario, "python": platform.python_version(), "results": results}, f, indent=2)
+    if baseline:
+        failures = compare(results, baseline, args.tolerance)
+        if failures:
+            raise SystemExit("FAIL: " + "; ".join(failures))
+        print(f"OK: no operation regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Cold-start cost: import time, app setup and time to first request, in fresh interpreters.
+
+Each sample runs in a new Python process, as a kiosk boot or a serverless restart does, and
+records how long ``import kiosk_queue`` takes, how long ``init_app`` takes and how many SQL
+statements it runs, and how long the first ``GET /queue`` takes after that. Samples are
+taken against a new SQLite file (the schema has to be created) and against one a previous
+process already set up, with and without a Socket.IO server, in the default (eager) and
+the lazy (``KIOSK_QUEUE_LAZY_INIT``) mode. Medians over ``--runs`` processes are reported.
+
+    python -m kiosk_queue.benchmarks.startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from . import percentile
+
+# Runs in the child process; prints one JSON line of timings
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import kiosk_queue
+imported = time.perf_counter()
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = [0]
+event.listen(Engine, "before_cursor_execute", lambda *args: statements.__setitem__(0, statements[0] + 1))
+database_uri, lazy, with_socketio = sys.argv[1], sys.argv[2] == "1", sys.argv[3] == "1"
+app = Flask("kiosk_queue_startup")
+app.config.update(SECRET_KEY="bench", SQLALCHEMY_DATABASE_URI=database_uri, LINE_COUNT=4, SLOT_TIME=5,
+                  RESET_TIME=3, ADMIN_PASSWORD="admin", KIOSK_QUEUE_LAZY_INIT=lazy)
+socketio = None
+if with_socketio:
+    from flask_socketio import SocketIO
+    socketio = SocketIO()
+kiosk_queue.KioskQueue().init_app(app, socketio=socketio)
+if socketio is not None:
+    socketio.init_app(app)
+initialized = time.perf_counter()
+init_statements = statements[0]
+status = app.test_client().get("/api/kiosk/queue").status_code
+answered = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "init_ms": (initialized - imported) * 1000,
+                  "first_request_ms": (answered - initialized) * 1000, "total_ms": (answered - started) * 1000,
+                  "init_statements": init_statements, "status": status, "modules": len(sys.modules)}))
+"""
+
+FIELDS = ("import_ms", "init_ms", "first_request_ms", "total_ms", "init_statements", "modules")
+
+
+def sample(database_uri, lazy, with_socketio):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run([sys.executable, "-c", CHILD, database_uri, "1" if lazy else "0", "1" if with_socketio else "0"],
+                         check=True, capture_output=True, text=True, env=env).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    if result["status"] != 200:
+        raise SystemExit(f"FAIL: first request returned {result['status']}")
+    return result
+
+
+def run(runs=5):
+    results = []
+    for lazy in (False, True):
+        for with_socketio in (False, True):
+            for database in ("new", "existing"):
+                samples = []
+                for _ in range(runs):
+                    fd, path = tempfile.mkstemp(suffix=".db")
+                    os.close(fd)
+                    os.remove(path)
+                    try:
+                        uri = f"sqlite:///{path}"
+                        if database == "existing":
+                            sample(uri, lazy, with_socketio)
+                        samples.append(sample(uri, lazy, with_socketio))
+                    finally:
+                        if os.path.exists(path):
+                            os.remove(path)
+                row = {"mode": "lazy" if lazy else "eager", "socketio": with_socketio, "database": database}
+                row.update({field: percentile([s[field] for s in samples], 50) for field in FIELDS})
+                results.append(row)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="processes per configuration")
+    args = parser.parse_args(argv)
+    print(f"{'mode':<6} {'socketio':<9} {'database':<9} {'import ms':>10} {'init ms':>8} {'init SQL':>9} "
+          f"{'1st req ms':>11} {'total ms':>9} {'modules':>8}")
+    for row in run(args.runs):
+        print(f"{row['mode']:<6} {'yes' if row['socketio'] else 'no':<9} {row['database']:<9} {row['import_ms']:>10.1f} "
+              f"{row['init_ms']:>8.1f} {row['init_statements']:>9.0f} {row['first_request_ms']:>11.1f} "
+              f"{row['total_ms']:>9.1f} {row['modules']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Throughput of the queue stores: SQLAlchemy on a SQLite file vs the in-memory store.
+
+Runs the same seeded mix of joins, admits and removals through the real ``queue_logic``
+functions on each backend, then checks every backend ended with the same queue
+(matched by party name, since the stores number parties differently).
+
+    python -m kiosk_queue.benchmarks.stores [--ops 2000] [--lines 4]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from . import make_app
+from ..queue_logic import (
+    get_admin_queue_data,
+    join_queue_logic,
+    next_in_queue_logic,
+    remove_from_queue_logic,
+)
+
+BACKENDS = {
+    "sqlalchemy (sqlite file)": {"KIOSK_QUEUE_STORE": "sqlalchemy"},
+    "memory, log": {"KIOSK_QUEUE_STORE": "memory"},
+    "memory, log + fsync": {"KIOSK_QUEUE_STORE": "memory", "KIOSK_QUEUE_STORE_FSYNC": True},
+}
+
+
+def _workload(app, ops, line_count, seed):
+    rnd = random.Random(seed)
+    queued = []  # names, so removals pick the same party on every backend
+    with app.app_context():
+        start = time.perf_counter()
+        for i in range(ops):
+            roll = rnd.random()
+            if roll < 0.6 or not queued:
+                name = f"party {i}"
+                join_queue_logic(name, None, min(line_count, rnd.choice((1, 1, 1, 2, 2, 3))), None, False)
+                queued.append(name)
+            elif roll < 0.9:
+                next_in_queue_logic(rnd.randrange(line_count))
+            else:
+                name = queued.pop(rnd.randrange(len(queued)))
+                by_name = {party["name"]: party["id"] for party in get_admin_queue_data()}
+                if name in by_name:
+                    remove_from_queue_logic(by_name[name])
+        elapsed = time.perf_counter() - start
+        layout = sorted((p["name"], p["line_number"], p["place_in_queue"]) for p in get_admin_queue_data())
+    return elapsed, layout
+
+
+def run(ops=2000, line_count=4, seed=0):
+    results = []
+    layouts = []
+    for label, config in BACKENDS.items():
+        workdir = tempfile.mkdtemp()
+        try:
+            app, _ = make_app(
+                line_count=line_count,
+                database_uri=f"sqlite:///{os.path.join(workdir, 'kiosk.db')}",
+                KIOSK_QUEUE_STORE_PATH=os.path.join(workdir, "store"),
+                **config,
+            )
+            # Measure the store, not the Socket.IO fan-out every mutation would trigger
+            app.extensions.pop("kiosk_queue_broadcaster")
+            elapsed, layout = _workload(app, ops, line_count, seed)
+            app.extensions["kiosk_queue_store"].close()
+        finally:
+            shutil.rmtree(workdir)
+        layouts.append(layout)
+        results.append({"backend": label, "ops": ops, "ops_per_s": ops / elapsed, "us_per_op": elapsed / ops * 1e6})
+    return results, all(layout == layouts[0] for layout in layouts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=4)
+    args = parser.parse_args(argv)
+    results, same = run(args.ops, args.lines)
+    print(f"{'backend':<26} {'ops/s':>9} {'us/op':>9}")
+    for row in results:
+        print(f"{row['backend']:<26} {row['ops_per_s']:>9.0f} {row['us_per_op']:>9.0f}")
+    if not same:
+        raise SystemExit("FAIL: backends ended with different queues")
+    print("OK: all backends ended with the same queue")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Micro-benchmark of the wait-time estimator over line counts and queue depths.
+
+Measures ``OccupancyGrid.wait_projection`` right after a queue change (recomputed) and
+between changes (cached), which is what ``_compute_wait_times`` reads on every broadcast.
+
+    python -m kiosk_queue.benchmarks.wait_times [--repeat 200]
+"""
+import argparse
+import random
+from ..occupancy import OccupancyGrid
+from . import timed, percentile
+
+LINE_COUNTS = (2, 4, 8, 12)
+DEPTHS = (10, 100, 1000)
+SLOT_SECONDS = 8 * 60
+
+
+def build_grid(line_count, depth, seed=0):
+    """Fill a grid with a mixed-size party layout about `depth` rows deep."""
+    rnd = random.Random(seed)
+    grid = OccupancyGrid(line_count)
+    grid.rebuild([], 0, {ln: 0 for ln in range(line_count)})
+    user_id = 0
+    while max(grid.first_free(ln) for ln in range(line_count)) <= depth:
+        party_size = min(line_count, rnd.choice((1, 1, 1, 2, 2, 3)))
+        line_number, place = grid.find_position(party_size)
+        user_id += 1
+        grid.place(user_id, line_number, party_size, place)
+    return grid, user_id
+
+
+def run(repeat=200, line_counts=LINE_COUNTS, depths=DEPTHS):
+    results = []
+    for line_count in line_counts:
+        for depth in depths:
+            grid, last_id = build_grid(line_count, depth)
+            entry = grid.party(last_id)
+            service = [SLOT_SECONDS] * line_count
+
+            def after_change():
+                # Release and re-place the same party: a realistic mutation that clears the cache
+                grid.release(last_id)
+                grid.place(last_id, *entry)
+                grid.wait_projection(service)
+
+            recomputed = timed(after_change, repeat)
+            cached = timed(lambda: grid.wait_projection(service), repeat)
+            results.append({
+                "lines": line_count,
+                "depth": depth,
+                "parties": len(grid),
+                "recompute_p50_us": percentile(recomputed, 50) * 1e6,
+                "recompute_p99_us": percentile(recomputed, 99) * 1e6,
+                "cached_p50_us": percentile(cached, 50) * 1e6,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+    print(f"{'lines':>5} {'depth':>6} {'parties':>8} {'recompute p50 us':>17} {'p99 us':>8} {'cached p50 us':>14}")
+    for row in run(args.repeat):
+        print(f"{row['lines']:>5} {row['depth']:>6} {row['parties']:>8} {row['recompute_p50_us']:>17.1f} "
+              f"{row['recompute_p99_us']:>8.1f} {row['cached_p50_us']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Memory and encode cost of the public queue list at 10k parties, per representation.
+
+Seeds ``--parties`` parties and compares the list as one dict per party (what
+``get_public_queue`` returns) with the read model's QueueEntry tuples: memory held
+(tracemalloc), JSON encode time of the row and columnar (``format=columns``) formats,
+response sizes, and what a connecting Socket.IO client costs: the old per-client encode
+of the dict list against the cached columnar snapshot sent as a binary attachment. Both
+formats must decode to the same parties.
+
+    python -m kiosk_queue.benchmarks.wire_format [--parties 10000] [--repeat 20]
+"""
+import argparse
+import json
+import tracemalloc
+from socketio import packet
+from ..queue_logic import get_public_queue, _get_queue
+from ..read_model import public_entries, public_view, wire_list
+from . import make_app, percentile, seed_layout, timed
+
+
+def measure_memory(build):
+    """(result of `build()`, bytes it allocated and still holds)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def client_encode(payload):
+    """Encode one ``queue_update`` emit the way python-socketio does for each client."""
+    return packet.Packet(packet.EVENT, data=["queue_update", payload], namespace="/queue").encode()
+
+
+def run(parties=10000, repeat=20, line_count=4):
+    app, socketio = make_app(line_count=line_count)
+    seed_layout(app, parties)
+    broadcaster = app.extensions["kiosk_queue_broadcaster"]
+    with app.app_context():
+        queue = _get_queue()
+        dicts, dict_bytes = measure_memory(lambda: get_public_queue(queue.id))
+        entries, entry_bytes = measure_memory(lambda: public_entries(queue))
+        view = public_view(queue)
+        rows_body = view.body()
+        columns_body = view.body("columns")
+        old_body = json.dumps({"queue": dicts, "wait_time": queue.wait_time, "seq": queue.version},
+                              separators=(",", ":")).encode("utf-8")
+
+        # From the list held to JSON, as a view's first body() call does
+        encode_dicts = timed(lambda: json.dumps({"queue": dicts}, separators=(",", ":")), repeat)
+        encode_rows = timed(lambda: json.dumps(wire_list(entries), separators=(",", ":")), repeat)
+        encode_columns = timed(lambda: json.dumps(wire_list(entries, "columns"), separators=(",", ":")), repeat)
+        cached = timed(view.body, repeat)
+
+        old_snapshot = {"queue": dicts, "wait_time": queue.wait_time, "wait_detail": None, "seq": queue.version}
+        per_client_old = timed(lambda: client_encode(old_snapshot), repeat)
+        per_client_rows = timed(lambda: client_encode(broadcaster.snapshot(queue.id, "public")), repeat)
+        per_client_columns = timed(lambda: client_encode(broadcaster.snapshot(queue.id, "public", "columns")), repeat)
+
+    decoded = json.loads(columns_body)
+    rebuilt = [dict(zip(decoded["columns"], values)) for values in zip(*decoded["columns"].values())]
+    if rebuilt != json.loads(rows_body)["queue"] or rows_body != old_body:
+        raise SystemExit("FAIL: the row and columnar formats disagree with get_public_queue")
+
+    return {
+        "parties": len(entries),
+        "dict_bytes": dict_bytes,
+        "entry_bytes": entry_bytes,
+        "encode_dicts_ms": percentile(encode_dicts, 50) * 1000,
+        "encode_rows_ms": percentile(encode_rows, 50) * 1000,
+        "encode_columns_ms": percentile(encode_columns, 50) * 1000,
+        "cached_body_us": percentile(cached, 50) * 1e6,
+        "rows_body_bytes": len(rows_body),
+        "columns_body_bytes": len(columns_body),
+        "client_old_ms": percentile(per_client_old, 50) * 1000,
+        "client_rows_ms": percentile(per_client_rows, 50) * 1000,
+        "client_columns_ms": percentile(per_client_columns, 50) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20, help="timed repetitions of each encode")
+    args = parser.parse_args(argv)
+    r = run(args.parties, args.repeat)
+    print(f"{r['parties']} parties")
+    print(f"memory held:        dicts {r['dict_bytes'] / 1024:8.0f} KiB   QueueEntry {r['entry_bytes'] / 1024:8.0f} KiB")
+    print(f"encode full list:   dicts {r['encode_dicts_ms']:8.2f} ms    rows {r['encode_rows_ms']:.2f} ms   "
+          f"columns {r['encode_columns_ms']:.2f} ms   cached {r['cached_body_us']:.2f} us")
+    print(f"body size:          rows  {r['rows_body_bytes'] / 1024:8.0f} KiB   columns {r['columns_body_bytes'] / 1024:.0f} KiB")
+    print(f"per connecting client (Socket.IO encode): dicts {r['client_old_ms']:.2f} ms   "
+          f"cached rows {r['client_rows_ms']:.2f} ms   cached columns {r['client_columns_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+from socketio import PubSubManager
+from .metrics import timer
+from .queue_logic import (
+    get_admin_queue_data,
+    party_position,
+    party_projections,
+    _compute_wait_times,
+    _get_queue,
+    _store,
+)
+from .read_model import QueueEntry, public_view, wire_list
+from .workers import run_db
+
+ROOMS = ('admin', 'public')
+
+
+def room_name(room, queue_id):
+    """Socket.IO room for one of ROOMS of a queue, e.g. ``public:3``."""
+    return f'{room}:{queue_id}'
+
+
+def _keyed(entries):
+    """``{id: entry}`` of a room's list: admin dicts or public QueueEntry tuples."""
+    if entries and isinstance(entries[0], QueueEntry):
+        return {entry.id: entry for entry in entries}
+    return {entry['id']: entry for entry in entries}
+
+
+def _place(entry):
+    """(line_number, place_in_queue) of a _keyed entry."""
+    if isinstance(entry, QueueEntry):
+        return entry.line_number, entry.place_in_queue
+    return entry['line_number'], entry['place_in_queue']
+
+
+def _diff(old, new):
+    """Return (added, removed, moved) between two _keyed maps; added entries are dicts."""
+    added = [entry.as_dict() if isinstance(entry, QueueEntry) else entry
+             for user_id, entry in new.items() if user_id not in old]
+    removed = [user_id for user_id in old if user_id not in new]
+    moved = []
+    for user_id, entry in new.items():
+        prev = old.get(user_id)
+        if prev is None:
+            continue
+        line_number, place_in_queue = _place(entry)
+        if _place(prev) != (line_number, place_in_queue):
+            moved.append({'id': user_id, 'line_number': line_number, 'place_in_queue': place_in_queue})
+    return added, removed, moved
+
+
+def _party_changes(old, new):
+    """``[(user_id, (line_number, place_in_queue, projected start) or None if gone)]`` for the
+    parties whose line, place or projected start minute differs between two projections."""
+    changes = []
+    for user_id, entry in new.items():
+        prev = old.get(user_id)
+        if prev is None or prev[:2] != entry[:2] or int(prev[2]) // 60 != int(entry[2]) // 60:
+            changes.append((user_id, entry))
+    changes.extend((user_id, None) for user_id in old if user_id not in new)
+    return changes
+
+
+class _Channel:
+    """Broadcast state of one queue."""
+
+    def __init__(self):
+        self.entries = {room: {} for room in ROOMS}  # {id: entry} of each room's list
+        self.snapshots = None  # {room: queue_update payload} as of self.seq
+        self.wire = {}  # (room, wire format) -> snapshot as emitted, as of self.seq
+        self.parties = {}  # party_projections() as of self.seq
+        self.seq = 0  # Queue.version of the last published state
+        self.pending = False
+        self.flush_lock = threading.Lock()
+
+
+class QueueBroadcaster:
+    """Coalesces queue updates into versioned ``queue_delta`` emits on the /queue namespace.
+
+    Mutations call ``request_update``; every request arriving within ``delay`` seconds is
+    merged into a single flush, which recomputes the queue once and emits to each room only
+    the entries added, removed or moved since the previous flush, tagged with ``seq`` and
+    ``base_seq``. Clients holding ``base_seq`` apply the delta; new or out-of-sync clients get
+    a full ``queue_update`` snapshot instead (see ``snapshot``), served from a cache so a
+    connecting client costs no queue recomputation. The public list comes from the same
+    read model as ``GET /queue`` (read_model.py), so it is built once per version for both.
+
+    Each flush also compares every party's line, place and projected start minute with the
+    previous flush and sends a small ``position`` event to the room of each party whose
+    values changed, so a phone following one party never receives the whole queue.
+
+    State is kept per queue id, so queues flush independently of one another. ``seq`` is
+    the queue's ``Queue.version``, so it means the same thing in every worker process: a
+    client fed deltas by several workers through the message bus sees a ``base_seq`` gap
+    when another worker's change slipped in between, and resyncs.
+    """
+
+    def __init__(self, socketio, app, delay=0.05):
+        self.socketio = socketio
+        self.app = app
+        self.delay = delay
+        self._channels = {}
+        self._pending_lock = threading.Lock()
+
+    def _channel(self, queue_id):
+        channel = self._channels.get(queue_id)
+        if channel is None:
+            with self._pending_lock:
+                channel = self._channels.setdefault(queue_id, _Channel())
+        return channel
+
+    def request_update(self, queue_id):
+        # A pending flush also marks the cached snapshots stale (see snapshot)
+        if self.delay <= 0:
+            self.flush(queue_id)
+            return
+        channel = self._channel(queue_id)
+        with self._pending_lock:
+            if channel.pending:
+                return
+            channel.pending = True
+        self.socketio.start_background_task(self._flush_later, queue_id)
+
+    def _flush_later(self, queue_id):
+        self.socketio.sleep(self.delay)
+        with self.app.app_context():
+            self.flush(queue_id)
+
+    def _build(self, queue_id):
+        """Recompute the queue once; returns {room: queue_update payload}. Runs on a DB pool thread."""
+        queue = _get_queue(queue_id)
+        wait_time = queue.wait_time if queue else 0
+        version = queue.version if queue else 0
+        wait_detail = _compute_wait_times(queue_id)
+        lists = {'admin': get_admin_queue_data(queue_id), 'public': public_view(queue).entries if queue else []}
+        payloads = {
+            room: {'queue': lists[room], 'wait_time': wait_time, 'wait_detail': wait_detail, 'seq': version}
+            for room in ROOMS
+        }
+        # Not a room: each party's position, for the per-party 'position' events
+        payloads['parties'] = party_projections(queue) if queue else {}
+        return payloads
+
+    def _adopt(self, channel, payloads):
+        """Make `payloads` the channel's published state without emitting."""
+        for room in ROOMS:
+            channel.entries[room] = _keyed(payloads[room]['queue'])
+        channel.seq = payloads[ROOMS[0]]['seq']
+        channel.parties = payloads['parties']
+        channel.snapshots = payloads
+        channel.wire = {}
+
+    def flush(self, queue_id):
+        channel = self._channel(queue_id)
+        with self._pending_lock:
+            channel.pending = False
+        with channel.flush_lock:
+            with timer('broadcast_build'):
+                payloads = run_db(self._build, queue_id)
+            if channel.snapshots is not None and payloads[ROOMS[0]]['seq'] == channel.seq:
+                return  # already published
+            self._publish(queue_id, channel, payloads)
+
+    def _publish(self, queue_id, channel, payloads):
+        """Adopt `payloads` and emit the ``queue_delta`` and ``position`` events leading to
+        them from the channel's previous state. Call with the channel's flush_lock held."""
+        base_seq = channel.seq
+        deltas = {}
+        for room in ROOMS:
+            deltas[room] = _diff(channel.entries[room], _keyed(payloads[room]['queue']))
+        party_changes = []
+        if channel.snapshots is not None:
+            party_changes = _party_changes(channel.parties, payloads['parties'])
+        self._adopt(channel, payloads)
+        metrics = self.app.extensions.get('kiosk_queue_metrics')
+        for room in ROOMS:
+            added, removed, moved = deltas[room]
+            delta = {
+                'seq': channel.seq,
+                'base_seq': base_seq,
+                'added': added,
+                'removed': removed,
+                'moved': moved,
+                'wait_time': payloads[room]['wait_time'],
+                'wait_detail': payloads[room]['wait_detail'],
+            }
+            with timer('broadcast_emit'):
+                self.socketio.emit('queue_delta', delta, to=room_name(room, queue_id), namespace='/queue')
+            if metrics is not None:
+                metrics.emitted('queue_delta', room, delta, self.participants(room_name(room, queue_id)))
+        self._emit_positions(channel.seq, party_changes, metrics)
+
+    def _emit_positions(self, seq, changes, metrics):
+        """Send each changed party its new ``position`` in its own room (see sockets.py);
+        a party that left gets ``queued: false`` and its room is closed."""
+        # Without a message bus every subscriber is on this worker, so empty rooms are skipped
+        shared = isinstance(self.socketio.server.manager, PubSubManager)
+        now = int(time.time())
+        for user_id, entry in changes:
+            room = room_name('party', user_id)
+            recipients = self.participants(room)
+            if not recipients and not shared:
+                continue
+            if entry is None:
+                payload = {'id': user_id, 'queued': False, 'seq': seq}
+            else:
+                payload = party_position(user_id, *entry, now, seq)
+            self.socketio.emit('position', payload, to=room, namespace='/queue')
+            if entry is None:
+                self.socketio.close_room(room, namespace='/queue')
+            if metrics is not None:
+                metrics.emitted('position', 'party', payload, recipients)
+
+    def participants(self, room):
+        """Clients of this worker in a Socket.IO room of the /queue namespace."""
+        return sum(1 for _ in self.socketio.server.manager.get_participants('/queue', room))
+
+    def snapshot(self, queue_id, room, wire_format='rows'):
+        """Full ``queue_update`` payload for `room` of a queue, consistent with its current ``seq``.
+
+        Served from the snapshots built by the last flush; a pending mutation invalidates
+        them, in which case the flush runs now instead of after the coalescing window. A
+        version newer than the snapshots (a change by another worker, or one of this
+        worker's own whose flush hasn't been requested yet) is published here too.
+
+        The public room can also be sent in the columnar format (see read_model.py), as
+        JSON-encoded bytes: Socket.IO sends bytes as a binary attachment without encoding
+        them again, so every client connecting at one ``seq`` shares a single encode. The
+        admin room is always sent as rows.
+        """
+        channel = self._channel(queue_id)
+        with self._pending_lock:
+            pending = channel.pending
+        if pending:
+            self.flush(queue_id)
+        with channel.flush_lock:
+            seq = channel.seq if channel.snapshots is not None else None
+            payloads = run_db(self._rebuild_if_stale, queue_id, seq)
+            if payloads is not None:
+                if channel.snapshots is None:
+                    self._adopt(channel, payloads)  # nothing was published yet, so nobody is behind
+                else:
+                    # The change may be this worker's own, committed but not yet flushed (its
+                    # flush would then find nothing new), so the delta is sent from here. For
+                    # another worker's change it is a duplicate, which clients ignore by seq
+                    self._publish(queue_id, channel, payloads)
+            if room != 'public':
+                wire_format = 'rows'
+            payload = channel.wire.get((room, wire_format))
+            if payload is None:
+                payload = channel.snapshots[room]
+                if room == 'public':
+                    entries = payload['queue']
+                    payload = {key: value for key, value in payload.items() if key != 'queue'}
+                    payload.update(wire_list(entries, wire_format))
+                if wire_format == 'columns':
+                    payload = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+                channel.wire[(room, wire_format)] = payload
+            return payload
+
+    def _rebuild_if_stale(self, queue_id, seq):
+        """``_build`` result if the queue's version is no longer `seq`, else None."""
+        version = _store().queue_version(queue_id)
+        if version == seq:
+            return None
+        return self._build(queue_id)
@@ -0,0 +1,46 @@
+import queue
+import threading
+import socketio
+
+
+class LocalBusManager(socketio.PubSubManager):
+    """In-process stand-in for a Redis/Kombu Socket.IO message queue.
+
+    Every manager created on the same channel receives what the others publish, so
+    several ``SocketIO`` servers in one process (e.g. one per test "worker") fan out
+    emits to each other exactly as separate workers would through Redis.
+    """
+    name = 'local'
+    _subscribers = {}  # channel -> [queue.Queue]
+    _subscribers_lock = threading.Lock()
+
+    def __init__(self, url='local://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._inbox = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.setdefault(self.channel, []).append(self._inbox)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._subscribers_lock:
+            inboxes = list(self._subscribers.get(self.channel, ()))
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+def socketio_options(url):
+    """``SocketIO(...)`` keyword arguments for a message bus URL.
+
+    ``local://<channel>`` uses the in-process LocalBusManager; any other URL (``redis://``,
+    ``amqp://``, ``kafka://``, ``zmq+tcp://`` ...) is handed to Flask-SocketIO's built-in
+    managers. No URL means a single process, with no bus at all.
+    """
+    if not url:
+        return {}
+    if url.startswith('local://'):
+        return {'client_manager': LocalBusManager(channel=url[len('local://'):] or 'flask-socketio')}
+    return {'message_queue': url}
@@ -1,6 +1,10 @@
 import click
 from flask import current_app
+from werkzeug.security import generate_password_hash
 from .db import db
+from .schema import upgrade_schema
+from .queue_logic import create_queue_logic
+from .archive import EVENT_COLUMNS, STATE_COLUMNS, parse_time, read_events, replay, write_rows
 
 @click.command("kiosk-init-db")
 def init_db_command():
@@ -13,4 +17,69 @@ def reset_db_command():
     with current_app.app_context():
         db.drop_all()
         db.create_all()
-    click.echo("Kiosk DB reset.")
\ No newline at end of file
+    click.echo("Kiosk DB reset.")
+
+@click.command("kiosk-upgrade-db")
+def upgrade_db_command():
+    with current_app.app_context():
+        upgrade_schema()
+    click.echo("Kiosk DB upgraded.")
+
+@click.command("kiosk-create-queue")
+@click.argument("name")
+@click.option("--lines", "line_count", type=int, default=None, help="Parallel lines (default: LINE_COUNT).")
+@click.option("--slot-time", type=int, default=None, help="Minutes per slot (default: SLOT_TIME).")
+@click.option("--reset-time", type=int, default=None, help="Minutes between slots (default: RESET_TIME).")
+def create_queue_command(name, line_count, slot_time, reset_time):
+    with current_app.app_context():
+        queue = create_queue_logic(name=name, line_count=line_count, slot_time=slot_time, reset_time=reset_time)
+        click.echo(f"Kiosk queue {queue.id} ({name}) created.")
+
+def _archive_path():
+    path = current_app.config.get("KIOSK_QUEUE_ARCHIVE_PATH")
+    if not path:
+        raise click.ClickException("KIOSK_QUEUE_ARCHIVE_PATH is not set.")
+    return path
+
+@click.command("kiosk-export-events")
+@click.option("--since", default=None, help="Start time: POSIX seconds or ISO 8601.")
+@click.option("--until", default=None, help="End time: POSIX seconds or ISO 8601.")
+@click.option("--queue-id", type=int, default=None, help="Only this queue's events.")
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]), default="jsonl")
+@click.option("--output", type=click.File("w"), default="-", help="File to write (default: stdout).")
+def export_events_command(since, until, queue_id, fmt, output):
+    """Export the archived queue events, oldest first."""
+    with current_app.app_context():
+        events = read_events(
+            _archive_path(),
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            queue_id=queue_id,
+        )
+        write_rows(events, EVENT_COLUMNS, fmt, output)
+
+def _state_order(party):
+    # A party only seen compacting in an old log has no line number
+    return (party["line_number"] is None, party["line_number"] or 0, party["place_in_queue"])
+
+@click.command("kiosk-replay-events")
+@click.option("--at", default=None, help="Time to rebuild the queues at: POSIX seconds or ISO 8601 (default: now).")
+@click.option("--queue-id", type=int, default=None, help="Only this queue.")
+@click.option("--format", "fmt", type=click.Choice(["jsonl", "csv"]), default="jsonl")
+@click.option("--output", type=click.File("w"), default="-", help="File to write (default: stdout).")
+def replay_events_command(at, queue_id, fmt, output):
+    """Rebuild the queues from the archive as they were at a given time."""
+    with current_app.app_context():
+        queues = replay(_archive_path(), at=parse_time(at) if at else None, queue_id=queue_id)
+        rows = (
+            party
+            for qid in sorted(queues)
+            for party in sorted(queues[qid].values(), key=_state_order)
+        )
+        write_rows(rows, STATE_COLUMNS, fmt, output)
+
+@click.command("kiosk-hash-password")
+@click.password_option(help="Admin password to hash (prompted if omitted).")
+def hash_password_command(password):
+    """Print a hash of the admin password for KIOSK_QUEUE_ADMIN_PASSWORD_HASH."""
+    click.echo(generate_password_hash(password))
@@ -8,4 +8,6 @@ class Config:
     SLOT_TIME = int(os.environ.get('SLOT_TIME', 5)) # in minutes
     RESET_TIME = int(os.environ.get('RESET_TIME', 3)) # in minutes
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'admin'
-    KIOSK_QUEUE_CORS_ORIGINS = os.environ.get('KIOSK_QUEUE_CORS_ORIGINS') or '*'
\ No newline at end of file
+    KIOSK_QUEUE_CORS_ORIGINS = os.environ.get('KIOSK_QUEUE_CORS_ORIGINS') or '*'
+    # Socket.IO message bus for multi-worker deployments, e.g. redis://localhost:6379/0
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
\ No newline at end of file
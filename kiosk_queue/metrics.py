@@ -0,0 +1,202 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from flask import current_app, g
+from sqlalchemy import event
+from .workers import native_rlock
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'kiosk_queue_operation_seconds': (
+        'histogram', 'Time spent in queue logic, DB commits and broadcasts.', SECONDS_BUCKETS),
+    'kiosk_queue_write_conflicts_total': (
+        'counter', 'Mutations retried after losing the DB write lock to another worker.', None),
+    'kiosk_queue_request_seconds': (
+        'histogram', 'HTTP request latency by endpoint.', SECONDS_BUCKETS),
+    'kiosk_queue_request_queries': (
+        'histogram', 'SQL statements executed per HTTP request by endpoint.', (0, 1, 2, 3, 5, 8, 13, 21, 34)),
+    'kiosk_queue_broadcast_recipients': (
+        'histogram', 'Clients of this worker each Socket.IO emit went to.', (0, 1, 10, 100, 1000, 10000)),
+    'kiosk_queue_broadcast_bytes': (
+        'histogram', 'JSON size of each Socket.IO emit payload.', (256, 1024, 4096, 16384, 65536, 262144, 1048576)),
+    'kiosk_queue_connected_clients': (
+        'gauge', 'Socket.IO clients connected to this worker, by queue and room.', None),
+    'kiosk_queue_parties': (
+        'gauge', 'Parties queued, by queue.', None),
+}
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+# Whether any app in this process has metrics on; until one does, the hooks return at once
+# without resolving current_app
+_enabled = False
+
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format.
+
+    Series are keyed by metric name and a tuple of ``(label, value)`` pairs. Updates take a
+    native lock for a dict lookup and a few additions, so they are safe from DB pool threads
+    and green threads alike. Each worker process keeps its own figures; scrape every worker.
+
+    Only created when ``KIOSK_QUEUE_METRICS`` is on; the hooks below (``instrumented``,
+    ``timer``) check for it first and otherwise cost a global lookup.
+    """
+
+    def __init__(self):
+        global _enabled
+        _enabled = True
+        self._histograms = {}  # (name, labels) -> [per-bucket counts + overflow, sum]
+        self._counters = {}  # (name, labels) -> value
+        self._lock = native_rlock()
+        self._queries = threading.local()  # per-thread SQL statement count
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(buckets, value)] += 1
+            series[1] += value
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def track_queries(self, engine):
+        """Count SQL statements per thread on `engine` (see ``count_queries``)."""
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        local = self._queries
+        local.count = getattr(local, 'count', 0) + 1
+
+    def count_queries(self, fn, *args, **kwargs):
+        """``(fn(*args, **kwargs), SQL statements it executed)``, counted on this thread."""
+        local = self._queries
+        if getattr(local, 'counting', False):
+            return fn(*args, **kwargs), 0  # nested run_db: the enclosing count includes these
+        start = getattr(local, 'count', 0)
+        local.counting = True
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            local.counting = False
+        return result, getattr(local, 'count', 0) - start
+
+    def add_request_queries(self, count):
+        """Add SQL statements run on a DB pool thread to the current HTTP request's total."""
+        if 'kiosk_queue_queries' in g:
+            g.kiosk_queue_queries += count
+
+    def emitted(self, event, room, payload, recipients):
+        """Record one Socket.IO emit of `payload` (an object, or bytes sent as they are) to
+        `recipients` clients."""
+        labels = (('event', event), ('room', room))
+        self.observe('kiosk_queue_broadcast_recipients', labels, recipients)
+        size = len(payload) if isinstance(payload, bytes) else len(_encode(payload))
+        self.observe('kiosk_queue_broadcast_bytes', labels, size)
+
+    def render(self, gauges=()):
+        """The Prometheus text exposition of every series, plus `gauges`: an iterable of
+        ``(name, labels, value)`` read at scrape time."""
+        series = {}
+        with self._lock:
+            for (name, labels), (counts, total) in self._histograms.items():
+                series.setdefault(name, []).append((labels, list(counts), total))
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append((labels, value))
+        for name, labels, value in gauges:
+            series.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            if name not in series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for entry in sorted(series[name], key=lambda entry: entry[0]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(entry[0])} {entry[1]}')
+                    continue
+                labels, counts, total = entry
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {total}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def get_metrics():
+    """The app's Metrics, or None when ``KIOSK_QUEUE_METRICS`` is off."""
+    if not _enabled:
+        return None
+    return current_app.extensions.get('kiosk_queue_metrics')
+
+
+class _Timer:
+    __slots__ = ('metrics', 'labels', 'start')
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe('kiosk_queue_operation_seconds', self.labels, time.perf_counter() - self.start)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timer(operation):
+    """Context manager timing a block as `operation` in kiosk_queue_operation_seconds."""
+    metrics = get_metrics()
+    if metrics is None:
+        return _NO_TIMER
+    return _Timer(metrics, (('operation', operation),))
+
+
+def instrumented(operation):
+    """Decorator timing every call as `operation` in kiosk_queue_operation_seconds."""
+    labels = (('operation', operation),)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            metrics = get_metrics()
+            if metrics is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe('kiosk_queue_operation_seconds', labels, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
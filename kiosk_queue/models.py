@@ -3,16 +3,34 @@ from .db import db
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    queue_id = db.Column(db.Integer, db.ForeignKey('queue.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(255), nullable=True)
     party_size = db.Column(db.Integer, nullable=False, default=1)
     place_in_queue = db.Column(db.Integer, nullable=False)
     line_number = db.Column(db.Integer, nullable=True)
     email_consent = db.Column(db.Boolean, nullable=False, default=False)
+    # Secret handed out by /join; the party looks up its own position with it
+    token = db.Column(db.String(32), nullable=True)
+    # The party asked for its line; optimized placement never moves it to another one
+    pinned = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        # Public/admin listings order by (line_number, place_in_queue) within a queue
+        db.Index('ix_user_queue_line_place', 'queue_id', 'line_number', 'place_in_queue'),
+        db.Index('ix_user_token', 'token', unique=True),
+    )
 
 class Queue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=True)
+    # Per-queue overrides of LINE_COUNT / SLOT_TIME / RESET_TIME; NULL falls back to the app config
+    line_count = db.Column(db.Integer, nullable=True)
+    slot_time = db.Column(db.Integer, nullable=True) # in minutes
+    reset_time = db.Column(db.Integer, nullable=True) # in minutes
     wait_time = db.Column(db.Integer, default=0) # in minutes
+    # Bumped on every queue mutation so each process can tell when its in-memory occupancy grid is stale
+    version = db.Column(db.Integer, nullable=False, default=0)
 
     # def update_wait_time(self):
     #     # This logic will need to be more sophisticated for parallel lines
@@ -22,6 +40,35 @@ class Queue(db.Model):
 
 class LineStatus(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    line_number = db.Column(db.Integer, nullable=False, unique=True)
+    queue_id = db.Column(db.Integer, db.ForeignKey('queue.id'), nullable=False)
+    line_number = db.Column(db.Integer, nullable=False)
     # POSIX timestamp (seconds) when last party occupying front of this line (or spanning across it) was admitted
     last_admitted_time = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('queue_id', 'line_number', name='uq_line_status_queue_line'),
+    )
+
+class Notification(db.Model):
+    """Outbox of messages to parties. Rows are written in the same transaction as the queue
+    change that calls for them and delivered in the background (see notifications.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    queue_id = db.Column(db.Integer, nullable=False)
+    # No foreign key: the party's row is deleted when it is admitted, its messages stay
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    address = db.Column(db.String(255), nullable=False)
+    place_in_queue = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / sent / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # POSIX seconds; while a worker is sending the row this is when its claim lapses
+    next_attempt_at = db.Column(db.Float, nullable=False, default=0)
+    claim = db.Column(db.String(32), nullable=True)
+    created_at = db.Column(db.Float, nullable=False)
+    sent_at = db.Column(db.Float, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+
+    __table_args__ = (
+        # Dispatchers poll for pending rows that are due
+        db.Index('ix_notification_due', 'status', 'next_attempt_at'),
+    )
@@ -0,0 +1,218 @@
+import atexit
+import json
+import random
+import time
+from sqlalchemy.exc import OperationalError
+from .workers import _original, native_rlock, native_sleep, start_native_thread
+
+DEFAULT_MESSAGE = "You're number {place} in line - please head to the entrance. Reply CANCEL to give up your place."
+
+
+class Transport:
+    """Delivers messages to parties; subclass it for an SMS gateway or email API.
+
+    ``send`` gets a batch of message dicts (``id``, ``kind``, ``address``, ``body``) and
+    returns one error string, or None if delivered, per message in order. Raising fails the
+    whole batch. It runs on the dispatcher's worker threads, which are native threads, so
+    blocking network calls are fine there.
+    """
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class MemoryTransport(Transport):
+    """Keeps delivered messages in ``sent``; for tests and benchmarks.
+
+    `latency` seconds are slept per batch, like a provider round trip, and `fail` (a callable
+    taking a message and returning an error string or None) injects failures.
+    """
+
+    def __init__(self, latency=0.0, fail=None):
+        self.latency = latency
+        self.fail = fail
+        self.sent = []
+        self.calls = 0
+        self._lock = native_rlock()
+
+    def send(self, messages):
+        if self.latency:
+            native_sleep(self.latency)
+        errors = [self.fail(message) if self.fail else None for message in messages]
+        with self._lock:
+            self.calls += 1
+            self.sent.extend(message for message, error in zip(messages, errors) if error is None)
+        return errors
+
+
+class FileTransport(Transport):
+    """Appends each message as a JSON line to the file at `path`; for local development."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = native_rlock()
+
+    def send(self, messages):
+        lines = ''.join(json.dumps(dict(message, ts=time.time()), separators=(',', ':')) + '\n' for message in messages)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        return [None] * len(messages)
+
+
+class NotificationDispatcher:
+    """Sends the store's outbox (``QueueStore.add_notifications``) in the background.
+
+    Queue mutations only add outbox rows inside their own transaction and call ``wake``, so
+    they never wait on the provider. A poller thread claims due rows in batches of up to
+    ``workers * batch_size``, hands them to a fixed pool of worker threads in chunks of
+    ``batch_size`` (one ``Transport.send`` each), then records every outcome in one write.
+    Failed messages are retried after ``backoff * 2 ** (attempts - 1)`` seconds (with
+    jitter) and given up on after ``max_attempts``. A claim lapses after ``lease`` seconds,
+    so rows held by a worker process that died are sent again by another.
+
+    All threads are native threads, so eventlet/gevent workers never block on a send.
+    """
+
+    def __init__(self, app, transport, within=3, workers=4, batch_size=50, max_attempts=5, backoff=2.0,
+                 poll_interval=1.0, lease=60.0, message=DEFAULT_MESSAGE):
+        self.app = app
+        self.transport = transport
+        self.within = within
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.message = message
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._wake = _original('threading', 'Event')()
+        self._jobs = _original('queue', 'SimpleQueue')()
+        self._allocate_lock = _original('_thread', 'allocate_lock')
+        self._closed = False
+        for _ in range(workers):
+            start_native_thread(self._work)
+        start_native_thread(self._run)
+        atexit.register(self.close)
+
+    def wake(self):
+        """Have the poller look for due rows now rather than at its next poll."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                with self.app.app_context():
+                    self.dispatch()
+            except Exception:
+                self.app.logger.exception('Notification dispatch failed')
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            messages, errors, done = job
+            try:
+                errors.extend(self.transport.send(messages))
+            except Exception as exc:
+                errors.extend([repr(exc)] * len(messages))
+            finally:
+                done.release()
+
+    def dispatch(self):
+        """Send everything that is due; returns the number of rows claimed. Call in an app context."""
+        store = self.app.extensions['kiosk_queue_store']
+        limit = self.workers * self.batch_size
+        claimed = 0
+        while not self._closed:
+            rows = self._write(store, store.claim_notifications, time.time(), self.lease, limit)
+            if not rows:
+                break
+            claimed += len(rows)
+            jobs = []
+            for start in range(0, len(rows), self.batch_size):
+                chunk = rows[start:start + self.batch_size]
+                errors = []
+                done = self._allocate_lock()
+                done.acquire()
+                jobs.append((chunk, errors, done))
+                self._jobs.put(([self._render(row) for row in chunk], errors, done))
+            sent, retries, failed = [], {}, {}
+            now = time.time()
+            for chunk, errors, done in jobs:
+                done.acquire()
+                for row, error in zip(chunk, errors):
+                    if error is None:
+                        sent.append(row['id'])
+                    elif row['attempts'] >= self.max_attempts:
+                        failed[row['id']] = str(error)[:255]
+                    else:
+                        delay = self.backoff * 2 ** (row['attempts'] - 1) * random.uniform(0.5, 1.5)
+                        retries[row['id']] = (now + delay, str(error)[:255])
+            self._write(store, store.finish_notifications, now, sent, retries, failed)
+            self.sent += len(sent)
+            self.retried += len(retries)
+            self.failed += len(failed)
+            if len(rows) < limit:
+                break
+        return claimed
+
+    def _write(self, store, fn, *args):
+        # Claims and outcomes race queue mutations for the DB write lock; retry like they do
+        retries = self.app.config['KIOSK_QUEUE_WRITE_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return fn(*args)
+            except OperationalError:
+                store.rollback()
+                if attempt == retries:
+                    raise
+                native_sleep(0.01 * 2 ** attempt)
+
+    def _render(self, row):
+        return {'id': row['id'], 'kind': row['kind'], 'address': row['address'],
+                'body': self.message.format(place=row['place_in_queue'])}
+
+    def close(self):
+        """Stop the poller and the worker threads (claimed rows in flight are still recorded)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        for _ in range(self.workers):
+            self._jobs.put(None)
+
+
+def create_notifier(app):
+    """The app's NotificationDispatcher, or None when ``KIOSK_QUEUE_NOTIFY_TRANSPORT`` is unset.
+
+    The setting is a Transport instance, "memory" (a MemoryTransport) or "file:<path>"
+    (a FileTransport).
+    """
+    transport = app.config.get('KIOSK_QUEUE_NOTIFY_TRANSPORT')
+    if not transport:
+        return None
+    if transport == 'memory':
+        transport = MemoryTransport()
+    elif isinstance(transport, str) and transport.startswith('file:'):
+        transport = FileTransport(transport[len('file:'):])
+    elif not isinstance(transport, Transport):
+        raise ValueError(f'Unknown KIOSK_QUEUE_NOTIFY_TRANSPORT: {transport!r}')
+    return NotificationDispatcher(
+        app,
+        transport,
+        within=app.config['KIOSK_QUEUE_NOTIFY_WITHIN'],
+        workers=app.config['KIOSK_QUEUE_NOTIFY_WORKERS'],
+        batch_size=app.config['KIOSK_QUEUE_NOTIFY_BATCH'],
+        max_attempts=app.config['KIOSK_QUEUE_NOTIFY_MAX_ATTEMPTS'],
+        backoff=app.config['KIOSK_QUEUE_NOTIFY_BACKOFF'],
+        poll_interval=app.config['KIOSK_QUEUE_NOTIFY_POLL_INTERVAL'],
+        message=app.config['KIOSK_QUEUE_NOTIFY_MESSAGE'] or DEFAULT_MESSAGE,
+    )
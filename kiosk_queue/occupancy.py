@@ -0,0 +1,392 @@
+from .workers import native_rlock
+
+
+class OccupancyGrid:
+    """In-memory mirror of the (line_number, place_in_queue) cells held by ``User`` rows.
+
+    Each line is stored as a Python int used as a bitmap: bit ``depth - 1`` is set when
+    that depth is occupied. The earliest free depth of a line (or of several contiguous
+    lines, by OR-ing their bitmaps) is then the lowest clear bit, which answers placement
+    without scanning the table or probing depth by depth.
+
+    ``admitted`` mirrors ``LineStatus.last_admitted_time`` per line so wait estimates can be
+    read without touching the DB. ``version`` is the ``Queue.version`` the grid reflects;
+    ``None`` marks it stale. Parties that asked for their line are *pinned* to it: re-packing
+    never moves them to another line.
+    """
+
+    def __init__(self, line_count):
+        self.line_count = line_count
+        self.version = None
+        self.lock = native_rlock()
+        self._bits = [0] * line_count
+        self._first_free = [1] * line_count
+        self._cells = [{} for _ in range(line_count)]  # per line: depth -> user id
+        self._parties = {}  # user id -> (line_number, party_size, depth)
+        self._pinned = set()  # user ids of parties that asked for their line
+        self.admitted = [0] * line_count
+        self._projections = {}  # cached wait_projection() results by service times, cleared on any change
+
+    def __len__(self):
+        return len(self._parties)
+
+    @staticmethod
+    def lowest_free(bits):
+        """Return the lowest free depth (1-based) in a bitmap."""
+        return ((bits + 1) & ~bits).bit_length()
+
+    def lines(self, line_number, party_size):
+        return range(line_number, min(self.line_count, line_number + party_size))
+
+    def rebuild(self, rows, version, admitted=None):
+        """Reset the grid from ``(id, line_number, party_size, place_in_queue[, pinned])`` rows
+        and an optional ``{line_number: last_admitted_time}`` mapping."""
+        admitted = admitted or {}
+        self.admitted = [admitted.get(ln, 0) for ln in range(self.line_count)]
+        self._projections = {}
+        self._bits = [0] * self.line_count
+        self._cells = [{} for _ in range(self.line_count)]
+        self._parties = {}
+        self._pinned = set()
+        for row in rows:
+            user_id, line_number, party_size, depth = row[:4]
+            if line_number is None:
+                continue
+            self._parties[user_id] = (line_number, party_size, depth)
+            if len(row) > 4 and row[4]:
+                self._pinned.add(user_id)
+            for ln in self.lines(line_number, party_size):
+                self._bits[ln] |= 1 << (depth - 1)
+                self._cells[ln][depth] = user_id
+        self._first_free = [self.lowest_free(b) for b in self._bits]
+        self.version = version
+
+    def invalidate(self):
+        self.version = None
+
+    def place(self, user_id, line_number, party_size, depth, pinned=False):
+        self._projections = {}
+        self._parties[user_id] = (line_number, party_size, depth)
+        if pinned:
+            self._pinned.add(user_id)
+        bit = 1 << (depth - 1)
+        for ln in self.lines(line_number, party_size):
+            self._bits[ln] |= bit
+            self._cells[ln][depth] = user_id
+            if depth == self._first_free[ln]:
+                self._first_free[ln] = self.lowest_free(self._bits[ln])
+
+    def release(self, user_id):
+        """Remove a party's cells; returns its ``(line_number, party_size, depth)`` or None."""
+        entry = self._parties.pop(user_id, None)
+        if entry is None:
+            return None
+        self._pinned.discard(user_id)
+        self._projections = {}
+        line_number, party_size, depth = entry
+        mask = ~(1 << (depth - 1))
+        for ln in self.lines(line_number, party_size):
+            self._bits[ln] &= mask
+            self._cells[ln].pop(depth, None)
+            if depth < self._first_free[ln]:
+                self._first_free[ln] = depth
+        return entry
+
+    def move(self, user_id, line_number, depth):
+        """Move a party to another cell block, keeping its size and pin."""
+        pinned = user_id in self._pinned
+        _, party_size, _ = self.release(user_id)
+        self.place(user_id, line_number, party_size, depth, pinned)
+
+    def compact(self, start_depth, lines):
+        """Close the gap freed at ``start_depth`` in ``lines``; returns ``{user_id: new_depth}``.
+
+        Walks depths below the gap, visiting only parties that cover an affected line, and
+        moves each straight up to its final depth: just below the deepest occupied cell
+        above it in any of its lines, but never above ``start_depth``. A party that moves
+        frees cells in all of its lines, so those lines become affected from the next depth
+        on. Parties sharing a depth never share a line, so the result is the same as
+        repeatedly moving every party up one row until nothing moves.
+
+        Because moves stop at ``start_depth``, an earlier removal can leave a party below
+        a hole that a later, shallower removal lets it close; lines holding such a hole
+        below ``start_depth`` are affected too.
+        """
+        active = set(lines)
+        for ln, bits in enumerate(self._bits):
+            # Free depths with an occupied depth right below them, from start_depth down
+            if (~bits & (bits >> 1)) >> (start_depth - 1):
+                active.add(ln)
+        max_depth = max((self._bits[ln].bit_length() for ln in active), default=0)
+        moves = {}
+        depth = start_depth + 1
+        while depth <= max_depth:
+            above_mask = (1 << (depth - 1)) - 1
+            visited = set()
+            for ln in list(active):
+                user_id = self._cells[ln].get(depth)
+                if user_id is None or user_id in visited:
+                    continue
+                visited.add(user_id)
+                line_number, party_size, _ = self._parties[user_id]
+                covered = self.lines(line_number, party_size)
+                bits = 0
+                for cl in covered:
+                    bits |= self._bits[cl]
+                target = max((bits & above_mask).bit_length() + 1, start_depth)
+                if target >= depth:
+                    continue
+                self.move(user_id, line_number, target)
+                moves[user_id] = target
+                for cl in covered:
+                    if cl not in active:
+                        active.add(cl)
+                        max_depth = max(max_depth, self._bits[cl].bit_length())
+            depth += 1
+        return moves
+
+    def set_admitted(self, lines, timestamp):
+        for ln in lines:
+            self.admitted[ln] = timestamp
+        self._projections = {}
+
+    def wait_projection(self, service):
+        """Projected start times (POSIX seconds) for a party joining now.
+
+        ``service`` holds the expected seconds per slot of each line. Returns
+        ``(per_line, per_span)``: for a size-1 party in each line, and for each span size
+        >= 2 the best contiguous block. A slot at depth k in a line starts at
+        ``admitted[line] + k * service[line]``; a spanning party waits for the latest of its
+        lines. Only depends on the grid, so it is cached (per ``service``) until the next change.
+        """
+        service = tuple(service)
+        cached = self._projections.get(service)
+        if cached is not None:
+            return cached
+        line_count = self.line_count
+        admitted = self.admitted
+        per_line = [admitted[ln] + self._first_free[ln] * service[ln] for ln in range(line_count)]
+        per_span = {}
+        for start in range(line_count):
+            bits = self._bits[start]
+            depth = self._first_free[start]
+            latest = per_line[start]
+            for end in range(start + 1, line_count):
+                bits |= self._bits[end]
+                span = end - start + 1
+                if self.lowest_free(bits) != depth:
+                    # The block's first common free depth moved down; re-project every line
+                    depth = self.lowest_free(bits)
+                    latest = max(admitted[ln] + depth * service[ln] for ln in range(start, end + 1))
+                else:
+                    latest = max(latest, admitted[end] + depth * service[end])
+                if span not in per_span or latest < per_span[span]:
+                    per_span[span] = latest
+        per_span = dict(sorted(per_span.items()))
+        self._projections[service] = per_line, per_span
+        return per_line, per_span
+
+    def party_projection(self, user_id, service):
+        """Projected start time of a queued party, as ``wait_projection`` projects the slot it
+        holds: the latest over its lines of ``admitted[line] + depth * service[line]``. A party
+        left with no lines (placed past a since-reduced line count) projects to 0."""
+        line_number, party_size, depth = self._parties[user_id]
+        return max((self.admitted[ln] + depth * service[ln] for ln in self.lines(line_number, party_size)), default=0)
+
+    def party_projections(self, service):
+        """``{user_id: (line_number, depth, projected start)}`` of every party."""
+        admitted = self.admitted
+        projections = {}
+        for user_id, (line_number, party_size, depth) in self._parties.items():
+            if party_size == 1 and line_number < self.line_count:
+                at = admitted[line_number] + depth * service[line_number]
+            else:
+                at = max((admitted[ln] + depth * service[ln] for ln in self.lines(line_number, party_size)), default=0)
+            projections[user_id] = (line_number, depth, at)
+        return projections
+
+    def head(self, line_number):
+        """User id at the front (lowest occupied depth) of a line, or None if it is empty."""
+        bits = self._bits[line_number]
+        if not bits:
+            return None
+        return self._cells[line_number][(bits & -bits).bit_length()]
+
+    def at(self, line_number, depth):
+        """User id of the party occupying a cell, or None."""
+        return self._cells[line_number].get(depth)
+
+    def parties_within(self, depth):
+        """User ids of the parties at depth `depth` or better, in any line."""
+        found = set()
+        for cells in self._cells:
+            for d in range(1, depth + 1):
+                user_id = cells.get(d)
+                if user_id is not None:
+                    found.add(user_id)
+        return found
+
+    def shape(self):
+        """Per line, ``(deepest occupied depth, free cells above it)``: how long the line is
+        and how many of its slots up to there would run empty."""
+        return [(bits.bit_length(), bits.bit_length() - bin(bits).count('1')) for bits in self._bits]
+
+    def party(self, user_id):
+        return self._parties.get(user_id)
+
+    def first_free(self, line_number):
+        return self._first_free[line_number]
+
+    def first_common_free(self, start, span):
+        """Earliest depth simultaneously free in lines ``start .. start + span - 1``."""
+        if span == 1:
+            return self._first_free[start]
+        bits = 0
+        for ln in range(start, start + span):
+            bits |= self._bits[ln]
+        return self.lowest_free(bits)
+
+    def find_position(self, party_size, requested_line=None, best_fit=False):
+        """Same contract as ``queue_logic._find_position``: ``(line, depth)`` or ``(-1, -1)``.
+
+        With ``best_fit``, ties between blocks at the earliest depth go to the block that
+        fits most tightly between occupied cells (see ``_best_block``) instead of the lowest.
+        """
+        line_count = self.line_count
+        if party_size <= 1:
+            if requested_line is not None:
+                if not 0 <= requested_line < line_count:
+                    return -1, -1
+                return requested_line, self._first_free[requested_line]
+            if not line_count:
+                return -1, -1
+            if best_fit:
+                return self._best_block(self._bits, 1)
+            best_depth = min(self._first_free)
+            return self._first_free.index(best_depth), best_depth
+
+        if party_size > line_count:
+            return -1, -1
+        if best_fit:
+            return self._best_block(self._bits, party_size)
+        best_start = -1
+        best_depth = None
+        for start in range(0, line_count - party_size + 1):
+            depth = self.first_common_free(start, party_size)
+            if best_depth is None or depth < best_depth:
+                best_start = start
+                best_depth = depth
+        return best_start, best_depth
+
+    def _block(self, bits, start, party_size):
+        """``(depth, tight)`` of the block of `party_size` lines from `start` in the `bits`
+        bitmaps: its first common free depth, and how many of its ends touch an occupied cell
+        (or the edge of the queue) at that depth."""
+        end = start + party_size
+        block = 0
+        for ln in range(start, end):
+            block |= bits[ln]
+        depth = self.lowest_free(block)
+        bit = 1 << (depth - 1)
+        tight = (start == 0 or bool(bits[start - 1] & bit)) + (end == self.line_count or bool(bits[end] & bit))
+        return depth, tight
+
+    def _best_block(self, bits, party_size):
+        """Earliest ``(line, depth)`` block of `party_size` lines in the `bits` bitmaps.
+
+        Among blocks at the same depth, prefer one whose ends touch an occupied cell (or the
+        edge of the queue) at that depth: it leaves no narrow gap beside it that only a
+        smaller party could use later. Then the lowest line.
+        """
+        best = None
+        for start in range(0, self.line_count - party_size + 1):
+            depth, tight = self._block(bits, start, party_size)
+            key = (depth, -tight, start)
+            if best is None or key < best:
+                best = key
+        return best[2], best[0]
+
+    def _ready_at(self, line_number, party_size, depth, service):
+        """Projected start of a slot, as ``party_projection`` projects it; with no `service`
+        times, just its depth."""
+        if service is None:
+            return depth
+        return max((self.admitted[ln] + depth * service[ln] for ln in self.lines(line_number, party_size)), default=0)
+
+    def repack(self, max_depth=None, service=None):
+        """Re-place parties across lines to close holes; returns ``{user_id: (line, depth)}`` moved.
+
+        Parties are taken in queue order (by depth, then line) and each is put in the block
+        of the grid rebuilt so far that starts it soonest: the lowest projected start
+        (``admitted[line] + depth * service[line]`` over its lines, with `service` the
+        seconds per slot of each line), then the best fit as in ``_best_block``. A party
+        only moves if that block is both shallower and projected strictly earlier than
+        where it is now, so nobody's estimate gets later, even when lines serve at different
+        rates; a pinned party only moves up its own line. Without `service`, depth alone
+        decides. Otherwise it keeps its cells. By induction those cells are still free when
+        its turn comes (parties before it only ever move to rows shallower than their own,
+        so none can have taken its row), so the pass can't fail.
+
+        Depth alone isn't the whole promise, though: a party's estimate assumes it moves up
+        a row every time the row in front of it is admitted. So the cells right above each
+        party (its lines, one row up) are reserved for it, and nobody else may move into
+        them; otherwise a later, smaller party could slip into the cell a spanning party is
+        waiting for and hold it back a slot. This is list scheduling:
+        O(parties * lines * party size) with bitmaps.
+
+        Only parties down to `max_depth` (default: all) are re-placed; deeper ones stay
+        put, and since nobody moves deeper, the re-placed ones never reach them.
+        """
+        line_count = self.line_count
+        deepest = max((bits.bit_length() for bits in self._bits), default=0)
+        limit = min(max_depth, deepest) if max_depth else deepest
+        order = []
+        seen = set()
+        reserved = [0] * line_count
+        # Parties one row past the window reserve cells in it too
+        for depth in range(1, limit + 2):
+            for ln in range(line_count):
+                user_id = self._cells[ln].get(depth)
+                if user_id is not None and user_id not in seen:
+                    seen.add(user_id)
+                    if depth <= limit:
+                        order.append(user_id)
+                    if depth > 1:
+                        line_number, party_size, _ = self._parties[user_id]
+                        for rl in self.lines(line_number, party_size):
+                            reserved[rl] |= 1 << (depth - 2)
+        keep = ~((1 << limit) - 1)
+        bits = [b & keep for b in self._bits]
+        moves = {}
+        for user_id in order:
+            line_number, party_size, depth = self._parties[user_id]
+            own = self.lines(line_number, party_size)
+            if depth > 1:
+                for ln in own:
+                    reserved[ln] &= ~(1 << (depth - 2))
+            taken = [b | r for b, r in zip(bits, reserved)]
+            ready_at = self._ready_at(line_number, party_size, depth, service)
+            starts = [line_number] if user_id in self._pinned else range(0, line_count - party_size + 1)
+            best = None
+            for start in starts:
+                new_depth, tight = self._block(taken, start, party_size)
+                new_at = self._ready_at(start, party_size, new_depth, service)
+                key = (new_at, new_depth, -tight, start)
+                if new_depth < depth and new_at < ready_at and (best is None or key < best):
+                    best = key
+            if best is not None:
+                line_number, depth = best[3], best[1]
+                moves[user_id] = (line_number, depth)
+            bit = 1 << (depth - 1)
+            for ln in self.lines(line_number, party_size):
+                bits[ln] |= bit
+                if depth > 1:
+                    reserved[ln] |= bit >> 1
+        # Released first, as a party may move into cells another one is leaving
+        entries = {user_id: (self._parties[user_id][1], user_id in self._pinned) for user_id in moves}
+        for user_id in moves:
+            self.release(user_id)
+        for user_id, (line_number, depth) in moves.items():
+            party_size, pinned = entries[user_id]
+            self.place(user_id, line_number, party_size, depth, pinned)
+        return moves
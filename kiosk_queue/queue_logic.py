@@ -1,320 +1,566 @@
 from flask import current_app
-from .models import User, Queue, LineStatus
+from sqlalchemy.exc import OperationalError
+from .occupancy import OccupancyGrid
+from .metrics import get_metrics, instrumented, timer
+from .service_stats import ServiceStats
+from .workers import after_db
+import functools
+import secrets
 import time
-from .db import db
-
-def get_public_queue():
-    users = User.query.order_by(User.line_number, User.place_in_queue).all()
-    first_in_line_ids = set()
-    seen_lines = set()
-    for u in users:
-        if u.line_number not in seen_lines:
-            first_in_line_ids.add(u.id)
-            seen_lines.add(u.line_number)
-    user_list = []
-    for user in users:
-        entry = {
-            'id': user.id,
-            'party_size': user.party_size,
-            'place_in_queue': user.place_in_queue,
-            'line_number': user.line_number,
-            'name': user.name
-        }
-        # if user.id in first_in_line_ids:
-        #     entry['name'] = user.name
-        user_list.append(entry)
-    return user_list
-
-def get_admin_queue_data():
-    users = User.query.order_by(User.line_number, User.place_in_queue).all()
-    return [{'id': user.id, 'name': user.name, 'email': user.email, 'party_size': user.party_size, 'place_in_queue': user.place_in_queue, 'line_number': user.line_number} for user in users]
-
-def _ensure_line_status():
-    line_count = current_app.config['LINE_COUNT']
-    existing = {ls.line_number: ls for ls in LineStatus.query.all()}
-    changed = False
-    for i in range(line_count):
-        if i not in existing:
-            db.session.add(LineStatus(line_number=i, last_admitted_time=int(time.time())))  # type: ignore[arg-type]
-            changed = True
-    if changed:
-        db.session.commit()
-
-def _compute_wait_times():
+
+def _store():
+    """The app's QueueStore (see storage.py); every read and write below goes through it."""
+    return current_app.extensions['kiosk_queue_store']
+
+@instrumented('public_queue')
+def get_public_queue(queue_id=None):
+    queue = _get_queue(queue_id)
+    if not queue:
+        return []
+    parties = _store().list_parties(queue.id)
+    return [{'id': p['id'], 'party_size': p['party_size'], 'place_in_queue': p['place_in_queue'], 'line_number': p['line_number'], 'name': p['name']} for p in parties]
+
+@instrumented('admin_queue')
+def get_admin_queue_data(queue_id=None):
+    queue = _get_queue(queue_id)
+    if not queue:
+        return []
+    parties = _store().list_parties(queue.id)
+    return [{'id': p['id'], 'name': p['name'], 'email': p['email'], 'party_size': p['party_size'], 'place_in_queue': p['place_in_queue'], 'line_number': p['line_number']} for p in parties]
+
+def queue_settings(queue):
+    """LINE_COUNT/SLOT_TIME/RESET_TIME for a queue: its own columns, else the app config."""
+    config = current_app.config
+    return {
+        'line_count': queue.line_count if queue.line_count is not None else config['LINE_COUNT'],
+        'slot_time': queue.slot_time if queue.slot_time is not None else config['SLOT_TIME'],
+        'reset_time': queue.reset_time if queue.reset_time is not None else config['RESET_TIME'],
+    }
+
+def _compute_wait_times(queue_id=None):
     """Compute dynamic wait estimates:
     Returns dict with:
       per_line_single: wait time (minutes) if a size-1 party joined each line now
       per_span: mapping span_size -> estimated wait (minutes) for a new party spanning that many lines placed at optimal start.
-    Formula per line slot depth k: last_admitted_time[line] + k*(SLOT_TIME+RESET_TIME).
+      per_line_single_p90, per_span_p90: the same, but a wait 9 in 10 parties stay under.
+    Formula per line slot depth k: last_admitted_time[line] + k*service[line], where service is
+    the line's median (p90) time per slot measured from recent admits (see ServiceStats),
+    SLOT_TIME+RESET_TIME until the line has been admitted from.
     For spanning size S we find minimal max over S contiguous lines at their next slot depth.
+    Read from the occupancy grid, which caches the projected start times until the queue
+    or a line's last admitted time changes, so only the subtraction from `now` is per call.
     """
-    _ensure_line_status()
-    slot_time = current_app.config['SLOT_TIME']
-    reset_time = current_app.config['RESET_TIME']
-    line_count = current_app.config['LINE_COUNT']
-    span_total = slot_time + reset_time
-    # Build occupancy sets of depths per line to capture holes (e.g., depth 1 free while depth 2 occupied by spanning party)
-    occupancy = [set() for _ in range(line_count)]
-    for u in User.query.order_by(User.place_in_queue).all():
-        if u.line_number is None:
-            continue
-        for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-            occupancy[ln].add(u.place_in_queue)
-    statuses = {ls.line_number: ls for ls in LineStatus.query.all()}
-    now = int(time.time())
-    def earliest_free_depth(line):
-        depth = 1
-        occ = occupancy[line]
-        while depth in occ:
-            depth += 1
-        return depth
-
-    per_line_single = []
-    for ln in range(line_count):
-        ls = statuses.get(ln)
-        last_time = ls.last_admitted_time if ls else now
-        depth = earliest_free_depth(ln)
-        wait_seconds = last_time + depth * span_total * 60 - now
-        per_line_single.append(max(0, wait_seconds // 60))
-    per_span = {}
-    for span in range(2, line_count+1):
-        best_projected = None
-        for start in range(0, line_count - span + 1):
-            # Find earliest depth simultaneously free across span contiguous lines
-            depth = 1
-            # Upper bound for search: current max depth observed + span (avoid infinite loop); derive rough cap
-            depth_cap = 1
-            for ln in range(start, start+span):
-                if occupancy[ln]:
-                    depth_cap = max(depth_cap, max(occupancy[ln]) + span + 5)
-            while True:
-                if all(depth not in occupancy[ln] for ln in range(start, start+span)):
-                    break
-                depth += 1
-                if depth > depth_cap:  # safety guard
-                    break
-            # If depth exceeded cap, skip this start
-            if depth > depth_cap:
-                continue
-            # Compute projected readiness as max across involved lines at that depth
-            line_times = []
-            for ln in range(start, start+span):
-                lt = statuses[ln].last_admitted_time if ln in statuses else now
-                line_times.append(lt + depth * span_total * 60)
-            projected = max(line_times)
-            if best_projected is None or projected < best_projected:
-                best_projected = projected
-        if best_projected is not None:
-            per_span[span] = max(0, (best_projected - now)//60)
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'per_line_single': [], 'per_span': {}, 'per_line_single_p90': [], 'per_span_p90': {}}
+    return _wait_detail(queue)
+
+@instrumented('wait_times')
+def _wait_detail(queue, now=None):
+    """_compute_wait_times for a queue already looked up, as of `now` (default: the current time)."""
+    grid = _get_grid(queue)
+    with grid.lock:
+        p50, p90 = _service_stats(queue, grid).quantiles()
+        per_line_at, per_span_at = grid.wait_projection(p50)
+        per_line_at_p90, per_span_at_p90 = grid.wait_projection(p90)
+    if now is None:
+        now = int(time.time())
     return {
-        'per_line_single': per_line_single,
-        'per_span': per_span
+        'per_line_single': _minutes_from(now, per_line_at),
+        'per_span': _minutes_from(now, per_span_at),
+        'per_line_single_p90': _minutes_from(now, per_line_at_p90),
+        'per_span_p90': _minutes_from(now, per_span_at_p90),
     }
 
-def broadcast_queue_update():
-    socketio = current_app.extensions.get('socketio')
-    if not socketio:
-        return
-    queue = Queue.query.first()
-    wait_time = queue.wait_time if queue else 0
-    wait_detail = _compute_wait_times()
-
-    # Broadcast separately to admin and public rooms inside /queue namespace
-    admin_user_list = get_admin_queue_data()
-    socketio.emit('queue_update', {'queue': admin_user_list, 'wait_time': wait_time, 'wait_detail': wait_detail}, to='admin', namespace='/queue')
-
-    public_user_list = get_public_queue()
-    socketio.emit('queue_update', {'queue': public_user_list, 'wait_time': wait_time, 'wait_detail': wait_detail}, to='public', namespace='/queue')
-
-def _build_occupancy():
-    """Return a list of sets. occupancy[line] = set of depth rows occupied in that line.
-    A user spans party_size lines starting at user.line_number. We mark each covered line for the user's depth (place_in_queue)."""
-    line_count = current_app.config['LINE_COUNT']
-    occupancy = [set() for _ in range(line_count)]
-    for u in User.query.all():
-        if u.line_number is None:
-            continue
-        for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-            occupancy[ln].add(u.place_in_queue)
-    return occupancy
-
-def _find_position(party_size, requested_line=None):
+def _minutes_from(now, times):
+    """Whole minutes from `now` until each of `times` (a list, or a dict's values), at least 0."""
+    if isinstance(times, dict):
+        return {key: max(0, int(at - now) // 60) for key, at in times.items()}
+    return [max(0, int(at - now) // 60) for at in times]
+
+def _service_stats(queue, grid):
+    """The queue's rolling per-line service-time statistics (kept beside its grid, in memory).
+    Their prior follows the queue's SLOT_TIME + RESET_TIME."""
+    settings = queue_settings(queue)
+    all_stats = current_app.extensions.setdefault('kiosk_queue_service_stats', {})
+    stats = all_stats.get(queue.id)
+    if stats is None or stats.line_count != grid.line_count:
+        stats = all_stats[queue.id] = ServiceStats(grid.line_count, alpha=current_app.config['KIOSK_QUEUE_SERVICE_ALPHA'])
+    stats.prior = (settings['slot_time'] + settings['reset_time']) * 60
+    return stats
+
+def get_party_position(token):
+    """Place and estimated wait of the party holding `token` (returned by /join), or None if
+    it isn't queued. One indexed lookup, then the grid: the queue is never scanned."""
+    found = _store().find_token(token) if isinstance(token, str) else None
+    if found is None:
+        return None
+    queue_id, user_id = found
+    queue = _get_queue(queue_id)
+    grid = _get_grid(queue)
+    with grid.lock:
+        entry = grid.party(user_id)
+        if entry is None:
+            return None
+        p50, p90 = _service_stats(queue, grid).quantiles()
+        ready_at = grid.party_projection(user_id, p50)
+        ready_at_p90 = grid.party_projection(user_id, p90)
+    line_number, party_size, depth = entry
+    now = int(time.time())
+    position = party_position(user_id, line_number, depth, ready_at, now, queue.version)
+    position.update(queue_id=queue_id, party_size=party_size, wait_minutes_p90=_minutes_from(now, [ready_at_p90])[0])
+    return position
+
+def party_position(user_id, line_number, depth, ready_at, now, seq):
+    """The ``position`` payload of a queued party: where it stands, the (p50) projected time
+    its turn starts, and the minutes until then as of `now`."""
+    return {'id': user_id, 'queued': True, 'line_number': line_number, 'place_in_queue': depth,
+            'ready_at': int(ready_at), 'wait_minutes': _minutes_from(now, [ready_at])[0], 'seq': seq}
+
+def party_projections(queue):
+    """``{user_id: (line_number, place_in_queue, projected start)}`` of every party queued."""
+    grid = _get_grid(queue)
+    with grid.lock:
+        p50, _ = _service_stats(queue, grid).quantiles()
+        return grid.party_projections(p50)
+
+def broadcast_queue_update(queue_id):
+    """Ask the broadcaster for a (coalesced) queue_delta emit to the queue's admin and public rooms.
+    Called from DB pool threads, so the request itself is made back on the caller's thread."""
+    broadcaster = current_app.extensions.get('kiosk_queue_broadcaster')
+    if broadcaster:
+        after_db(broadcaster.request_update, queue_id)
+
+def _archive():
+    """The app's EventArchive (see archive.py), or None when no history is kept."""
+    return current_app.extensions.get('kiosk_queue_archive')
+
+def _archive_removals(queue_id, ts, kind, user_ids, moves):
+    """Record `kind` ("admit" or "remove") for `user_ids` and the compaction `moves` it caused.
+    Called under the queue's grid lock, so one queue's events are archived in commit order."""
+    archive = _archive()
+    if archive is not None:
+        events = [(kind, user_id) for user_id in user_ids]
+        events.extend(('compact', user_id, depth, line) for user_id, (line, depth) in moves.items())
+        archive.record(queue_id, ts, events)
+
+def _notifier():
+    """The app's NotificationDispatcher (see notifications.py), or None when nothing is sent."""
+    return current_app.extensions.get('kiosk_queue_notifier')
+
+def _notify_up_soon(store, queue, parties, ts):
+    """Add an "up_soon" outbox row for each of `parties` ``(user_id, email, email_consent,
+    place_in_queue)`` that agreed to be contacted. Called inside the write, so the rows
+    commit with it; returns whether any were added."""
+    rows = [{'queue_id': queue.id, 'user_id': user_id, 'kind': 'up_soon', 'address': email,
+             'place_in_queue': depth, 'created_at': ts}
+            for user_id, email, consent, depth in parties if email and consent]
+    if rows:
+        store.add_notifications(rows)
+    return bool(rows)
+
+def _notify_moved_up(store, queue, grid, notifier, near, ts):
+    """Outbox "up_soon" for the parties that moved to within the notifier's range of the
+    front, `near` being the ids that were already there before the write."""
+    if notifier is None:
+        return False
+    arrived = grid.parties_within(notifier.within) - near
+    if not arrived:
+        return False
+    contacts = store.contacts(arrived)
+    return _notify_up_soon(store, queue, [(user_id, email, consent, grid.party(user_id)[2])
+                                          for user_id, (email, consent) in contacts.items()], ts)
+
+def _get_queue(queue_id=None):
+    """Queue for `queue_id`, or None if there is no such queue.
+    Without an id this is the default (lowest id) queue, created on first use so a
+    single-attraction deployment never has to create one explicitly."""
+    return _store().get_queue(queue_id)
+
+def create_queue_logic(name=None, line_count=None, slot_time=None, reset_time=None):
+    """Create another independent queue; unset settings fall back to the app config."""
+    return _store().create_queue(name=name, line_count=line_count, slot_time=slot_time, reset_time=reset_time)
+
+def _get_grid(queue, version=None):
+    """Return the queue's in-memory occupancy grid, rebuilding it from the store if it is stale.
+    The grid is stale when it wasn't built at `version` (default: queue.version), i.e. another
+    worker (or a manual DB edit) changed the queue since.
+    Each queue has its own grid and lock, so work on one queue never waits on another."""
+    line_count = queue_settings(queue)['line_count']
+    grids = current_app.extensions.setdefault('kiosk_queue_grids', {})
+    grid = grids.get(queue.id)
+    if grid is None or grid.line_count != line_count:
+        grid = grids[queue.id] = OccupancyGrid(line_count)
+    if version is None:
+        version = queue.version
+    with grid.lock:
+        if grid.version != version:
+            # Lines that never had an admit count as admitted now, as set_admitted would record
+            now = int(time.time())
+            admitted = {ln: now for ln in range(line_count)}
+            store = _store()
+            admitted.update(store.admitted_times(queue.id))
+            grid.rebuild(store.grid_rows(queue.id), version, admitted)
+    return grid
+
+def _lock_queue(queue, grid):
+    """Take the queue's write lock for the rest of the transaction; returns the new version.
+    Bumping the queue's version comes first because with the SQLAlchemy store that UPDATE is
+    the lock: a row lock on Postgres, the database write lock on SQLite, both held until
+    commit/rollback. Everything read after it, including the grid (re-synced here if another
+    worker got in first), stays valid until commit, so concurrent workers can never place two
+    parties in the same cell.
+    The caller holds grid.lock and sets grid.version to the returned version once committed."""
+    version = _store().begin_write(queue)
+    if grid.version != version - 1:
+        _get_grid(queue, version - 1)
+    return version
+
+def _retry_on_conflict(fn):
+    """Re-run a queue mutation that lost a write-lock race to another worker
+    (SQLite "database is locked", Postgres deadlock or serialization failure)."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config.get('KIOSK_QUEUE_WRITE_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError:
+                _store().rollback()
+                if attempt == retries:
+                    raise
+                metrics = get_metrics()
+                if metrics is not None:
+                    metrics.inc('kiosk_queue_write_conflicts_total')
+                time.sleep(0.01 * 2 ** attempt)
+    return wrapper
+
+def _find_position(grid, party_size, requested_line=None):
     """Determine starting line (for party) and depth (place_in_queue) according to new rules.
     Rules:
     - Party size 1: if requested_line provided, put in earliest free depth in that line; else choose line whose earliest free depth is minimal (tie -> lowest line index).
     - Party size >1: find contiguous block of lines of width party_size whose earliest common free depth (simultaneously free in every line) is minimal (tie -> lowest starting line).
     Returns (line_number, depth) or (-1,-1) if impossible (shouldn't happen with infinite depth model).
+    In optimized placement, ties at the earliest depth go to the tightest-fitting block.
+    Answered from the queue's in-memory occupancy grid rather than a table scan.
     """
-    line_count = current_app.config['LINE_COUNT']
-    occupancy = _build_occupancy()
-
-    # Helper to find earliest free depth in a given line
-    def earliest_free_depth(line):
-        depth = 1
-        occ = occupancy[line]
-        while depth in occ:
-            depth += 1
-        return depth
-
-    if party_size <= 1:
-        if requested_line is not None:
-            if not 0 <= requested_line < line_count:
-                return -1, -1
-            return requested_line, earliest_free_depth(requested_line)
-        # compute earliest depth per line, choose best
-        best_line = -1
-        best_depth = None
-        for ln in range(line_count):
-            d = earliest_free_depth(ln)
-            if best_depth is None or d < best_depth or (d == best_depth and (best_line == -1 or ln < best_line)):
-                best_line = ln
-                best_depth = d
-        return best_line if best_line != -1 else -1, best_depth if best_depth is not None else -1
-
-    # Multi-line spanning parties
-    if party_size > line_count:
-        return -1, -1  # cannot span more lines than exist
-
-    best_start = -1
-    best_depth = None
-    for start in range(0, line_count - party_size + 1):
-        depth = 1
-        while True:
-            # Check if depth free across all lines in span
-            if all(depth not in occupancy[ln] for ln in range(start, start + party_size)):
-                if best_depth is None or depth < best_depth or (depth == best_depth and (best_start == -1 or start < best_start)):
-                    best_start = start
-                    best_depth = depth
-                break
-            depth += 1
-            # Safety cap (unlikely to hit); stop after large iterations to avoid infinite loop
-            if depth > 10000:
-                break
-    if best_start == -1 or best_depth is None:
-        return -1, -1
-    return best_start, best_depth
-
-def _compact_queue(start_depth: int):
-    """Compact queue depths upward starting from start_depth to remove holes while preserving relative order constraints.
-    A user can move up one depth level if all lines it spans are free at the target depth.
-    Repeat until no moves occur. """
-    line_count = current_app.config['LINE_COUNT']
-    while True:
-        # Rebuild occupancy for current state each pass while allowing in-place moves this pass.
-        occupancy = [set() for _ in range(line_count)]
-        users = User.query.order_by(User.place_in_queue, User.line_number).all()
-        moved = False
-        for u in users:
-            if u.line_number is None:
-                continue
-            if u.place_in_queue <= start_depth:
-                for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-                    occupancy[ln].add(u.place_in_queue)
-                continue
-            target_depth = u.place_in_queue - 1
-            if target_depth < start_depth:
-                # shouldn't move above start_depth scope
-                for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-                    occupancy[ln].add(u.place_in_queue)
-                continue
-            can_move = True
-            for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-                if target_depth in occupancy[ln]:
-                    can_move = False
-                    break
-            if can_move:
-                u.place_in_queue = target_depth
-                moved = True
-                for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-                    occupancy[ln].add(target_depth)
-            else:
-                for ln in range(u.line_number, min(line_count, u.line_number + u.party_size)):
-                    occupancy[ln].add(u.place_in_queue)
-        if not moved:
-            break
-    db.session.flush()
-
-def join_queue_logic(name, email, party_size, line_number_req, email_consent):
-    if not name:
-        return {'error': 'Name is required'}, 400
+    return grid.find_position(party_size, requested_line, best_fit=_optimized_placement())
 
-    line_number, depth = _find_position(party_size, line_number_req)
-    if line_number == -1 or depth == -1:
-        return {'error': 'No available space in the queue for this party size.'}, 400
+@instrumented('compact')
+def _compact_queue(grid, removed, moves):
+    """Close the gap left by a removed party, preserving relative order constraints.
+    `removed` is the (line_number, party_size, depth) the party held. A user can move up
+    while all lines it spans are free at the target depth, but never above the removed depth.
+    The grid works out every party's final depth in one pass over the affected lines; they
+    are merged into `moves`, which the caller writes back once (one bulk UPDATE in SQL)."""
+    line_number, party_size, start_depth = removed
+    for user_id, depth in grid.compact(start_depth, grid.lines(line_number, party_size)).items():
+        moves[user_id] = (grid.party(user_id)[0], depth)
 
-    queue = Queue.query.first()
-    if not queue:
-        queue = Queue()
-        db.session.add(queue)
-        db.session.commit()
+def _optimized_placement():
+    """Whether KIOSK_QUEUE_PLACEMENT is "optimized" (best-fit joins, re-pack after removals)."""
+    return current_app.config['KIOSK_QUEUE_PLACEMENT'] == 'optimized'
 
-    # SQLAlchemy model accepts kwargs; type: ignore for static checker
-    print(email, email_consent)
-    new_user = User(name=name, email=email, party_size=party_size, line_number=line_number, place_in_queue=depth, email_consent=email_consent)  # type: ignore[arg-type]
-    db.session.add(new_user)
-    # queue.update_wait_time()
-    db.session.commit()
+def _repack_service(queue, grid):
+    """Median seconds per slot of each line, which re-packing compares projected starts by,
+    or None outside optimized placement."""
+    if not _optimized_placement():
+        return None
+    return _service_stats(queue, grid).quantiles()[0]
 
-    broadcast_queue_update()
+def _release(grid, user_id, moves, service=None):
+    """Take a party out of the grid and compact behind it; returns its grid entry.
+    In optimized placement (`service` from _repack_service) the queue is then re-packed
+    across lines (OccupancyGrid.repack). Doing both after every removal keeps a batch
+    identical to removing one at a time.
+    `moves` collects {user_id: (line_number, depth)} for the store."""
+    removed = grid.release(user_id)
+    moves.pop(user_id, None)
+    _compact_queue(grid, removed, moves)
+    if service is not None:
+        moves.update(grid.repack(current_app.config['KIOSK_QUEUE_REPACK_DEPTH'] or None, service))
+    return removed
 
-    return {'message': 'Successfully joined queue', 'place_in_queue': depth, 'line_number': line_number, 'wait_time': queue.wait_time}, 201
+def _record_admitted(queue, grid, spans, now):
+    """Set the last admitted time to `now` for every line of the (line_number, party_size) spans."""
+    lines = {ln for line_number, party_size in spans for ln in grid.lines(line_number, party_size)}
+    if lines:
+        _store().set_admitted(queue, lines, now, grid.line_count)
+    return lines
 
-def next_in_queue_logic(line_number):
-    if line_number is None:
-        return {'error': 'Line number is required'}, 400
+def _is_int(value):
+    """Whether a request value is an int (JSON true/false are bools, which are ints too)."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _valid_line(queue, line_number):
+    """Whether `line_number` is an int naming one of the queue's lines."""
+    return _is_int(line_number) and 0 <= line_number < queue_settings(queue)['line_count']
+
+def _party_error(queue, party):
+    """Why a party (a dict with the /join fields) can't be placed as given, or None."""
+    if not isinstance(party, dict) or not party.get('name'):
+        return 'Name is required'
+    if not isinstance(party['name'], str):
+        return 'Name must be a string'
+    if party.get('email') is not None and not isinstance(party['email'], str):
+        return 'Email must be a string'
+    party_size = party.get('party_size', 1)
+    if not _is_int(party_size) or party_size < 1:
+        return 'Party size must be a positive integer'
+    if party.get('line_number') is not None and not _valid_line(queue, party['line_number']):
+        return 'Invalid line number'
+    if not isinstance(party.get('email_consent', False), bool):
+        return 'email_consent must be true or false'
+    return None
+
+def _head(grid, line_number):
+    """Earliest (smallest depth) party whose span covers the line, read from the grid
+    (in sync while the queue is locked)."""
+    if not _is_int(line_number) or not 0 <= line_number < grid.line_count:
+        return None
+    return grid.head(line_number)
+
+def _place_parties(queue, parties):
+    """Place parties (dicts with the /join fields) in order, in one transaction.
+    Returns one (result, status) per party, as a single join would have returned it."""
+    store = _store()
+    results = []
+    placed = []
+    joined = []
+    grid = _get_grid(queue)
+    with grid.lock:
+        version = _lock_queue(queue, grid)
+        # Placements go into the grid before commit; rebuild it if anything fails
+        grid.invalidate()
+        for party in parties:
+            error = _party_error(queue, party)
+            if error:
+                results.append(({'error': error}, 400))
+                continue
+            party_size = party.get('party_size', 1)
+            line_number, depth = _find_position(grid, party_size, party.get('line_number'))
+            if line_number == -1 or depth == -1:
+                results.append(({'error': 'No available space in the queue for this party size.'}, 400))
+                continue
+            # Keyed by a placeholder until the store assigns the party's id
+            # A party that asked for its line is kept to it (see OccupancyGrid.repack)
+            pinned = party.get('line_number') is not None and party_size == 1
+            grid.place(('new', len(placed)), line_number, party_size, depth, pinned)
+            token = secrets.token_urlsafe(16)
+            placed.append({'name': party['name'], 'email': party.get('email'), 'party_size': party_size, 'line_number': line_number, 'place_in_queue': depth, 'email_consent': party.get('email_consent', False), 'token': token, 'pinned': pinned})
+            # The party's id is filled in once the store has assigned it
+            joined.append({'message': 'Successfully joined queue', 'place_in_queue': depth, 'line_number': line_number, 'wait_time': queue.wait_time, 'id': None, 'token': token})
+            results.append((joined[-1], 201))
+        if not placed:
+            store.rollback()
+            grid.version = version - 1
+            return results
+        ids = store.add_parties(queue.id, placed)
+        # queue.update_wait_time()
+        # Archived events are stamped while the lock is still held (see EventArchive)
+        ts = time.time()
+        notifier = _notifier()
+        notify = notifier is not None and _notify_up_soon(store, queue, [
+            (user_id, party['email'], party['email_consent'], party['place_in_queue'])
+            for user_id, party in zip(ids, placed) if party['place_in_queue'] <= notifier.within], ts)
+        with timer('commit'):
+            store.commit()
+        for i, user_id in enumerate(ids):
+            grid.place(user_id, *grid.release(('new', i)), placed[i]['pinned'])
+            joined[i]['id'] = user_id
+        grid.version = version
+        _service_stats(queue, grid).touched(grid, {ln for p in placed for ln in grid.lines(p['line_number'], p['party_size'])}, ts)
+        archive = _archive()
+        if archive is not None:
+            events = []
+            for user_id, party in zip(ids, placed):
+                events.append(('join', user_id, party['name'], party['party_size']))
+                events.append(('place', user_id, party['line_number'], party['place_in_queue']))
+            archive.record(queue.id, ts, events)
+
+    if notify:
+        notifier.wake()
+    broadcast_queue_update(queue.id)
+    return results
 
-    # Find earliest (smallest depth) user whose span covers the line
-    users = User.query.order_by(User.place_in_queue, User.line_number).all()
-    target = None
-    for u in users:
-        if u.line_number is None:
-            continue
-        if u.line_number <= line_number < u.line_number + u.party_size:
-            target = u
-            break
-
-    if target:
-        removed_depth = target.place_in_queue
-        db.session.delete(target)
-        _compact_queue(removed_depth)
+def _admit_heads(queue, line_numbers):
+    """Admit the head of each line in `line_numbers`, in order, in one transaction.
+    Heads are read from the grid, which is compacted after each admit, so a line listed
+    twice admits its first two parties. Returns the admitted user id (None for an empty
+    line) per entry; the store sees one delete and one batch of moves."""
+    store = _store()
+    admitted_ids = []
+    spans = []
+    moves = {}
+    grid = _get_grid(queue)
+    notifier = _notifier()
+    with grid.lock:
+        version = _lock_queue(queue, grid)
+        grid.invalidate()
+        # Parties already close to the front were told so when they got there
+        near = grid.parties_within(notifier.within) if notifier is not None else None
+        service = _repack_service(queue, grid)
+        for line_number in line_numbers:
+            user_id = _head(grid, line_number)
+            if user_id is not None:
+                line, party_size, _ = _release(grid, user_id, moves, service)
+                spans.append((line, party_size))
+            admitted_ids.append(user_id)
+        if not spans:
+            store.rollback()
+            grid.version = version - 1
+            return admitted_ids
+        ids = [user_id for user_id in admitted_ids if user_id is not None]
+        contacts = store.contacts(ids)
+        store.delete_parties(ids)
+        store.move_parties(moves)
         # Update last admitted time for each line spanned
-        _ensure_line_status()
-        statuses = {ls.line_number: ls for ls in LineStatus.query.all()}
-        now = int(time.time())
-        for ln in range(target.line_number, target.line_number + target.party_size):
-            if ln in statuses:
-                statuses[ln].last_admitted_time = now
-        queue = Queue.query.first()
+        ts = time.time()
+        now = int(ts)
+        lines = _record_admitted(queue, grid, spans, now)
+        notify = _notify_moved_up(store, queue, grid, notifier, near, ts)
         # if queue:
         #     queue.update_wait_time()
-        db.session.commit()
-        broadcast_queue_update()
-        file_server = current_app.extensions.get('file_server')
-        if file_server:
-            file_server.log_recent_email(target.email, target.email_consent)
-    return {'message': f'Line {line_number} advanced'}
-
-def remove_from_queue_logic(user_id):
-    user = User.query.get(user_id)
-    if user:
-        removed_depth = user.place_in_queue
-        db.session.delete(user)
-        # Compact queue first to close gaps created by removal
-        _compact_queue(removed_depth)
-        # Only update last_admitted_time if the removed user was actually the next to be served (depth 1)
-        if removed_depth == 1:
-            _ensure_line_status()
-            statuses = {ls.line_number: ls for ls in LineStatus.query.all()}
-            now = int(time.time())
-            for ln in range(user.line_number, user.line_number + user.party_size):
-                if ln in statuses:
-                    statuses[ln].last_admitted_time = now
-        queue = Queue.query.first()
+        with timer('commit'):
+            store.commit()
+        stats = _service_stats(queue, grid)
+        stats.served(grid, lines, ts)
+        stats.touched(grid, range(grid.line_count), ts)
+        grid.set_admitted(lines, now)
+        grid.version = version
+        _archive_removals(queue.id, ts, 'admit', ids, moves)
+
+    if notify:
+        notifier.wake()
+    broadcast_queue_update(queue.id)
+    file_server = current_app.extensions.get('file_server')
+    if file_server:
+        for user_id in ids:
+            file_server.log_recent_email(*contacts[user_id])
+    return admitted_ids
+
+def _remove_parties(queue, user_ids):
+    """Remove parties from one queue in one transaction, compacting after each.
+    Returns whether each entry was queued (and is now removed)."""
+    store = _store()
+    found = []
+    removed = []
+    moves = {}
+    grid = _get_grid(queue)
+    notifier = _notifier()
+    with grid.lock:
+        version = _lock_queue(queue, grid)
+        grid.invalidate()
+        near = grid.parties_within(notifier.within) if notifier is not None else None
+        service = _repack_service(queue, grid)
+        for user_id in user_ids:
+            # The grid is in sync under the lock, so it knows exactly which parties are queued
+            queued = isinstance(user_id, int) and grid.party(user_id) is not None
+            if queued:
+                removed.append(_release(grid, user_id, moves, service))
+            found.append(queued)
+        if not removed:
+            store.rollback()
+            grid.version = version - 1
+            return found
+        removed_ids = [user_id for user_id, queued in zip(user_ids, found) if queued]
+        store.delete_parties(removed_ids)
+        store.move_parties(moves)
+        # Only update last admitted time if the removed party was actually the next to be served (depth 1)
+        ts = time.time()
+        now = int(ts)
+        lines = _record_admitted(queue, grid, [(line, size) for line, size, depth in removed if depth == 1], now)
+        notify = _notify_moved_up(store, queue, grid, notifier, near, ts)
         # if queue:
         #     queue.update_wait_time()
-        db.session.commit()
-        broadcast_queue_update()
+        with timer('commit'):
+            store.commit()
+        # A no-show at the front restarts the line's service clock without counting as a sample
+        stats = _service_stats(queue, grid)
+        stats.served(grid, lines, ts, sample=False)
+        stats.touched(grid, range(grid.line_count), ts)
+        grid.set_admitted(lines, now)
+        grid.version = version
+        _archive_removals(queue.id, ts, 'remove', removed_ids, moves)
+
+    if notify:
+        notifier.wake()
+    broadcast_queue_update(queue.id)
+    return found
+
+@instrumented('join')
+@_retry_on_conflict
+def join_queue_logic(name, email, party_size, line_number_req, email_consent, queue_id=None):
+    if not name:
+        return {'error': 'Name is required'}, 400
+
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'error': 'Queue not found'}, 404
+
+    party = {'name': name, 'email': email, 'party_size': party_size, 'line_number': line_number_req, 'email_consent': email_consent}
+    return _place_parties(queue, [party])[0]
+
+@instrumented('next')
+@_retry_on_conflict
+def next_in_queue_logic(line_number, queue_id=None):
+    if line_number is None:
+        return {'error': 'Line number is required'}, 400
+
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'error': 'Queue not found'}, 404
+    if not _valid_line(queue, line_number):
+        return {'error': 'Invalid line number'}, 400
+
+    _admit_heads(queue, [line_number])
+    return {'message': f'Line {line_number} advanced'}, 200
+
+@instrumented('remove')
+@_retry_on_conflict
+def remove_from_queue_logic(user_id, queue_id=None):
+    owner = _store().find_party_queue(user_id)
+    if owner is not None and (queue_id is None or owner == queue_id):
+        _remove_parties(_get_queue(owner), [user_id])
         # file_server = current_app.extensions.get('file_server')
         # if file_server:
         #     file_server.log_recent_email(user.email, user.email_consent)
-    return {'message': 'User removed'}
\ No newline at end of file
+    return {'message': 'User removed'}
+
+@instrumented('join_batch')
+@_retry_on_conflict
+def join_queue_batch_logic(parties, queue_id=None):
+    """Place several parties (dicts with the /join fields) in one transaction with one broadcast.
+    Parties are placed in order, exactly as consecutive joins would place them; each gets the
+    (result, status) a single join would have returned."""
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'error': 'Queue not found'}, 404
+    return {'results': _place_parties(queue, parties)}, 200
+
+@instrumented('next_batch')
+@_retry_on_conflict
+def next_in_queue_batch_logic(line_numbers, queue_id=None):
+    """Admit the head of each line in `line_numbers`, in order, in one transaction.
+    A line may be listed several times to admit that many parties from it; the outcome
+    matches calling next_in_queue_logic once per entry."""
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'error': 'Queue not found'}, 404
+    admitted = _admit_heads(queue, line_numbers)
+    return {'results': [
+        {'line_number': line_number, 'user_id': user_id, 'message': f'Line {line_number} advanced'}
+        for line_number, user_id in zip(line_numbers, admitted)
+    ]}, 200
+
+@instrumented('remove_batch')
+@_retry_on_conflict
+def remove_from_queue_batch_logic(user_ids, queue_id=None):
+    """Remove several parties from one queue (the default queue without `queue_id`) in one
+    transaction, compacting after each as remove_from_queue_logic would. Parties not in the
+    queue are reported with removed=False."""
+    queue = _get_queue(queue_id)
+    if not queue:
+        return {'error': 'Queue not found'}, 404
+    found = _remove_parties(queue, user_ids)
+    return {'results': [{'user_id': user_id, 'removed': removed} for user_id, removed in zip(user_ids, found)]}, 200
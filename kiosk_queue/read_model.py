@@ -0,0 +1,137 @@
+import bisect
+import json
+import time
+from collections import namedtuple
+from flask import current_app
+from .metrics import instrumented
+from .queue_logic import _get_grid, _store, _wait_detail
+
+PUBLIC_FIELDS = ('id', 'party_size', 'place_in_queue', 'line_number', 'name')
+WIRE_FORMATS = ('rows', 'columns')
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+class QueueEntry(namedtuple('QueueEntry', PUBLIC_FIELDS)):
+    """One party of the public list. A tuple rather than a dict: less than half the memory per
+    party, and the read model and broadcaster keep one per party of every queue."""
+
+    __slots__ = ()
+
+    def as_dict(self):
+        """The entry as sent in the row format (``get_public_queue``)."""
+        user_id, party_size, place_in_queue, line_number, name = self
+        return {'id': user_id, 'party_size': party_size, 'place_in_queue': place_in_queue,
+                'line_number': line_number, 'name': name}
+
+
+def columns(entries):
+    """The columnar wire format of QueueEntry tuples: ``{field: [value per party]}``, one
+    array per field of PUBLIC_FIELDS, in the same order as `entries`."""
+    if not entries:
+        return {field: [] for field in PUBLIC_FIELDS}
+    return dict(zip(PUBLIC_FIELDS, zip(*entries)))
+
+
+def wire_list(entries, format='rows'):
+    """``{'queue': [entry dicts]}`` in the row format, or ``{'columns': columns(entries)}``."""
+    if format == 'columns':
+        return {'columns': columns(entries)}
+    return {'queue': [entry.as_dict() for entry in entries]}
+
+
+@instrumented('public_queue')
+def public_entries(queue):
+    """The queue's parties as QueueEntry tuples, in ``get_public_queue`` order."""
+    return [QueueEntry(p['id'], p['party_size'], p['place_in_queue'], p['line_number'], p['name'])
+            for p in _store().list_parties(queue.id)]
+
+
+class PublicQueueView:
+    """What ``GET /queue`` serves for one queue at one ``Queue.version``.
+
+    Built once per version (per worker) from the store and shared by every poll and by the
+    Socket.IO broadcaster until the queue changes: the parties are kept as QueueEntry
+    tuples, the full list is JSON-encoded once per wire format, pages are list slices, and
+    a window around a party is a bisect over the parties ordered by depth. The summary's
+    counts and line depths are fixed for the version; its wait estimates are refreshed at
+    most once a minute, as that is their resolution.
+
+    The version is read before the parties, so a view is never older than its version (a
+    write landing in between shows up early, and the next poll rebuilds under the new one).
+    """
+
+    def __init__(self, queue, entries, grid):
+        self.queue_id = queue.id
+        self.version = queue.version
+        self.wait_time = queue.wait_time
+        self.entries = entries  # QueueEntry tuples, by line, then place in queue
+        self.etag = f'{queue.id}-{queue.version}'
+        self._by_id = {entry.id: entry for entry in entries}
+        self._by_depth = sorted(entries, key=lambda entry: (entry.place_in_queue, entry.line_number))
+        self._depths = [entry.place_in_queue for entry in self._by_depth]
+        with grid.lock:
+            line_depth = [depth for depth, _ in grid.shape()]
+        self._summary = (None, {
+            'size': len(entries),
+            'people': sum(entry.party_size for entry in entries),
+            'line_depth': line_depth,
+            'wait_time': self.wait_time,
+            'wait_detail': None,
+            'seq': self.version,
+        })  # (minute of the wait estimates, payload)
+        self._bodies = {}  # wire format -> encoded full list
+
+    def body(self, format='rows'):
+        """The full ``{queue, wait_time, seq}`` response (``{columns, wait_time, seq}`` in the
+        columnar format), JSON-encoded once per format."""
+        body = self._bodies.get(format)
+        if body is None:
+            body = self._bodies[format] = _encode(
+                dict(wire_list(self.entries, format), wait_time=self.wait_time, seq=self.version)
+            ).encode('utf-8')
+        return body
+
+    def page(self, offset, limit, format='rows'):
+        """`limit` parties (all, if None) from index `offset` of the full list."""
+        end = None if limit is None else offset + limit
+        return dict(wire_list(self.entries[offset:end], format), total=len(self.entries), offset=offset,
+                    wait_time=self.wait_time, seq=self.version)
+
+    def window(self, user_id, radius, format='rows'):
+        """The parties at most `radius` slots ahead of or behind party `user_id`, with its
+        position and how many parties are ahead of it; None if it isn't queued."""
+        party = self._by_id.get(user_id)
+        if party is None:
+            return None
+        depth = party.place_in_queue
+        start = bisect.bisect_left(self._depths, depth - radius)
+        end = bisect.bisect_right(self._depths, depth + radius)
+        return dict(
+            wire_list(self._by_depth[start:end], format),
+            position={'line_number': party.line_number, 'place_in_queue': depth,
+                      'parties_ahead': bisect.bisect_left(self._depths, depth)},
+            total=len(self.entries),
+            wait_time=self.wait_time,
+            seq=self.version,
+        )
+
+    def summary(self, queue):
+        """``(etag, payload)`` of the size, people, per-line depth and wait estimates, without
+        the list. Call with the queue looked up for this request; the waits are recomputed
+        when the minute changes."""
+        minute = int(time.time()) // 60
+        cached = self._summary
+        if cached[0] != minute:
+            payload = dict(cached[1], wait_detail=_wait_detail(queue, minute * 60))
+            cached = self._summary = (minute, payload)
+        return f'{self.etag}-{minute}', cached[1]
+
+
+def public_view(queue):
+    """The queue's PublicQueueView, rebuilt if the queue changed since it was last built."""
+    views = current_app.extensions.setdefault('kiosk_queue_views', {})
+    view = views.get(queue.id)
+    if view is None or view.version != queue.version:
+        view = views[queue.id] = PublicQueueView(queue, public_entries(queue), _get_grid(queue))
+    return view
+
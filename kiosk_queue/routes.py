@@ -1,78 +1,311 @@
-from flask import Blueprint, request, jsonify, current_app
-from .models import User, Queue
-from .db import db
+import hashlib
+import hmac
+import time
+from flask import Blueprint, request, jsonify, current_app, g
 from .queue_logic import (
     get_public_queue,
     get_admin_queue_data,
+    get_party_position,
     join_queue_logic,
     next_in_queue_logic,
     remove_from_queue_logic,
+    join_queue_batch_logic,
+    next_in_queue_batch_logic,
+    remove_from_queue_batch_logic,
+    queue_settings,
+    _get_grid,
+    _get_queue,
+    _store,
 )
+from .auth import admin_required, get_auth
+from .metrics import get_metrics
+from .read_model import WIRE_FORMATS, public_view
+from .workers import run_db
+
+def _read_queue(queue_id, reader):
+    """(wait_time, reader(queue.id)) for a queue, or None if it doesn't exist."""
+    queue = _get_queue(queue_id)
+    if not queue:
+        return None
+    return queue.wait_time, reader(queue.id)
+
+def _public_view(queue_id, summary):
+    """(view, summary etag and payload or None) for GET /queue, or None if there is no such queue."""
+    queue = _get_queue(queue_id)
+    if not queue:
+        return None
+    view = public_view(queue)
+    return view, view.summary(queue) if summary else None
+
+def _batch_items(data, key):
+    """The list under `key` of a batch request body, or an error response tuple."""
+    items = (data or {}).get(key)
+    if not isinstance(items, list):
+        return None, ({'error': f'{key} must be a list'}, 400)
+    limit = current_app.config['KIOSK_QUEUE_MAX_BATCH']
+    if len(items) > limit:
+        return None, ({'error': f'At most {limit} items per batch'}, 400)
+    return items, None
+
+def _cancel_by_address(address):
+    """Remove every queued party reached at `address`; returns how many there were."""
+    parties = _store().find_parties_by_address(address)
+    for queue_id, user_id in parties:
+        remove_from_queue_logic(user_id, queue_id=queue_id)
+    return len(parties)
+
+def _webhook_signed(secret):
+    """Whether the request carries a valid ``X-Webhook-Signature``: ``sha256=`` and the hex
+    HMAC-SHA256, keyed by `secret`, of ``<X-Webhook-Timestamp>.<raw body>``, with the
+    timestamp (POSIX seconds) recent enough that a captured request can't be replayed later."""
+    signature = request.headers.get('X-Webhook-Signature', '')
+    timestamp = request.headers.get('X-Webhook-Timestamp', '')
+    if not signature.startswith('sha256=') or not (timestamp.isascii() and timestamp.isdigit()):
+        return False
+    if abs(time.time() - int(timestamp)) > current_app.config['KIOSK_QUEUE_NOTIFY_WEBHOOK_TOLERANCE']:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), timestamp.encode('ascii') + b'.' + request.get_data(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[len('sha256='):].encode('utf-8'), expected.encode('ascii'))
+
+def _list_queues():
+    return [{'id': q.id, 'name': q.name, **queue_settings(q)} for q in _store().list_queues()]
+
+def _gauges():
+    """(name, labels, value) of the metrics read at scrape time rather than recorded."""
+    gauges = []
+    queue_ids = []
+    for queue in _store().list_queues():
+        queue_ids.append(queue.id)
+        gauges.append(('kiosk_queue_parties', (('queue', queue.id),), len(_get_grid(queue))))
+    namespace = current_app.extensions.get('kiosk_queue_namespace')
+    if namespace is not None:
+        for (room, queue_id), clients in namespace.client_counts(queue_ids).items():
+            gauges.append(('kiosk_queue_connected_clients', (('queue', queue_id), ('room', room)), clients))
+    return gauges
 
 def create_blueprint():
     bp = Blueprint('kiosk_queue', __name__)
 
-    @bp.route('/queue', methods=['GET'])
-    def get_queue():
-        queue = Queue.query.first()
-        if not queue:
-            return jsonify({'queue': [], 'wait_time': 0})
+    # Every view hands its DB work to run_db, which runs it on the bounded DB pool so a slow
+    # commit never blocks the Socket.IO event loop.
+
+    # Every queue route is served both at its plain path (default queue) and under
+    # /q/<queue_id>/ for a specific queue.
+    def queue_route(rule, **options):
+        def decorator(view):
+            bp.route(rule, **options)(view)
+            bp.route(f'/q/<int:queue_id>{rule}', **options)(view)
+            return view
+        return decorator
+
+    # With KIOSK_QUEUE_METRICS on, every request's latency and SQL statement count (summed
+    # by run_db across the pool threads it used) is recorded per endpoint
+    @bp.before_request
+    def start_request_metrics():
+        if get_metrics() is not None:
+            g.kiosk_queue_queries = 0
+            g.kiosk_queue_started = time.perf_counter()
 
-        user_list = get_public_queue()
-        
-        return jsonify({'queue': user_list, 'wait_time': queue.wait_time})
+    @bp.after_request
+    def record_request_metrics(response):
+        metrics = get_metrics()
+        if metrics is not None and 'kiosk_queue_started' in g:
+            labels = (('endpoint', request.endpoint.rpartition('.')[2]),)
+            metrics.observe('kiosk_queue_request_seconds', labels, time.perf_counter() - g.kiosk_queue_started)
+            metrics.observe('kiosk_queue_request_queries', labels, g.kiosk_queue_queries)
+        return response
 
+    @bp.route('/queues', methods=['GET'])
+    def list_queues():
+        return jsonify({'queues': run_db(_list_queues)})
 
-    @bp.route('/join', methods=['POST'])
-    def join_queue():
+    @queue_route('/queue', methods=['GET'])
+    def get_queue(queue_id=None):
+        # Served from a read model rebuilt only when the queue changes (see read_model.py), with
+        # an ETag so pollers get a bodiless 304 until it does. Query options:
+        #   ?summary=1                  counts, per-line depth and wait estimates only
+        #   ?offset=0&limit=50          one page of the list
+        #   ?around=<user id>&radius=5  the parties within `radius` slots of that party
+        #   ?format=columns             parallel arrays per field instead of one object per party
+        args = request.args
+        numbers = {name: args.get(name, type=int) for name in ('offset', 'limit', 'around', 'radius') if name in args}
+        if any(value is None or value < 0 for value in numbers.values()):
+            return jsonify({'error': 'offset, limit, around and radius must be non-negative integers'}), 400
+        offset = numbers.get('offset', 0)
+        limit = numbers.get('limit')
+        around = numbers.get('around')
+        radius = numbers.get('radius', 5)
+        summary = args.get('summary') in ('1', 'true')
+        wire_format = args.get('format', 'rows')
+        if wire_format not in WIRE_FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(WIRE_FORMATS)}"}), 400
+        found = run_db(_public_view, queue_id, summary)
+        if not found:
+            return jsonify({'error': 'Queue not found'}), 404
+        view, summary = found
+        etag = summary[0] if summary else view.etag
+        if wire_format != 'rows' and not summary:
+            etag = f'{etag}-{wire_format}'
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        elif summary:
+            response = jsonify(summary[1])
+        elif around is not None:
+            window = view.window(around, radius, wire_format)
+            if window is None:
+                return jsonify({'error': 'Party not in queue'}), 404
+            response = jsonify(window)
+        elif 'offset' in numbers or limit is not None:
+            response = jsonify(view.page(offset, limit, wire_format))
+        else:
+            response = current_app.response_class(view.body(wire_format), mimetype='application/json')
+        response.set_etag(etag)
+        # Caches may keep the response but must revalidate it on every use
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+
+    @bp.route('/position/<token>', methods=['GET'])
+    def get_position(token):
+        # A party's own place and wait, by the token /join returned (no queue id needed)
+        position = run_db(get_party_position, token)
+        if position is None:
+            return jsonify({'error': 'Party not in queue', 'queued': False}), 404
+        return jsonify(position)
+
+    @queue_route('/join', methods=['POST'])
+    def join_queue(queue_id=None):
         data = request.get_json()
         name = data.get('name')
         email = data.get('email')
         party_size = data.get('party_size', 1)
         line_number_req = data.get('line_number')
         email_consent = data.get('email_consent', False)
-        result, status_code = join_queue_logic(name, email, party_size, line_number_req, email_consent)
+        result, status_code = run_db(join_queue_logic, name, email, party_size, line_number_req, email_consent, queue_id=queue_id)
+        return jsonify(result), status_code
+
+
+    @queue_route('/join/batch', methods=['POST'])
+    def join_queue_batch(queue_id=None):
+        # {"parties": [{name, email, party_size, line_number, email_consent}, ...]}
+        parties, error = _batch_items(request.get_json(), 'parties')
+        if error:
+            return jsonify(error[0]), error[1]
+        result, status_code = run_db(join_queue_batch_logic, parties, queue_id=queue_id)
+        if status_code == 200:
+            result['results'] = [dict(item, status=item_status) for item, item_status in result['results']]
         return jsonify(result), status_code
 
 
+    @bp.route('/admin/login', methods=['POST'])
     @bp.route('/admin/check_password', methods=['POST'])
-    def check_password():
-        data = request.get_json()
-        if data.get('password') != current_app.config['ADMIN_PASSWORD']:
+    def login():
+        # The password is checked here only; admin routes and admin_connect take the returned
+        # token, as "Authorization: Bearer <token>" or a "token" field respectively
+        data = request.get_json(silent=True) or {}
+        auth = get_auth()
+        token, retry_after = auth.login(data.get('password'), request.remote_addr)
+        if token is None:
+            if retry_after:
+                return jsonify({'error': 'Too many failed logins', 'retry_after': retry_after}), 429, {'Retry-After': str(int(retry_after) + 1)}
             return jsonify({'error': 'Invalid password'}), 401
-        return jsonify({'message': 'Password is correct'}), 200
+        return jsonify({'message': 'Password is correct', 'token': token, 'expires_in': auth.ttl}), 200
+
+    @bp.route('/admin/metrics', methods=['GET', 'POST'])
+    def metrics():
+        # Prometheus text format. Scrapers can't refresh a token, so they may send the admin
+        # password as HTTP Basic auth (any user name) instead. It goes through the same
+        # rate-limited check as a login, but once verified each scrape costs only an HMAC
+        auth = request.authorization
+        if auth is not None and auth.type == 'basic':
+            ok, retry_after = get_auth().check(auth.password, request.remote_addr)
+            if not ok:
+                status = 429 if retry_after else 401
+                return jsonify({'error': 'Invalid password'}), status, {'WWW-Authenticate': 'Basic realm="kiosk-queue"'}
+        elif not get_auth().verify(auth.token if auth is not None else None):
+            return jsonify({'error': 'Invalid or expired token'}), 401, {'WWW-Authenticate': 'Basic realm="kiosk-queue"'}
+        metrics = get_metrics()
+        if metrics is None:
+            return jsonify({'error': 'Metrics are disabled (KIOSK_QUEUE_METRICS)'}), 404
+        body = metrics.render(run_db(_gauges))
+        return current_app.response_class(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @queue_route('/admin/queue', methods=['GET', 'POST'])
+    @admin_required
+    def get_admin_queue(queue_id=None):
+        found = run_db(_read_queue, queue_id, get_admin_queue_data)
+        if not found:
+            return jsonify({'error': 'Queue not found'}), 404
+        wait_time, user_list = found
 
-    @bp.route('/admin/queue', methods=['POST'])
-    def get_admin_queue():
-        data = request.get_json()
-        if data.get('password') != current_app.config['ADMIN_PASSWORD']:
-            return jsonify({'error': 'Invalid password'}), 401
-        
-        queue = Queue.query.first()
-        wait_time = queue.wait_time if queue else 0
-        
-        user_list = get_admin_queue_data()
-        
         return jsonify({'queue': user_list, 'wait_time': wait_time})
 
-    @bp.route('/admin/next', methods=['POST'])
-    def next_in_queue():
+    @queue_route('/admin/next', methods=['POST'])
+    @admin_required
+    def next_in_queue(queue_id=None):
         data = request.get_json()
-        if data.get('password') != current_app.config['ADMIN_PASSWORD']:
-            return jsonify({'error': 'Invalid password'}), 401
-
         line_number = data.get('line_number')
-        result = next_in_queue_logic(line_number)
-        return jsonify(result)
+        result, status_code = run_db(next_in_queue_logic, line_number, queue_id=queue_id)
+        return jsonify(result), status_code
 
-    @bp.route('/admin/remove', methods=['POST'])
-    def remove_from_queue():
+    @queue_route('/admin/remove', methods=['POST'])
+    @admin_required
+    def remove_from_queue(queue_id=None):
         data = request.get_json()
-        if data.get('password') != current_app.config['ADMIN_PASSWORD']:
-            return jsonify({'error': 'Invalid password'}), 401
-            
         user_id = data.get('user_id')
-        result = remove_from_queue_logic(user_id)
+        result = run_db(remove_from_queue_logic, user_id, queue_id=queue_id)
         return jsonify(result)
-        
-    return bp
\ No newline at end of file
+
+    @queue_route('/admin/next/batch', methods=['POST'])
+    @admin_required
+    def next_in_queue_batch(queue_id=None):
+        # {"line_numbers": [0, 2, 3]} advances several lines; {"line_number": 0, "count": 3} admits 3 parties from one
+        data = request.get_json()
+        if 'line_numbers' not in data and data.get('line_number') is not None:
+            count = data.get('count', 1)
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                return jsonify({'error': 'count must be a non-negative integer'}), 400
+            data = {'line_numbers': [data['line_number']] * min(count, current_app.config['KIOSK_QUEUE_MAX_BATCH'] + 1)}
+        line_numbers, error = _batch_items(data, 'line_numbers')
+        if error:
+            return jsonify(error[0]), error[1]
+        result, status_code = run_db(next_in_queue_batch_logic, line_numbers, queue_id=queue_id)
+        return jsonify(result), status_code
+
+    @queue_route('/admin/remove/batch', methods=['POST'])
+    @admin_required
+    def remove_from_queue_batch(queue_id=None):
+        data = request.get_json()
+        user_ids, error = _batch_items(data, 'user_ids')
+        if error:
+            return jsonify(error[0]), error[1]
+        result, status_code = run_db(remove_from_queue_batch_logic, user_ids, queue_id=queue_id)
+        return jsonify(result), status_code
+
+    @bp.route('/notifications/inbound', methods=['POST'])
+    def inbound_notification():
+        # Replies relayed by the messaging provider, as JSON {"from", "body"} or form
+        # From/Body fields; signed with the shared secret (see _webhook_signed), or carrying
+        # it as X-Webhook-Secret. Never in the URL, where proxies and access logs keep it
+        secret = current_app.config['KIOSK_QUEUE_NOTIFY_WEBHOOK_SECRET']
+        if not secret:
+            return jsonify({'error': 'Inbound messages are disabled'}), 404
+        given = request.headers.get('X-Webhook-Secret', '')
+        if not (_webhook_signed(secret) or (given and hmac.compare_digest(given.encode('utf-8'), secret.encode('utf-8')))):
+            return jsonify({'error': 'Invalid signature'}), 401
+        data = request.get_json(silent=True)
+        if data is None:
+            data = {}
+        elif not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        sender = data.get('from', request.form.get('From'))
+        body = data.get('body', request.form.get('Body', ''))
+        if not sender or not isinstance(sender, str):
+            return jsonify({'error': 'Sender is required'}), 400
+        if not isinstance(body, str):
+            return jsonify({'error': 'Body must be a string'}), 400
+        if body.strip().upper() != 'CANCEL':
+            return jsonify({'cancelled': 0})
+        return jsonify({'cancelled': run_db(_cancel_by_address, sender)})
+
+    return bp
@@ -0,0 +1,102 @@
+import hashlib
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from .db import db
+
+# Columns added after the first release: (table, column, DDL type/default).
+# db.create_all() never alters existing tables, so these are added in place.
+ADDED_COLUMNS = [
+    ("queue", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("queue", "name", "VARCHAR(100)"),
+    ("queue", "line_count", "INTEGER"),
+    ("queue", "slot_time", "INTEGER"),
+    ("queue", "reset_time", "INTEGER"),
+    ("user", "queue_id", "INTEGER REFERENCES queue (id)"),
+    ("user", "token", "VARCHAR(32)"),
+    ("user", "pinned", "BOOLEAN NOT NULL DEFAULT FALSE"),
+]
+
+# Tables whose constraints changed in a way ALTER TABLE can't express (SQLite can't drop a
+# UNIQUE constraint): (table, column whose absence marks the old layout). They only hold
+# derived state, so they are dropped and recreated.
+RECREATED_TABLES = [
+    ("line_status", "queue_id"),
+]
+
+# Indexes replaced by later ones, or no longer used (head-of-line is read from the grid).
+DROPPED_INDEXES = ["ix_user_line_place", "ix_user_place_line", "ix_user_queue_place_line"]
+
+# One row holding the fingerprint of the schema the DB was last created/upgraded for
+SCHEMA_TABLE = db.Table("kiosk_queue_schema", db.Column("version", db.String(64), primary_key=True))
+
+def schema_version():
+    """Fingerprint of the current models and the upgrade steps above; changes whenever a
+    table, column, type or index does, so nobody has to remember to bump it."""
+    parts = [repr((ADDED_COLUMNS, RECREATED_TABLES, DROPPED_INDEXES))]
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{c.name}:{c.type}:{c.nullable}" for c in table.columns)
+        parts.extend(sorted(f"{i.name}:{i.unique}:{','.join(c.name for c in i.columns)}" for i in table.indexes))
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+def schema_is_current():
+    """Whether the DB records the current schema_version (one SELECT)."""
+    try:
+        version = db.session.execute(text(f"SELECT version FROM {SCHEMA_TABLE.name}")).scalar()
+    except DBAPIError:  # no version table: a new DB, or one from before versioning
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return version == schema_version()
+
+def ensure_schema():
+    """Create and upgrade the tables unless the DB is already at the current schema
+    version; returns whether anything was run."""
+    if schema_is_current():
+        return False
+    db.create_all()
+    upgrade_schema()
+    return True
+
+def upgrade_schema():
+    """Bring an existing SQLite/Postgres DB up to the current models (columns and indexes)."""
+    inspector = inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    recreated = False
+    for table, marker in RECREATED_TABLES:
+        if marker not in {c["name"] for c in inspector.get_columns(table)}:
+            db.metadata.tables[table].drop(db.engine)
+            recreated = True
+    if recreated:
+        db.create_all()
+    changed = False
+    for table, column, ddl in ADDED_COLUMNS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing:
+            db.session.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}"))
+            changed = True
+    if changed:
+        db.session.commit()
+    _assign_default_queue(quote)
+    for name in DROPPED_INDEXES:
+        db.session.execute(text(f"DROP INDEX IF EXISTS {quote(name)}"))
+    db.session.commit()
+    # create_all() skips existing tables entirely, including indexes declared on them since
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    SCHEMA_TABLE.create(db.engine, checkfirst=True)
+    db.session.execute(SCHEMA_TABLE.delete())
+    db.session.execute(SCHEMA_TABLE.insert().values(version=schema_version()))
+    db.session.commit()
+
+def _assign_default_queue(quote):
+    """Rows from before multi-queue support belong to the default (lowest id) queue."""
+    user = quote("user")
+    orphans = db.session.execute(text(f"SELECT COUNT(*) FROM {user} WHERE queue_id IS NULL")).scalar()
+    if not orphans:
+        return
+    if db.session.execute(text("SELECT COUNT(*) FROM queue")).scalar() == 0:
+        db.session.execute(text("INSERT INTO queue (wait_time, version) VALUES (0, 0)"))
+    db.session.execute(text(f"UPDATE {user} SET queue_id = (SELECT MIN(id) FROM queue) WHERE queue_id IS NULL"))
+    db.session.commit()
@@ -0,0 +1,94 @@
+import math
+
+# Standard normal quantile of 0.9: p90 of a lognormal is exp(mean + Z90 * sd) of its logs
+Z90 = 1.2815515655446004
+# Spread assumed before a line has admits of its own: a log-sd of 0.5 puts p90 at about 1.9x
+# the median. Decays like the mean's prior, so a few similar admits can't collapse p90 onto p50
+PRIOR_VAR = 0.25
+
+
+class LineServiceStats:
+    """Rolling estimate of one line's service time (seconds between admits while it is busy).
+
+    Keeps an exponentially weighted mean and variance of the log of each sample, so memory
+    is constant and an update is O(1); ``alpha`` sets how fast old samples fade (0.1 weighs
+    roughly the last 20 admits). Service times are positive and right-skewed, so they are
+    modelled as lognormal: the median is ``exp(mean)`` and the 90th percentile
+    ``exp(mean + Z90 * sd)``. Both moments start from a prior, the configured slot time and
+    PRIOR_VAR, and samples are blended into them, so neither a single fast or slow admit
+    nor a handful of similar ones makes the estimate overconfident.
+    """
+
+    __slots__ = ('alpha', 'mean', 'var')
+
+    def __init__(self, alpha, prior):
+        self.alpha = alpha
+        self.mean = math.log(max(prior, 1.0))
+        self.var = PRIOR_VAR
+
+    def add(self, seconds):
+        diff = math.log(max(seconds, 1.0)) - self.mean
+        self.mean += self.alpha * diff
+        self.var = (1 - self.alpha) * (self.var + self.alpha * diff * diff)
+
+    def p50(self):
+        return math.exp(self.mean)
+
+    def p90(self):
+        return math.exp(self.mean + Z90 * math.sqrt(self.var))
+
+
+class ServiceStats:
+    """Per-line service-time statistics of one queue, fed by admits.
+
+    A sample is the time from when a line's front party started being served (the previous
+    admit from that line, or the party's arrival at the front of an empty line) to its
+    admit, so time a line spends empty never counts as service. Lines without samples
+    estimate ``prior`` seconds per slot, with the p90 of PRIOR_VAR around it.
+
+    Kept in memory per process and updated under the queue's grid lock; estimates are read
+    without touching the DB.
+    """
+
+    def __init__(self, line_count, alpha=0.1, prior=0):
+        self.line_count = line_count
+        self.alpha = alpha
+        self.prior = prior
+        self._lines = [None] * line_count  # LineServiceStats, once a line has a sample
+        self._started = [None] * line_count  # when the line's front party started being served
+
+    def served(self, grid, lines, ts, sample=True):
+        """The front party of each of `lines` left at `ts` (admitted, or removed as a no-show
+        with ``sample=False``). Call before ``grid.set_admitted``: ``grid.admitted`` then still
+        holds the previous admit, which may have come from another worker."""
+        for ln in lines:
+            started = self._started[ln]
+            if sample and started is not None:
+                seconds = ts - max(started, grid.admitted[ln])
+                if seconds > 0:
+                    stats = self._lines[ln]
+                    if stats is None:
+                        stats = self._lines[ln] = LineServiceStats(self.alpha, self.prior)
+                    stats.add(seconds)
+            self._started[ln] = ts if grid.head(ln) is not None else None
+
+    def touched(self, grid, lines, ts):
+        """Parties joined or left `lines` at `ts`; starts or stops their service clocks."""
+        for ln in lines:
+            if grid.head(ln) is None:
+                self._started[ln] = None
+            elif self._started[ln] is None:
+                self._started[ln] = ts
+
+    def quantiles(self):
+        """``(p50, p90)``: per-line lists of the expected seconds per slot."""
+        p50 = []
+        p90 = []
+        for stats in self._lines:
+            if stats is None:
+                p50.append(self.prior)
+                p90.append(self.prior * math.exp(Z90 * math.sqrt(PRIOR_VAR)))
+            else:
+                p50.append(stats.p50())
+                p90.append(stats.p90())
+        return p50, p90
@@ -1,34 +1,116 @@
 from flask import request, current_app
-from flask_socketio import Namespace, emit, join_room, leave_room
-from .models import Queue
-from .queue_logic import get_admin_queue_data, broadcast_queue_update
+from flask_socketio import Namespace, emit, join_room, leave_room, rooms
+from .auth import admin_required
+from .broadcast import ROOMS, room_name
+from .metrics import get_metrics
+from .queue_logic import get_party_position, _get_queue
+from .read_model import WIRE_FORMATS
+from .workers import run_db
+
+def _snapshot(queue_id, room, wire_format):
+    return current_app.extensions['kiosk_queue_broadcaster'].snapshot(queue_id, room, wire_format)
+
+def _send_snapshot(queue_id, room, wire_format='rows'):
+    """Send this client the full queue_update for `room` of a queue, in `wire_format`."""
+    payload = _snapshot(queue_id, room, wire_format)
+    emit('queue_update', payload, to=request.sid)
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.emitted('queue_update', room, payload, 1)
+
+def _queue_id(queue_id):
+    queue = _get_queue(queue_id)
+    return queue.id if queue else None
+
+def _subscribe_party(token):
+    """Put this client in the room of the party holding `token` and send it the party's
+    position; from then on it gets a 'position' event only when that position changes."""
+    position = run_db(get_party_position, token)
+    if position is None:
+        emit('position', {'queued': False}, to=request.sid)
+        return
+    join_room(room_name('party', position['id']))
+    emit('position', position, to=request.sid)
+
+def _current_room():
+    """(room, queue_id) this client is subscribed to, e.g. ('public', 3)."""
+    for name in rooms():
+        room, _, queue_id = name.partition(':')
+        if room in ('admin', 'public') and queue_id.isdigit():
+            return room, int(queue_id)
+    return None, None
 
 class QueueNamespace(Namespace):
-    def on_connect(self):  # client connected to /queue namespace
-        join_room('public')
-        broadcast_queue_update()
+    def __init__(self, namespace=None):
+        super().__init__(namespace)
+        self._formats = {}  # sid -> wire format of the clients that asked for 'columns'
+
+    def client_counts(self, queue_ids):
+        """{(room, queue_id): clients of this worker subscribed}, for each of ROOMS of each queue."""
+        manager = self.socketio.server.manager
+        return {
+            (room, queue_id): sum(1 for _ in manager.get_participants(self.namespace, room_name(room, queue_id)))
+            for queue_id in queue_ids for room in ROOMS
+        }
+
+    def on_connect(self, auth=None):  # client connected to /queue namespace
+        # A party's own device can connect with {auth: {token}} (from /join) to follow just its
+        # position, without the queue-wide rooms and their full-list payloads
+        token = (auth or {}).get('token')
+        if token:
+            _subscribe_party(token)
+            return
+        # Clients pick a queue with {auth: {queue_id}} or ?queue_id=; default queue otherwise
+        queue_id = (auth or {}).get('queue_id') or request.args.get('queue_id', type=int)
+        # ... and may ask for public snapshots in the columnar format with {auth: {format: 'columns'}}
+        wire_format = (auth or {}).get('format') or request.args.get('format', 'rows')
+        if wire_format not in WIRE_FORMATS:
+            return False
+        queue_id = run_db(_queue_id, queue_id)
+        if queue_id is None:
+            return False
+        if wire_format != 'rows':
+            self._formats[request.sid] = wire_format
+        join_room(room_name('public', queue_id))
+        # Only the new client needs the full queue; everyone else is already in sync
+        _send_snapshot(queue_id, 'public', wire_format)
+
+    def on_resync(self):
+        # Client missed a queue_delta (seq gap); send it a fresh full snapshot
+        room, queue_id = _current_room()
+        if room:
+            _send_snapshot(queue_id, room, self._formats.get(request.sid, 'rows'))
 
     def on_disconnect(self):
-        # Rooms auto-cleaned by flask-socketio; nothing needed
-        pass
+        # Rooms auto-cleaned by flask-socketio
+        self._formats.pop(request.sid, None)
 
+    def on_subscribe_party(self, data):
+        _subscribe_party((data or {}).get('token'))
+
+    def on_unsubscribe_party(self):
+        for name in rooms():
+            if name.startswith('party:'):
+                leave_room(name)
+
+    @admin_required
     def on_admin_connect(self, data):
-        password = (data or {}).get('password')
-        if password != current_app.config['ADMIN_PASSWORD']:
-            emit('admin_error', {'error': 'Invalid password'})
+        # {token} from /admin/login; checked once here, the admin room is kept until admin_leave
+        _, queue_id = _current_room()
+        if queue_id is None:
             return
-        leave_room('public')
-        join_room('admin')
-        queue = Queue.query.first()
-        wait_time = queue.wait_time if queue else 0
-        admin_user_list = get_admin_queue_data()
-        emit('queue_update', {'queue': admin_user_list, 'wait_time': wait_time}, to=request.sid)
+        leave_room(room_name('public', queue_id))
+        join_room(room_name('admin', queue_id))
+        _send_snapshot(queue_id, 'admin')
         emit('admin_status', {'role': 'admin'})
 
     def on_admin_leave(self):
-        leave_room('admin')
-        join_room('public')
-        broadcast_queue_update()
+        _, queue_id = _current_room()
+        if queue_id is None:
+            return
+        leave_room(room_name('admin', queue_id))
+        join_room(room_name('public', queue_id))
+        _send_snapshot(queue_id, 'public', self._formats.get(request.sid, 'rows'))
 
 def create_socket_namespace(socketio):
     ns = QueueNamespace('/queue')
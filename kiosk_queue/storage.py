@@ -0,0 +1,583 @@
+import abc
+import json
+import os
+import secrets
+import threading
+from sqlalchemy import case, delete, update
+from .db import db
+from .models import User, Queue, LineStatus, Notification
+from .workers import native_rlock
+
+PARTY_FIELDS = ('id', 'name', 'email', 'party_size', 'place_in_queue', 'line_number', 'email_consent')
+NOTIFICATION_FIELDS = ('id', 'queue_id', 'user_id', 'kind', 'address', 'place_in_queue', 'attempts')
+
+
+class QueueStore(abc.ABC):
+    """Persistence used by ``queue_logic``; one instance per app, in ``app.extensions['kiosk_queue_store']``.
+
+    Queues are returned as objects with the ``Queue`` model's attributes (``id``, ``name``,
+    ``line_count``, ``slot_time``, ``reset_time``, ``wait_time``, ``version``); parties as
+    dicts with PARTY_FIELDS.
+
+    Writes happen between ``begin_write`` and ``commit``/``rollback``. ``begin_write`` bumps
+    and returns the queue's version and is the queue's write lock, so callers hold the
+    queue's grid lock across the whole write (see ``queue_logic._lock_queue``).
+    """
+
+    @abc.abstractmethod
+    def get_queue(self, queue_id=None):
+        """Queue `queue_id` or None; without an id, the default (lowest id) queue, created if missing."""
+
+    @abc.abstractmethod
+    def create_queue(self, name=None, line_count=None, slot_time=None, reset_time=None):
+        ...
+
+    @abc.abstractmethod
+    def list_queues(self):
+        ...
+
+    @abc.abstractmethod
+    def queue_version(self, queue_id):
+        ...
+
+    @abc.abstractmethod
+    def find_party_queue(self, user_id):
+        """Queue id of a party, or None if it isn't queued."""
+
+    @abc.abstractmethod
+    def find_token(self, token):
+        """``(queue_id, user_id)`` of the queued party holding `token`, or None."""
+
+    @abc.abstractmethod
+    def list_parties(self, queue_id):
+        """A queue's parties as PARTY_FIELDS dicts, ordered by (line_number, place_in_queue)."""
+
+    @abc.abstractmethod
+    def grid_rows(self, queue_id):
+        """``(id, line_number, party_size, place_in_queue, pinned)`` for every party of a queue."""
+
+    @abc.abstractmethod
+    def admitted_times(self, queue_id):
+        """``{line_number: last_admitted_time}`` of a queue's lines that have one."""
+
+    @abc.abstractmethod
+    def contacts(self, user_ids):
+        """``{id: (email, email_consent)}`` for the given parties."""
+
+    @abc.abstractmethod
+    def begin_write(self, queue):
+        ...
+
+    @abc.abstractmethod
+    def add_parties(self, queue_id, parties):
+        """Insert PARTY_FIELDS dicts (without ``id``, with a ``token`` and ``pinned``); returns their new ids in order."""
+
+    @abc.abstractmethod
+    def delete_parties(self, user_ids):
+        ...
+
+    @abc.abstractmethod
+    def move_parties(self, moves):
+        """Apply ``{user_id: (new line_number, new place_in_queue)}``."""
+
+    @abc.abstractmethod
+    def set_admitted(self, queue, lines, timestamp, line_count):
+        """Record `timestamp` as the last admit of `lines`. Lines below `line_count` that
+        have never recorded one start at `timestamp` too."""
+
+    @abc.abstractmethod
+    def find_parties_by_address(self, address):
+        """``(queue_id, user_id)`` of every queued party whose contact address is `address`."""
+
+    @abc.abstractmethod
+    def add_notifications(self, rows):
+        """Queue outbox rows (dicts with queue_id, user_id, kind, address, place_in_queue and
+        created_at) as part of the current write; they are sent once it commits."""
+
+    @abc.abstractmethod
+    def claim_notifications(self, now, lease, limit):
+        """Claim up to `limit` pending outbox rows due by `now` for `lease` seconds, counting an
+        attempt; returns them as NOTIFICATION_FIELDS dicts. Committed on its own, outside
+        any queue write, and safe against other workers claiming the same rows."""
+
+    @abc.abstractmethod
+    def finish_notifications(self, now, sent, retries, failed):
+        """Record the outcome of claimed rows: `sent` ids were delivered at `now`, `retries`
+        ``{id: (retry_at, error)}`` go back to pending, `failed` ``{id: error}`` are given up
+        on. Committed on its own."""
+
+    @abc.abstractmethod
+    def commit(self):
+        ...
+
+    @abc.abstractmethod
+    def rollback(self):
+        ...
+
+    def close(self):
+        """Release files or connections held by the store."""
+
+
+class SQLAlchemyStore(QueueStore):
+    """The ``User``/``Queue``/``LineStatus`` tables through Flask-SQLAlchemy."""
+
+    def get_queue(self, queue_id=None):
+        if queue_id is not None:
+            return db.session.get(Queue, queue_id)
+        queue = Queue.query.order_by(Queue.id).first()
+        if not queue:
+            queue = Queue()
+            db.session.add(queue)
+            db.session.commit()
+        return queue
+
+    def create_queue(self, name=None, line_count=None, slot_time=None, reset_time=None):
+        queue = Queue(name=name, line_count=line_count, slot_time=slot_time, reset_time=reset_time)  # type: ignore[arg-type]
+        db.session.add(queue)
+        db.session.commit()
+        return queue
+
+    def list_queues(self):
+        return Queue.query.order_by(Queue.id).all()
+
+    def queue_version(self, queue_id):
+        return db.session.query(Queue.version).filter(Queue.id == queue_id).scalar()
+
+    def find_party_queue(self, user_id):
+        return db.session.query(User.queue_id).filter(User.id == user_id).scalar()
+
+    def find_token(self, token):
+        row = db.session.query(User.queue_id, User.id).filter(User.token == token).first()
+        return tuple(row) if row else None
+
+    def list_parties(self, queue_id):
+        columns = [getattr(User, field) for field in PARTY_FIELDS]
+        rows = db.session.query(*columns).filter(User.queue_id == queue_id).order_by(User.line_number, User.place_in_queue)
+        return [dict(zip(PARTY_FIELDS, row)) for row in rows]
+
+    def grid_rows(self, queue_id):
+        return db.session.query(User.id, User.line_number, User.party_size, User.place_in_queue, User.pinned).filter_by(queue_id=queue_id)
+
+    def admitted_times(self, queue_id):
+        return dict(db.session.query(LineStatus.line_number, LineStatus.last_admitted_time).filter_by(queue_id=queue_id))
+
+    def contacts(self, user_ids):
+        rows = db.session.query(User.id, User.email, User.email_consent).filter(User.id.in_(list(user_ids)))
+        return {user_id: (email, consent) for user_id, email, consent in rows}
+
+    def begin_write(self, queue):
+        # The UPDATE is the lock: a row lock on Postgres, the database write lock on SQLite
+        db.session.execute(update(Queue).where(Queue.id == queue.id).values(version=Queue.version + 1))
+        return db.session.query(Queue.version).filter(Queue.id == queue.id).scalar()
+
+    def add_parties(self, queue_id, parties):
+        users = [User(queue_id=queue_id, **party) for party in parties]  # type: ignore[arg-type]
+        db.session.add_all(users)
+        db.session.flush()
+        return [user.id for user in users]
+
+    def delete_parties(self, user_ids):
+        db.session.execute(delete(User).where(User.id.in_(list(user_ids))))
+
+    def move_parties(self, moves):
+        if moves:
+            db.session.execute(
+                update(User)
+                .where(User.id.in_(list(moves)))
+                .values(
+                    line_number=case({user_id: line for user_id, (line, depth) in moves.items()}, value=User.id),
+                    place_in_queue=case({user_id: depth for user_id, (line, depth) in moves.items()}, value=User.id),
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+    def find_parties_by_address(self, address):
+        return [tuple(row) for row in db.session.query(User.queue_id, User.id).filter(User.email == address)]
+
+    def add_notifications(self, rows):
+        db.session.add_all([Notification(next_attempt_at=row['created_at'], **row) for row in rows])
+
+    def claim_notifications(self, now, lease, limit):
+        due = (db.session.query(Notification.id)
+               .filter(Notification.status == 'pending', Notification.next_attempt_at <= now)
+               .order_by(Notification.next_attempt_at).limit(limit))
+        ids = [row[0] for row in due]
+        if not ids:
+            db.session.rollback()
+            return []
+        # Rows another worker claimed since the SELECT no longer match the due condition
+        claim = secrets.token_hex(8)
+        db.session.execute(
+            update(Notification)
+            .where(Notification.id.in_(ids), Notification.status == 'pending', Notification.next_attempt_at <= now)
+            .values(claim=claim, next_attempt_at=now + lease, attempts=Notification.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        columns = [getattr(Notification, field) for field in NOTIFICATION_FIELDS]
+        rows = db.session.query(*columns).filter(Notification.claim == claim)
+        claimed = [dict(zip(NOTIFICATION_FIELDS, row)) for row in rows]
+        db.session.rollback()
+        return claimed
+
+    def finish_notifications(self, now, sent, retries, failed):
+        done = update(Notification).execution_options(synchronize_session=False)
+        if sent:
+            db.session.execute(done.where(Notification.id.in_(list(sent))).values(status='sent', sent_at=now, claim=None))
+        for notification_id, (retry_at, error) in retries.items():
+            db.session.execute(done.where(Notification.id == notification_id).values(
+                status='pending', next_attempt_at=retry_at, last_error=error, claim=None))
+        for notification_id, error in failed.items():
+            db.session.execute(done.where(Notification.id == notification_id).values(
+                status='failed', last_error=error, claim=None))
+        db.session.commit()
+
+    def set_admitted(self, queue, lines, timestamp, line_count):
+        # Missing LineStatus rows are created as part of the same transaction
+        existing = {ls.line_number: ls for ls in LineStatus.query.filter_by(queue_id=queue.id)}
+        for ln in range(line_count):
+            if ln not in existing:
+                existing[ln] = LineStatus(queue_id=queue.id, line_number=ln, last_admitted_time=timestamp)  # type: ignore[arg-type]
+                db.session.add(existing[ln])
+        for ln in lines:
+            if ln in existing:
+                existing[ln].last_admitted_time = timestamp
+
+    def commit(self):
+        db.session.commit()
+
+    def rollback(self):
+        db.session.rollback()
+
+
+class QueueRecord:
+    """MemoryStore's stand-in for a ``Queue`` row."""
+
+    def __init__(self, id, name=None, line_count=None, slot_time=None, reset_time=None, version=0):
+        self.id = id
+        self.name = name
+        self.line_count = line_count
+        self.slot_time = slot_time
+        self.reset_time = reset_time
+        self.wait_time = 0
+        self.version = version
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'line_count': self.line_count, 'slot_time': self.slot_time,
+                'reset_time': self.reset_time, 'version': self.version}
+
+
+class MemoryStore(QueueStore):
+    """Queue state held in process memory, made durable by an append-only log.
+
+    Every commit appends one JSON line holding the transaction's operations to
+    ``<path>/queue.log`` (flushed, and fsynced with ``fsync=True``); nothing is read back
+    from disk while serving. Every ``snapshot_every`` commits the full state is written to
+    ``<path>/snapshot.json`` and the log restarts, so startup loads the snapshot and
+    replays at most that many transactions. A torn last line (crash mid-append) is
+    ignored and cut from the log. Without a ``path`` the store is purely in-memory.
+
+    Writes to one queue are serialized by the caller's grid lock, so the store only
+    supports a single process; run one worker with it.
+    """
+
+    LOG_NAME = 'queue.log'
+    SNAPSHOT_NAME = 'snapshot.json'
+
+    def __init__(self, path=None, fsync=False, snapshot_every=1000):
+        self.path = path
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.lock = native_rlock()
+        self._txn = threading.local()
+        self._queues = {}  # id -> QueueRecord
+        self._parties = {}  # user id -> party dict (PARTY_FIELDS + queue_id, token)
+        self._by_queue = {}  # queue id -> {user id: party dict}
+        self._tokens = {}  # token -> party dict
+        self._outbox = {}  # notification id -> pending notification dict (sent/failed ones are dropped)
+        self._next_notification_id = 1
+        self._admitted = {}  # queue id -> {line_number: timestamp}
+        self._next_queue_id = 1
+        self._next_user_id = 1
+        self._seq = 0  # transactions applied
+        self._since_snapshot = 0
+        self._log = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+            self._log = open(os.path.join(path, self.LOG_NAME), 'a', encoding='utf-8')
+
+    # -- state -------------------------------------------------------------------------
+
+    def _apply(self, op):
+        kind = op[0]
+        if kind == 'queue':
+            record = QueueRecord(**op[1])
+            self._queues[record.id] = record
+            self._by_queue.setdefault(record.id, {})
+            self._admitted.setdefault(record.id, {})
+            self._next_queue_id = max(self._next_queue_id, record.id + 1)
+        elif kind == 'version':
+            self._queues[op[1]].version = op[2]
+        elif kind == 'add':
+            party = op[1]
+            self._parties[party['id']] = party
+            self._by_queue[party['queue_id']][party['id']] = party
+            if party.get('token'):
+                self._tokens[party['token']] = party
+            self._next_user_id = max(self._next_user_id, party['id'] + 1)
+        elif kind == 'delete':
+            for user_id in op[1]:
+                party = self._parties.pop(user_id, None)
+                if party is not None:
+                    del self._by_queue[party['queue_id']][user_id]
+                    self._tokens.pop(party.get('token'), None)
+        elif kind == 'move':
+            # [user_id, line, depth]; logs written before parties could change lines hold [user_id, depth]
+            for move in op[1]:
+                party = self._parties.get(move[0])
+                if party is not None:
+                    party['place_in_queue'] = move[-1]
+                    if len(move) == 3:
+                        party['line_number'] = move[1]
+        elif kind == 'admit':
+            admitted = self._admitted[op[1]]
+            for ln in op[2]:
+                admitted[ln] = op[3]
+        elif kind == 'notify':
+            for row in op[1]:
+                self._outbox[row['id']] = row
+                self._next_notification_id = max(self._next_notification_id, row['id'] + 1)
+        elif kind == 'claim':
+            for notification_id, next_attempt_at in op[1]:
+                row = self._outbox[notification_id]
+                row['next_attempt_at'] = next_attempt_at
+                row['attempts'] += 1
+        elif kind == 'retry':
+            for notification_id, next_attempt_at in op[1]:
+                self._outbox[notification_id]['next_attempt_at'] = next_attempt_at
+        elif kind == 'notified':
+            for notification_id in op[1]:
+                self._outbox.pop(notification_id, None)
+
+    def _commit_ops(self, ops):
+        with self.lock:
+            for op in ops:
+                self._apply(op)
+            self._seq += 1
+            if self._log is not None:
+                self._log.write(json.dumps({'seq': self._seq, 'ops': ops}, separators=(',', ':')) + '\n')
+                self._log.flush()
+                if self.fsync:
+                    os.fsync(self._log.fileno())
+                self._since_snapshot += 1
+                if self._since_snapshot >= self.snapshot_every:
+                    self.snapshot()
+
+    def snapshot(self):
+        """Write the full state to the snapshot file and start a new, empty log."""
+        with self.lock:
+            if self._log is None:
+                return
+            state = {
+                'seq': self._seq,
+                'queues': [record.to_dict() for record in self._queues.values()],
+                'parties': list(self._parties.values()),
+                'admitted': {str(qid): {str(ln): ts for ln, ts in lines.items()} for qid, lines in self._admitted.items()},
+                'next_user_id': self._next_user_id,
+                'notifications': list(self._outbox.values()),
+                'next_notification_id': self._next_notification_id,
+            }
+            target = os.path.join(self.path, self.SNAPSHOT_NAME)
+            with open(target + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(target + '.tmp', target)
+            # Records up to state['seq'] are in the snapshot; replay skips them if the truncate is lost
+            self._log.close()
+            self._log = open(os.path.join(self.path, self.LOG_NAME), 'w', encoding='utf-8')
+            self._since_snapshot = 0
+
+    def _load(self):
+        snapshot_path = os.path.join(self.path, self.SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding='utf-8') as f:
+                state = json.load(f)
+            for record in state['queues']:
+                self._apply(('queue', record))
+            for party in state['parties']:
+                self._apply(('add', party))
+            for qid, lines in state['admitted'].items():
+                self._admitted[int(qid)] = {int(ln): ts for ln, ts in lines.items()}
+            self._next_user_id = max(self._next_user_id, state['next_user_id'])
+            self._apply(('notify', state.get('notifications', [])))
+            self._next_notification_id = max(self._next_notification_id, state.get('next_notification_id', 1))
+            self._seq = state['seq']
+        log_path = os.path.join(self.path, self.LOG_NAME)
+        if not os.path.exists(log_path):
+            return
+        intact = 0  # bytes of whole records
+        with open(log_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    break  # torn write at the tail
+                intact += len(line)
+                if entry['seq'] <= self._seq:
+                    continue
+                for op in entry['ops']:
+                    self._apply(op)
+                self._seq = entry['seq']
+                self._since_snapshot += 1
+        if intact < os.path.getsize(log_path):
+            # Drop the torn tail, or the next commit would be appended to it and lost with it
+            with open(log_path, 'r+b') as f:
+                f.truncate(intact)
+
+    def close(self):
+        with self.lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    # -- reads -------------------------------------------------------------------------
+
+    def get_queue(self, queue_id=None):
+        with self.lock:
+            if queue_id is not None:
+                return self._queues.get(queue_id)
+            if self._queues:
+                return self._queues[min(self._queues)]
+        return self.create_queue()
+
+    def create_queue(self, name=None, line_count=None, slot_time=None, reset_time=None):
+        with self.lock:
+            record = {'id': self._next_queue_id, 'name': name, 'line_count': line_count,
+                      'slot_time': slot_time, 'reset_time': reset_time, 'version': 0}
+            self._commit_ops([('queue', record)])
+            return self._queues[record['id']]
+
+    def list_queues(self):
+        with self.lock:
+            return [self._queues[qid] for qid in sorted(self._queues)]
+
+    def queue_version(self, queue_id):
+        record = self._queues.get(queue_id)
+        return record.version if record else None
+
+    def find_party_queue(self, user_id):
+        party = self._parties.get(user_id)
+        return party['queue_id'] if party else None
+
+    def find_token(self, token):
+        party = self._tokens.get(token)
+        return (party['queue_id'], party['id']) if party else None
+
+    def list_parties(self, queue_id):
+        with self.lock:
+            parties = [{field: party[field] for field in PARTY_FIELDS} for party in self._by_queue.get(queue_id, {}).values()]
+        parties.sort(key=lambda party: (party['line_number'], party['place_in_queue']))
+        return parties
+
+    def grid_rows(self, queue_id):
+        with self.lock:
+            return [(p['id'], p['line_number'], p['party_size'], p['place_in_queue'], p.get('pinned', False))
+                    for p in self._by_queue.get(queue_id, {}).values()]
+
+    def admitted_times(self, queue_id):
+        with self.lock:
+            return dict(self._admitted.get(queue_id, {}))
+
+    def contacts(self, user_ids):
+        with self.lock:
+            return {uid: (self._parties[uid]['email'], self._parties[uid]['email_consent']) for uid in user_ids if uid in self._parties}
+
+    def find_parties_by_address(self, address):
+        with self.lock:
+            return [(p['queue_id'], p['id']) for p in self._parties.values() if p['email'] == address]
+
+    # -- writes ------------------------------------------------------------------------
+
+    def _ops(self):
+        ops = getattr(self._txn, 'ops', None)
+        if ops is None:
+            raise RuntimeError('MemoryStore write outside begin_write()')
+        return ops
+
+    def begin_write(self, queue):
+        version = self._queues[queue.id].version + 1
+        self._txn.ops = [('version', queue.id, version)]
+        return version
+
+    def add_parties(self, queue_id, parties):
+        ops = self._ops()
+        with self.lock:
+            first = self._next_user_id
+            self._next_user_id += len(parties)
+        ids = list(range(first, first + len(parties)))
+        for user_id, party in zip(ids, parties):
+            ops.append(('add', dict(party, id=user_id, queue_id=queue_id)))
+        return ids
+
+    def delete_parties(self, user_ids):
+        self._ops().append(('delete', list(user_ids)))
+
+    def move_parties(self, moves):
+        if moves:
+            self._ops().append(('move', [(user_id, line, depth) for user_id, (line, depth) in moves.items()]))
+
+    def set_admitted(self, queue, lines, timestamp, line_count):
+        known = self._admitted.get(queue.id, {})
+        lines = set(lines) | {ln for ln in range(line_count) if ln not in known}
+        self._ops().append(('admit', queue.id, sorted(lines), timestamp))
+
+    def add_notifications(self, rows):
+        ops = self._ops()
+        with self.lock:
+            first = self._next_notification_id
+            self._next_notification_id += len(rows)
+        ops.append(('notify', [dict(row, id=first + i, attempts=0, next_attempt_at=row['created_at'])
+                               for i, row in enumerate(rows)]))
+
+    def claim_notifications(self, now, lease, limit):
+        with self.lock:
+            due = sorted((row for row in self._outbox.values() if row['next_attempt_at'] <= now),
+                         key=lambda row: row['next_attempt_at'])[:limit]
+            if not due:
+                return []
+            self._commit_ops([('claim', [(row['id'], now + lease) for row in due])])
+            return [{field: row[field] for field in NOTIFICATION_FIELDS} for row in due]
+
+    def finish_notifications(self, now, sent, retries, failed):
+        ops = [('notified', list(sent) + list(failed))]
+        if retries:
+            ops.append(('retry', [(notification_id, retry_at) for notification_id, (retry_at, _) in retries.items()]))
+        self._commit_ops(ops)
+
+    def commit(self):
+        ops = getattr(self._txn, 'ops', None)
+        self._txn.ops = None
+        if ops:
+            self._commit_ops(ops)
+
+    def rollback(self):
+        self._txn.ops = None
+
+
+def create_store(app):
+    """The QueueStore selected by ``KIOSK_QUEUE_STORE`` ("sqlalchemy" or "memory")."""
+    kind = app.config['KIOSK_QUEUE_STORE']
+    if kind == 'sqlalchemy':
+        return SQLAlchemyStore()
+    if kind == 'memory':
+        path = app.config.get('KIOSK_QUEUE_STORE_PATH')
+        return MemoryStore(
+            path=path,
+            fsync=app.config.get('KIOSK_QUEUE_STORE_FSYNC', False),
+            snapshot_every=app.config.get('KIOSK_QUEUE_STORE_SNAPSHOT_EVERY', 1000),
+        )
+    raise ValueError(f'Unknown KIOSK_QUEUE_STORE {kind!r}')
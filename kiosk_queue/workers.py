@@ -0,0 +1,149 @@
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+
+def _original(module, name):
+    """``module.name`` as it was before eventlet/gevent monkey-patching, if either ran."""
+    try:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('time' if module == 'time' else 'thread'):
+            return getattr(patcher.original(module), name)
+    except ImportError:
+        pass
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched(module):
+            return monkey.get_original(module, name)
+    except ImportError:
+        pass
+    return getattr(importlib.import_module(module), name)
+
+
+def native_rlock():
+    """An RLock backed by a real OS lock even when eventlet/gevent monkey-patched threading.
+
+    Occupancy grids are only touched from DB pool threads, which are native threads; a green
+    lock blocking there would try to switch to the event loop of a thread that has none.
+    """
+    return _original('threading', 'RLock')()
+
+
+def start_native_thread(fn, *args):
+    """Run ``fn(*args)`` on a new OS thread (never a greenlet) that doesn't block exit."""
+    _original('_thread', 'start_new_thread')(fn, args)
+
+
+def native_sleep(seconds):
+    """Sleep the current OS thread; for threads started by ``start_native_thread``."""
+    _original('time', 'sleep')(seconds)
+
+
+class DbWorkerPool:
+    """Bounded pool of native threads that runs the blocking (DB) part of queue work.
+
+    Under eventlet or gevent, a SQLAlchemy call made from a green thread blocks the whole
+    event loop, and with it every connected socket, for as long as the commit takes (the
+    sqlite3 and psycopg2 drivers are C code the monkey-patching can't reach). Routes and
+    socket handlers instead hand the work to ``run``, which executes it on a real thread in
+    its own app context and yields to the event loop until the result is ready. Under the
+    threading async mode ``run`` still bounds how many requests hit the DB at once.
+
+    Keep ``size`` at or below the SQLAlchemy connection pool size (5 by default), so pool
+    threads never wait on a connection checkout.
+
+    Work running on a pool thread must not emit or spawn green tasks; it hands those to
+    ``after`` and they run on the calling thread once the work returns.
+    """
+
+    def __init__(self, app, size=4, socketio=None):
+        self.app = app
+        self.size = size
+        self.socketio = socketio
+        self._local = threading.local()
+        self._submit = None
+        self._submit_lock = threading.Lock()
+
+    def _submitter(self):
+        # The async mode is only known once socketio.init_app has run, so pick lazily
+        with self._submit_lock:
+            if self._submit is None:
+                self._submit = self._make_submitter(getattr(self.socketio, 'async_mode', None))
+        return self._submit
+
+    def _make_submitter(self, async_mode):
+        size = self.size
+        if async_mode == 'eventlet':
+            from eventlet import tpool
+            from eventlet.semaphore import Semaphore
+            slots = Semaphore(size)
+
+            def submit(fn, *args):
+                with slots:
+                    return tpool.execute(fn, *args)
+        elif async_mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            pool = ThreadPool(size)
+
+            def submit(fn, *args):
+                return pool.apply(fn, args)
+        else:
+            executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='kiosk-queue-db')
+
+            def submit(fn, *args):
+                return executor.submit(fn, *args).result()
+        return submit
+
+    def run(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on a pool thread and return its result."""
+        if getattr(self._local, 'deferred', None) is not None:
+            return fn(*args, **kwargs)  # already on a pool thread
+        result, deferred = self._submitter()(self._call, fn, args, kwargs)
+        for callback, callback_args in deferred:
+            callback(*callback_args)
+        return result
+
+    def after(self, callback, *args):
+        """Run ``callback(*args)`` on the caller's thread once the current work returns."""
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred is None:
+            callback(*args)
+        else:
+            deferred.append((callback, args))
+
+    def _call(self, fn, args, kwargs):
+        self._local.deferred = deferred = []
+        try:
+            with self.app.app_context():
+                return fn(*args, **kwargs), deferred
+        finally:
+            self._local.deferred = None
+
+
+def run_db(fn, *args, **kwargs):
+    """Run queue DB work through the app's DbWorkerPool (inline if it has none)."""
+    extensions = current_app.extensions
+    pool = extensions.get('kiosk_queue_db_pool')
+    metrics = extensions.get('kiosk_queue_metrics')
+    if metrics is not None:
+        # Count the SQL the work runs on the pool thread towards the current request
+        fn, args = metrics.count_queries, (fn,) + args
+    if pool is None:
+        result = fn(*args, **kwargs)
+    else:
+        result = pool.run(fn, *args, **kwargs)
+    if metrics is None:
+        return result
+    result, queries = result
+    metrics.add_request_queries(queries)
+    return result
+
+
+def after_db(callback, *args):
+    """Defer ``callback(*args)`` until the current pool work is back on its caller's thread."""
+    pool = current_app.extensions.get('kiosk_queue_db_pool')
+    if pool is None:
+        callback(*args)
+    else:
+        pool.after(callback, *args)
@@ -1,9 +1,12 @@
 from flask import Flask
 from flask_socketio import SocketIO
 from kiosk_queue import KioskQueue
+from kiosk_queue.bus import socketio_options
 from kiosk_queue.config import Config
 
-socketio = SocketIO(cors_allowed_origins="*")
+# With several workers (e.g. gunicorn -w 4), set SOCKETIO_MESSAGE_QUEUE (redis://...) so
+# emits from any worker reach clients connected to the others.
+socketio = SocketIO(cors_allowed_origins="*", **socketio_options(Config.SOCKETIO_MESSAGE_QUEUE))
 kiosk = KioskQueue()
 
 def create_app():
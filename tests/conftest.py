@@ -0,0 +1,58 @@
+import sys
+import types
+import pytest
+from flask import Flask
+from kiosk_queue import KioskQueue
+
+try:
+    import cors_helpers  # noqa: F401
+except ImportError:
+    # cors_helpers ships with the host application, not this package; stand in for it with
+    # the same signature: CORS on the prefix's routes, returning the configured origins
+    def configure_cors(app, url_prefix, origins_config_key, creds_config_key):
+        from flask_cors import CORS
+        origins = app.config.get(origins_config_key) or "*"
+        CORS(app, resources={f"{url_prefix}/*": {"origins": origins}},
+             supports_credentials=bool(app.config.get(creds_config_key)))
+        return origins
+
+    sys.modules["cors_helpers"] = types.ModuleType("cors_helpers")
+    sys.modules["cors_helpers"].configure_cors = configure_cors
+
+
+def create_app(socketio=None, **config):
+    """An app wired up like ``main.py``, against a private in-memory SQLite DB unless
+    `config` says otherwise."""
+    app = Flask("kiosk_queue_tests")
+    app.config.update(
+        SECRET_KEY="test",
+        SQLALCHEMY_DATABASE_URI="sqlite://",
+        LINE_COUNT=3,
+        SLOT_TIME=5,
+        RESET_TIME=3,
+        ADMIN_PASSWORD="admin",
+        KIOSK_QUEUE_BROADCAST_DELAY=0,
+        KIOSK_QUEUE_DB_WORKERS=0,
+    )
+    app.config.update(config)
+    KioskQueue().init_app(app, socketio=socketio)
+    if socketio is not None:
+        socketio.init_app(app)
+    return app
+
+
+@pytest.fixture
+def app():
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(client):
+    """Headers carrying a valid admin token."""
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    return {"Authorization": f"Bearer {token}"}
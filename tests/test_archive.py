@@ -0,0 +1,56 @@
+import json
+import os
+from kiosk_queue.archive import EventArchive, read_events, replay
+
+TS = 1760745600.0  # 2025-10-18 UTC
+
+
+def write_log(path, rows):
+    with open(os.path.join(path, "events-2025-10-18.1.jsonl"), "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_replay(tmp_path):
+    write_log(tmp_path, [
+        [TS, 1, "join", 1, "a", 1], [TS, 1, "place", 1, 0, 1],
+        [TS + 1, 1, "join", 2, "b", 2], [TS + 1, 1, "place", 2, 1, 1],
+        [TS + 2, 1, "admit", 1],
+        [TS + 2, 1, "compact", 2, 1, 0],
+    ])
+    assert replay(str(tmp_path)) == {1: {2: {"queue_id": 1, "user_id": 2, "name": "b", "party_size": 2,
+                                             "line_number": 0, "place_in_queue": 1}}}
+    assert set(replay(str(tmp_path), at=TS + 1)[1]) == {1, 2}
+
+
+def test_replay_seeds_parties_that_joined_before_the_log(tmp_path):
+    # The archive was switched on with parties 7, 8 and 9 already queued
+    write_log(tmp_path, [
+        [TS, 1, "remove", 7],
+        [TS, 1, "compact", 8, 1, 2],
+        [TS, 1, "compact", 9, 1],
+        [TS + 1, 1, "join", 10, "new", 1], [TS + 1, 1, "place", 10, 0, 2],
+    ])
+    parties = replay(str(tmp_path))[1]
+    assert sorted(parties) == [8, 9, 10]
+    assert parties[8] == {"queue_id": 1, "user_id": 8, "name": None, "party_size": None,
+                          "line_number": 2, "place_in_queue": 1}
+    assert (parties[9]["line_number"], parties[9]["place_in_queue"]) == (None, 1)
+
+
+def test_events_flushed_out_of_order_are_read_in_order(tmp_path):
+    archive = EventArchive(str(tmp_path), flush_interval=3600)
+    # The mutation at TS + 1 was flushed before the one at TS recorded its events
+    archive.record(1, TS + 1, [("join", 2, "b", 1), ("place", 2, 0, 1)])
+    archive.flush()
+    archive.record(1, TS, [("join", 1, "a", 1), ("place", 1, 0, 1)])
+    archive.record(2, TS + 2, [("join", 3, "c", 1), ("place", 3, 0, 1)])
+    archive.close()
+    # Another process's file, in order, interleaves with it
+    with open(os.path.join(tmp_path, "events-2025-10-18.1.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps([TS + 0.5, 1, "admit", 1]) + "\n")
+    events = [(event["ts"], event["kind"], event["user_id"]) for event in read_events(str(tmp_path))]
+    assert events == [(TS, "join", 1), (TS, "place", 1), (TS + 0.5, "admit", 1),
+                      (TS + 1, "join", 2), (TS + 1, "place", 2), (TS + 2, "join", 3), (TS + 2, "place", 3)]
+    assert [event["user_id"] for event in read_events(str(tmp_path), since=TS + 0.75)] == [2, 2, 3, 3]
+    assert set(replay(str(tmp_path))[1]) == {2}
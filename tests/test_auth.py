@@ -0,0 +1,85 @@
+import threading
+import time
+import pytest
+from kiosk_queue import auth as auth_module
+from kiosk_queue.auth import AdminAuth
+
+
+@pytest.fixture
+def auth():
+    return AdminAuth(password="admin", secret_key="test", max_failures=3, lockout=30)
+
+
+def test_login_and_verify(auth):
+    token, wait = auth.login("admin", "client")
+    assert wait == 0 and auth.verify(token)
+    assert not auth.verify(token + "x")
+    assert not auth.verify(auth.issue(now=time.time() - 2 * auth.ttl))
+
+
+@pytest.mark.parametrize("token", ["１２３４５６７８９０.abc", "9999999999.é", "²³.abc", "", None, "9999999999"])
+def test_verify_rejects_malformed_tokens(auth, token):
+    assert auth.verify(token) is False
+
+
+def test_lockout_after_failures(auth):
+    waits = [auth.login("wrong", "client")[1] for _ in range(4)]
+    assert waits[:2] == [0, 0] and waits[2] == 30
+    assert waits[3] > 0  # refused without hashing
+    assert auth.login("admin", "other")[1] == 0
+
+
+def test_success_resets_failures(auth):
+    auth.login("wrong", "client")
+    auth.login("wrong", "client")
+    assert auth.login("admin", "client")[1] == 0
+    assert auth.login("wrong", "client")[1] == 0
+
+
+def test_concurrent_logins_hash_at_most_max_failures(auth, monkeypatch):
+    hashed = []
+    check = auth_module.check_password_hash
+
+    def slow_check(password_hash, password):
+        hashed.append(password)
+        time.sleep(0.05)
+        return check(password_hash, password)
+
+    auth._stored_hash()  # hash ADMIN_PASSWORD up front
+    monkeypatch.setattr(auth_module, "check_password_hash", slow_check)
+    barrier = threading.Barrier(20)
+
+    def attempt():
+        barrier.wait()
+        auth.login("wrong", "client")
+
+    threads = [threading.Thread(target=attempt) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(hashed) == auth.max_failures
+    assert auth.retry_after("client") > 0
+
+
+def test_verified_password_is_not_hashed_again(auth, monkeypatch):
+    hashed = []
+    check = auth_module.check_password_hash
+    monkeypatch.setattr(auth_module, "check_password_hash",
+                        lambda password_hash, password: hashed.append(password) or check(password_hash, password))
+    assert auth.check("admin", "scraper") == (True, 0)
+    for _ in range(10):
+        assert auth.check("admin", "scraper") == (True, 0)
+    assert hashed == ["admin"]
+    assert auth.retry_after("scraper") == 0
+    # A wrong password is still hashed and counted
+    assert auth.check("wrong", "scraper") == (False, 0)
+    assert hashed == ["admin", "wrong"]
+
+
+def test_verified_password_still_waits_out_lockout(auth):
+    auth.check("admin", "client")
+    for _ in range(auth.max_failures):
+        auth.check("wrong", "client")
+    ok, wait = auth.check("admin", "client")
+    assert not ok and wait > 0
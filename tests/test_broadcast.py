@@ -0,0 +1,272 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from flask_socketio import SocketIO
+from kiosk_queue.broadcast import room_name
+from kiosk_queue.bus import LocalBusManager
+from kiosk_queue.queue_logic import _get_grid, _get_queue, create_queue_logic, get_public_queue, join_queue_logic
+from conftest import create_app
+
+
+class Follower:
+    """The public list as the frontend keeps it from ``queue_update`` and ``queue_delta``:
+    deltas at or below its seq are ignored, and one whose base_seq isn't its seq resyncs
+    from `resync()` (a full ``queue_update`` payload)."""
+
+    def __init__(self, resync):
+        self.resync = resync
+        self.deltas = 0
+        self.update(resync())
+
+    def update(self, payload):
+        self.seq = payload["seq"]
+        self.entries = {entry["id"]: entry for entry in payload["queue"]}
+
+    def delta(self, delta):
+        if delta["seq"] <= self.seq:
+            return
+        if delta["base_seq"] != self.seq:
+            self.update(self.resync())
+            return
+        self.deltas += 1
+        for user_id in delta["removed"]:
+            del self.entries[user_id]
+        for entry in delta["added"]:
+            self.entries[entry["id"]] = entry
+        for move in delta["moved"]:
+            self.entries[move["id"]].update(move)
+        self.seq = delta["seq"]
+
+    def layout(self):
+        return sorted((e["id"], e["line_number"], e["place_in_queue"]) for e in self.entries.values())
+
+
+def db_layout(app):
+    with app.app_context():
+        return sorted((e["id"], e["line_number"], e["place_in_queue"]) for e in get_public_queue())
+
+
+def snapshot(app):
+    with app.app_context():
+        return app.extensions["kiosk_queue_broadcaster"].snapshot(_get_queue().id, "public")
+
+
+def receive(socket, follower):
+    for message in socket.get_received("/queue"):
+        if message["name"] == "queue_delta":
+            follower.delta(message["args"][0])
+
+
+def test_connect_between_commit_and_flush_still_sends_delta():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    broadcaster = app.extensions["kiosk_queue_broadcaster"]
+    socket = socketio.test_client(app, namespace="/queue")
+    follower = Follower(lambda: snapshot(app))
+    socket.get_received("/queue")
+
+    # Hold the flush a commit requests, and have a client connect (and so catch the
+    # snapshot up to the commit) before it runs
+    held = []
+    broadcaster.request_update = held.append
+    with app.app_context():
+        join_queue_logic("a", None, 1, None, False)
+    late = socketio.test_client(app, namespace="/queue")
+    del broadcaster.request_update
+    with app.app_context():
+        for queue_id in held:
+            broadcaster.request_update(queue_id)
+
+    receive(socket, follower)
+    assert follower.deltas == 1
+    assert follower.layout() == db_layout(app)
+    assert late.is_connected("/queue")
+
+
+def test_workers_sharing_db_and_bus(tmp_path):
+    # Each "worker" is its own app (grid, DB connections, Socket.IO server) on one SQLite
+    # file, with emits fanned out through an in-process bus as Redis would between processes
+    channel = f"test-{uuid.uuid4().hex}"
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'queue.db'}", "LINE_COUNT": 4,
+              "SQLALCHEMY_ENGINE_OPTIONS": {"connect_args": {"timeout": 30}}}
+    apps = [create_app(socketio=SocketIO(async_mode="threading", client_manager=LocalBusManager(channel=channel)),
+                       **config)
+            for _ in range(3)]
+    # What any worker relays to its clients in the public room is what goes over the bus
+    bus = LocalBusManager(channel=channel, write_only=True)
+    with apps[0].app_context():
+        public = room_name("public", _get_queue().id)
+    followers = [Follower(lambda app=app: snapshot(app)) for app in apps]
+    errors = []
+
+    def work(app, seed):
+        client = app.test_client()
+        token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+        admin = {"Authorization": f"Bearer {token}"}
+        try:
+            for i in range(30):
+                response = client.post("/api/kiosk/join", json={"name": f"w{seed}-{i}", "party_size": 1 + (i + seed) % 3})
+                assert response.status_code == 201, response.get_json()
+                if i % 3 == 2:
+                    response = client.post("/api/kiosk/admin/next", json={"line_number": (i + seed) % 4}, headers=admin)
+                    assert response.status_code == 200, response.get_json()
+        except Exception as exc:  # re-raised from the test's thread
+            errors.append(exc)
+
+    threads = [threading.Thread(target=work, args=(app, seed)) for seed, app in enumerate(apps)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    with apps[0].app_context():
+        parties = get_public_queue()
+    cells = [(line, party["place_in_queue"]) for party in parties
+             for line in range(party["line_number"], party["line_number"] + party["party_size"])]
+    assert len(cells) == len(set(cells)), "overlapping parties"
+
+    # Replay the bus to each follower: a missed delta leaves it behind the DB's layout
+    expected = db_layout(apps[0])
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            message = json.loads(bus._inbox.get(timeout=0.5))
+        except queue.Empty:
+            break
+        if message.get("event") == "queue_delta" and message["room"] == public:
+            for follower in followers:
+                follower.delta(message["data"][0])
+    for follower in followers:
+        assert follower.layout() == expected
+        assert follower.deltas > 0
+
+
+def columns_to_rows(payload):
+    columns = payload["columns"]
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def test_columnar_snapshot_matches_rows_and_is_encoded_once():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    with app.app_context():
+        for i in range(5):
+            join_queue_logic(f"p{i}", None, 1 + i % 2, None, False)
+    rows = socketio.test_client(app, namespace="/queue")
+    clients = [socketio.test_client(app, namespace="/queue", auth={"format": "columns"}) for _ in range(2)]
+    received = [[m["args"][0] for m in client.get_received("/queue") if m["name"] == "queue_update"]
+                for client in [rows] + clients]
+    expected = received[0][0]
+    for (payload,) in received[1:]:
+        # Sent as one JSON-encoded binary attachment
+        assert isinstance(payload, bytes)
+        payload = json.loads(payload)
+        assert set(map(len, payload["columns"].values())) == {len(expected["queue"])}
+        assert columns_to_rows(payload) == expected["queue"]
+        del payload["columns"]
+        assert payload == {key: value for key, value in expected.items() if key != "queue"}
+
+    # Every columnar client at one seq shares a single encode; a change makes a new one
+    broadcaster = app.extensions["kiosk_queue_broadcaster"]
+    with app.app_context():
+        queue_id = _get_queue().id
+        first = broadcaster.snapshot(queue_id, "public", "columns")
+        assert broadcaster.snapshot(queue_id, "public", "columns") is first
+        assert broadcaster.snapshot(queue_id, "admin", "columns") is broadcaster.snapshot(queue_id, "admin")
+        join_queue_logic("late", None, 1, None, False)
+        second = broadcaster.snapshot(queue_id, "public", "columns")
+    assert second is not first
+    assert json.loads(second)["seq"] == json.loads(first)["seq"] + 1
+    assert columns_to_rows(json.loads(second)) == snapshot(app)["queue"]
+
+
+def test_unknown_socket_format_is_refused():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    client = socketio.test_client(app, namespace="/queue", auth={"format": "xml"})
+    assert not client.is_connected("/queue")
+
+
+def test_party_follows_own_position_by_token():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    client = app.test_client()
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    admin = {"Authorization": f"Bearer {token}"}
+    joined = [client.post("/api/kiosk/join", json={"name": name}).get_json() for name in "abcd"]
+    party = joined[3]
+    socket = socketio.test_client(app, namespace="/queue", auth={"token": party["token"]})
+
+    def events():
+        received = socket.get_received("/queue")
+        # Only its own position, never the queue-wide rooms' lists
+        assert {message["name"] for message in received} <= {"position"}
+        return [message["args"][0] for message in received]
+
+    (position,) = events()
+    assert position["queued"] is True
+    assert (position["id"], position["line_number"], position["place_in_queue"]) == (party["id"], 0, 2)
+    assert position == client.get(f"/api/kiosk/position/{party['token']}").get_json()
+
+    # A change elsewhere in the queue doesn't touch its position, so nothing is sent
+    client.post("/api/kiosk/admin/next", json={"line_number": 1}, headers=admin)
+    assert events() == []
+
+    client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin)
+    (position,) = events()
+    assert (position["queued"], position["line_number"], position["place_in_queue"]) == (True, 0, 1)
+
+    client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin)
+    (position,) = events()
+    assert position == {"id": party["id"], "queued": False, "seq": position["seq"]}
+    # Its room is closed once it is admitted
+    client.post("/api/kiosk/join", json={"name": "e"})
+    assert events() == []
+
+
+def test_unknown_party_token_is_not_queued():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    socket = socketio.test_client(app, namespace="/queue", auth={"token": "no-such-token"})
+    assert socket.is_connected("/queue")
+    assert [(m["name"], m["args"][0]) for m in socket.get_received("/queue")] == [("position", {"queued": False})]
+
+
+def test_queues_are_isolated():
+    socketio = SocketIO(async_mode="threading")
+    app = create_app(socketio=socketio)
+    client = app.test_client()
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    admin = {"Authorization": f"Bearer {token}"}
+    with app.app_context():
+        a = _get_queue().id
+        b = create_queue_logic("B").id
+    client.post(f"/api/kiosk/q/{b}/join", json={"name": "b1"})
+    watchers = {queue_id: socketio.test_client(app, namespace="/queue", auth={"queue_id": queue_id}) for queue_id in (a, b)}
+    for socket in watchers.values():
+        socket.get_received("/queue")
+
+    def state_of_b():
+        with app.app_context():
+            queue = _get_queue(b)
+            grid = _get_grid(queue)
+            with grid.lock:
+                shape = grid.shape()
+            return queue.version, shape, client.get(f"/api/kiosk/q/{b}/queue").get_json()
+    before = state_of_b()
+    etag = client.get(f"/api/kiosk/q/{b}/queue").headers["ETag"]
+
+    assert client.post(f"/api/kiosk/q/{a}/join", json={"name": "a1"}).status_code == 201
+    client.post("/api/kiosk/join", json={"name": "a2"})
+    client.post(f"/api/kiosk/q/{a}/admin/next", json={"line_number": 0}, headers=admin)
+
+    assert state_of_b() == before
+    assert client.get(f"/api/kiosk/q/{b}/queue", headers={"If-None-Match": etag}).status_code == 304
+    assert watchers[b].get_received("/queue") == []
+    deltas = [m["args"][0] for m in watchers[a].get_received("/queue") if m["name"] == "queue_delta"]
+    assert sorted(entry["name"] for delta in deltas for entry in delta["added"]) == ["a1", "a2"]
+    assert [party["name"] for party in client.get(f"/api/kiosk/q/{a}/queue").get_json()["queue"]] == ["a2"]
+    assert [party["name"] for party in before[2]["queue"]] == ["b1"]
@@ -0,0 +1,69 @@
+"""OccupancyGrid.compact against the fixed-point loop it replaced (the old ``_compact_queue``)."""
+import random
+import pytest
+from kiosk_queue.occupancy import OccupancyGrid
+
+
+def fixed_point_compact(parties, line_count, start_depth):
+    """The original algorithm, on ``{user_id: [line_number, party_size, depth]}``: every
+    party below ``start_depth`` moves up one row if all of its lines are free there,
+    visiting parties by (depth, line), and the pass repeats until nothing moves."""
+    while True:
+        occupancy = [set() for _ in range(line_count)]
+        moved = False
+        for user_id in sorted(parties, key=lambda u: (parties[u][2], parties[u][0])):
+            line_number, party_size, depth = parties[user_id]
+            lines = range(line_number, min(line_count, line_number + party_size))
+            target = depth - 1
+            if depth > start_depth and target >= start_depth and all(target not in occupancy[ln] for ln in lines):
+                parties[user_id][2] = target
+                moved = True
+                depth = target
+            for ln in lines:
+                occupancy[ln].add(depth)
+        if not moved:
+            return
+
+
+def layout(grid):
+    return {user_id: [line_number, party_size, depth]
+            for user_id, (line_number, party_size, depth) in grid._parties.items()}
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("line_count", [1, 3, 6])
+def test_compact_matches_fixed_point(seed, line_count):
+    rnd = random.Random(seed)
+    grid = OccupancyGrid(line_count)
+    oracle = {}
+    next_id = 1
+    for _ in range(300):
+        if oracle and rnd.random() < 0.45:
+            if rnd.random() < 0.5:
+                # "Next": the head of a random non-empty line
+                heads = [grid.head(ln) for ln in range(line_count) if grid.head(ln) is not None]
+                user_id = rnd.choice(heads)
+            else:
+                user_id = rnd.choice(sorted(oracle))
+            line_number, party_size, depth = grid.release(user_id)
+            grid.compact(depth, grid.lines(line_number, party_size))
+            del oracle[user_id]
+            fixed_point_compact(oracle, line_count, depth)
+        else:
+            party_size = rnd.randint(1, line_count)
+            requested = rnd.randrange(line_count) if rnd.random() < 0.3 else None
+            line_number, depth = grid.find_position(party_size, requested)
+            grid.place(next_id, line_number, party_size, depth)
+            oracle[next_id] = [line_number, party_size, depth]
+            next_id += 1
+        assert layout(grid) == oracle
+
+
+def test_compact_returns_only_moved_parties():
+    grid = OccupancyGrid(2)
+    grid.place(1, 0, 1, 1)
+    grid.place(2, 0, 1, 2)
+    grid.place(3, 1, 1, 1)
+    grid.release(1)
+    assert grid.compact(1, grid.lines(0, 1)) == {2: 1}
+    assert grid.head(0) == 2 and grid.head(1) == 3
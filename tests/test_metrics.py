@@ -0,0 +1,50 @@
+import base64
+import pytest
+from kiosk_queue import auth as auth_module
+from conftest import create_app
+
+
+@pytest.fixture
+def app():
+    return create_app(KIOSK_QUEUE_METRICS=True)
+
+
+def basic(password, user="prometheus"):
+    return {"Authorization": "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()}
+
+
+def test_exposition_text(client, admin):
+    client.post("/api/kiosk/join", json={"name": "a"})
+    response = client.get("/api/kiosk/admin/metrics", headers=admin)
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'kiosk_queue_parties{queue="1"} 1' in lines
+    assert any(line.startswith("# TYPE kiosk_queue_request_seconds ") for line in lines)
+    assert any(line.startswith('kiosk_queue_request_seconds_count{endpoint="join_queue"}') for line in lines)
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer 1.abc"}, basic("wrong")])
+def test_unauthorized(client, headers):
+    response = client.get("/api/kiosk/admin/metrics", headers=headers)
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"].startswith("Basic")
+
+
+def test_basic_auth_is_hashed_once(app, client, monkeypatch):
+    hashed = []
+    check = auth_module.check_password_hash
+    monkeypatch.setattr(auth_module, "check_password_hash",
+                        lambda password_hash, password: hashed.append(password) or check(password_hash, password))
+    for _ in range(3):
+        assert client.get("/api/kiosk/admin/metrics", headers=basic("admin")).status_code == 200
+    assert hashed == ["admin"]
+    with app.app_context():
+        assert auth_module.get_auth().retry_after("127.0.0.1") == 0
+
+
+def test_disabled_metrics_are_404():
+    client = create_app().test_client()
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    response = client.get("/api/kiosk/admin/metrics", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404
@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import json
+import time
+import pytest
+from conftest import create_app
+from kiosk_queue.models import Notification, db
+from kiosk_queue.notifications import MemoryTransport
+
+SECRET = "webhook-secret"
+
+
+@pytest.fixture
+def app():
+    return create_app(KIOSK_QUEUE_NOTIFY_WEBHOOK_SECRET=SECRET)
+
+
+def signed(body, timestamp=None, secret=SECRET):
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return {"X-Webhook-Timestamp": timestamp, "X-Webhook-Signature": f"sha256={signature}",
+            "Content-Type": "application/json"}
+
+
+def queued(client):
+    return len(client.get("/api/kiosk/queue").get_json()["queue"])
+
+
+@pytest.fixture
+def cancel(client):
+    client.post("/api/kiosk/join", json={"name": "a", "email": "a@example.com", "email_consent": True})
+    return json.dumps({"from": "a@example.com", "body": "cancel"}).encode()
+
+
+def test_signed_cancel(client, cancel):
+    response = client.post("/api/kiosk/notifications/inbound", data=cancel, headers=signed(cancel))
+    assert response.get_json() == {"cancelled": 1}
+    assert queued(client) == 0
+
+
+def test_secret_header(client, cancel):
+    response = client.post("/api/kiosk/notifications/inbound", data=cancel,
+                           headers={"X-Webhook-Secret": SECRET, "Content-Type": "application/json"})
+    assert response.get_json() == {"cancelled": 1}
+
+
+@pytest.mark.parametrize("headers", [
+    lambda body: {"Content-Type": "application/json"},
+    lambda body: signed(body, secret="wrong"),
+    lambda body: signed(body, timestamp=int(time.time()) - 3600),
+    lambda body: signed(body, timestamp="１２３"),
+    lambda body: signed(body.replace(b"cancel", b"CANCEL")),
+    lambda body: {"X-Webhook-Secret": "wrong", "Content-Type": "application/json"},
+])
+def test_rejected(client, cancel, headers):
+    response = client.post("/api/kiosk/notifications/inbound", data=cancel, headers=headers(cancel))
+    assert response.status_code == 401
+    assert queued(client) == 1
+
+
+def test_secret_in_query_is_not_accepted(client, cancel):
+    response = client.post(f"/api/kiosk/notifications/inbound?secret={SECRET}", data=cancel,
+                           headers={"Content-Type": "application/json"})
+    assert response.status_code == 401
+    assert queued(client) == 1
+
+
+@pytest.mark.parametrize("payload", [[], [1], 5, "cancel", {"from": 5, "body": "cancel"},
+                                     {"from": "a@example.com", "body": 5},
+                                     {"from": "a@example.com", "body": None},
+                                     {"from": "a@example.com", "body": ["cancel"]}])
+def test_malformed_payload(client, cancel, payload):
+    body = json.dumps(payload).encode()
+    response = client.post("/api/kiosk/notifications/inbound", data=body, headers=signed(body))
+    assert response.status_code == 400
+    assert queued(client) == 1
+
+
+@pytest.fixture
+def notifier_app():
+    """Builds an app whose dispatcher only runs when a test calls ``dispatch()``."""
+    notifiers = []
+
+    def build(transport=None, **config):
+        app = create_app(KIOSK_QUEUE_NOTIFY_TRANSPORT=transport or MemoryTransport(), LINE_COUNT=1,
+                         KIOSK_QUEUE_NOTIFY_POLL_INTERVAL=3600, **config)
+        notifier = app.extensions["kiosk_queue_notifier"]
+        notifier.wake = lambda: None
+        notifiers.append(notifier)
+        return app, notifier
+
+    yield build
+    for notifier in notifiers:
+        notifier.close()
+
+
+def join_all(client, *names, consent=True):
+    for name in names:
+        client.post("/api/kiosk/join", json={"name": name, "email": f"{name}@example.com", "email_consent": consent})
+
+
+def dispatch(app, notifier):
+    with app.app_context():
+        return notifier.dispatch()
+
+
+def outbox(app):
+    with app.app_context():
+        return {row.address: (row.status, row.attempts, row.next_attempt_at, row.last_error)
+                for row in Notification.query}
+
+
+def due_now(app):
+    """Make every pending row due, as if its retry delay or lease had run out."""
+    with app.app_context():
+        Notification.query.filter_by(status="pending").update({"next_attempt_at": time.time() - 1})
+        db.session.commit()
+
+
+def test_dispatch_only_to_consenting_parties(notifier_app):
+    app, notifier = notifier_app()
+    client = app.test_client()
+    join_all(client, "a")
+    join_all(client, "b", consent=False)
+    client.post("/api/kiosk/join", json={"name": "c", "email_consent": True})
+    assert dispatch(app, notifier) == 1
+    assert [(m["address"], m["kind"]) for m in notifier.transport.sent] == [("a@example.com", "up_soon")]
+    assert "number 1" in notifier.transport.sent[0]["body"]
+    assert notifier.sent == 1
+    assert outbox(app)["a@example.com"][:2] == ("sent", 1)
+
+
+def test_dispatch_within_k_of_the_front(notifier_app):
+    app, notifier = notifier_app(KIOSK_QUEUE_NOTIFY_WITHIN=2)
+    client = app.test_client()
+    join_all(client, "a", "b", "c", "d")
+    dispatch(app, notifier)
+    assert [m["address"] for m in notifier.transport.sent] == ["a@example.com", "b@example.com"]
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers={"Authorization": f"Bearer {token}"})
+    dispatch(app, notifier)
+    # c moved up to place 2; b is messaged only once, d is still too far back
+    assert [m["address"] for m in notifier.transport.sent] == ["a@example.com", "b@example.com", "c@example.com"]
+    assert "number 2" in notifier.transport.sent[-1]["body"]
+
+
+def test_dispatch_retries_with_backoff(notifier_app):
+    failures = ["gateway timeout"]
+    transport = MemoryTransport(fail=lambda message: failures.pop() if failures else None)
+    app, notifier = notifier_app(transport, KIOSK_QUEUE_NOTIFY_BACKOFF=10)
+    join_all(app.test_client(), "a")
+    before = time.time()
+    assert dispatch(app, notifier) == 1
+    status, attempts, next_attempt_at, error = outbox(app)["a@example.com"]
+    assert (status, attempts, error) == ("pending", 1, "gateway timeout")
+    # First retry after backoff * 2 ** 0, jittered by 0.5-1.5x
+    assert before + 5 <= next_attempt_at <= time.time() + 15
+    assert notifier.retried == 1 and transport.sent == []
+    assert dispatch(app, notifier) == 0
+    due_now(app)
+    assert dispatch(app, notifier) == 1
+    assert [m["address"] for m in transport.sent] == ["a@example.com"]
+    assert outbox(app)["a@example.com"][:2] == ("sent", 2)
+
+
+def test_dispatch_gives_up_after_max_attempts(notifier_app):
+    transport = MemoryTransport(fail=lambda message: "rejected")
+    app, notifier = notifier_app(transport, KIOSK_QUEUE_NOTIFY_BACKOFF=0, KIOSK_QUEUE_NOTIFY_MAX_ATTEMPTS=3)
+    join_all(app.test_client(), "a")
+    for _ in range(3):
+        assert dispatch(app, notifier) == 1
+    assert dispatch(app, notifier) == 0
+    assert outbox(app)["a@example.com"][:2] == ("failed", 3)
+    assert (transport.calls, notifier.retried, notifier.failed) == (3, 2, 1)
+
+
+def test_dispatch_reclaims_expired_lease(notifier_app):
+    app, notifier = notifier_app()
+    join_all(app.test_client(), "a")
+    with app.app_context():
+        # A worker process claims the row, then dies before recording the outcome
+        store = app.extensions["kiosk_queue_store"]
+        assert len(store.claim_notifications(time.time(), 60, 10)) == 1
+    assert dispatch(app, notifier) == 0
+    due_now(app)
+    assert dispatch(app, notifier) == 1
+    assert [m["address"] for m in notifier.transport.sent] == ["a@example.com"]
+    assert outbox(app)["a@example.com"][:2] == ("sent", 2)
@@ -0,0 +1,75 @@
+import random
+import pytest
+from kiosk_queue.occupancy import OccupancyGrid
+
+
+def test_projections_of_party_without_lines():
+    # Rows placed before LINE_COUNT was lowered leave parties on lines the grid doesn't have
+    grid = OccupancyGrid(2)
+    grid.rebuild([(1, 0, 2, 1), (2, 3, 1, 1), (3, 1, 2, 2)], 1, {0: 100, 1: 200})
+    service = [60, 60]
+    assert grid.party_projection(1, service) == 260
+    assert grid.party_projection(2, service) == 0
+    assert grid.party_projections(service) == {1: (0, 1, 260), 2: (3, 1, 0), 3: (1, 2, 320)}
+
+
+def layout_is_consistent(grid):
+    cells = {}
+    for user_id, (line_number, party_size, depth) in grid._parties.items():
+        for ln in grid.lines(line_number, party_size):
+            assert (ln, depth) not in cells
+            cells[(ln, depth)] = user_id
+    return all(grid.at(ln, depth) == user_id for (ln, depth), user_id in cells.items())
+
+
+def test_repack_keeps_pinned_party_off_slow_line():
+    # Line 1 serves ten times slower; the party at (0, 3) asked for line 0
+    grid = OccupancyGrid(2)
+    grid.rebuild([(1, 0, 1, 1), (2, 0, 1, 2), (3, 0, 1, 3, True), (4, 1, 1, 1), (5, 1, 1, 2)], 1, {0: 1000, 1: 1000})
+    service = [40, 1800]
+    grid.release(4)
+    assert grid.repack(service=service).get(3) is None
+    assert grid.party(3) == (0, 1, 3)
+
+
+def test_repack_never_moves_to_later_start():
+    # Unpinned, depth 2 on the slow line would still start after depth 3 on the fast one
+    grid = OccupancyGrid(2)
+    grid.rebuild([(1, 0, 1, 1), (2, 0, 1, 2), (3, 0, 1, 3), (4, 1, 1, 1), (5, 1, 1, 2)], 1, {0: 1000, 1: 1000})
+    grid.release(4)
+    grid.compact(1, grid.lines(1, 1))
+    assert 3 not in grid.repack(service=[40, 1800])
+    assert 3 in grid.repack(service=[600, 60])
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_repack_estimates_never_get_later(seed):
+    rnd = random.Random(seed)
+    line_count = rnd.randint(2, 5)
+    grid = OccupancyGrid(line_count)
+    grid.admitted = [rnd.randint(0, 3600) for _ in range(line_count)]
+    service = [rnd.choice((30, 120, 300, 900, 2400)) for _ in range(line_count)]
+    pinned_lines = {}
+    next_id = 1
+    for _ in range(250):
+        if grid._parties and rnd.random() < 0.45:
+            before = {user_id: grid.party_projection(user_id, service) for user_id in grid._parties}
+            user_id = rnd.choice(sorted(grid._parties))
+            line_number, party_size, depth = grid.release(user_id)
+            grid.compact(depth, grid.lines(line_number, party_size))
+            grid.repack(rnd.choice((None, 3)), service)
+            for other, at in before.items():
+                if other != user_id:
+                    assert grid.party_projection(other, service) <= at
+            for other, line_number in pinned_lines.items():
+                if grid.party(other) is not None:
+                    assert grid.party(other)[0] == line_number
+            assert layout_is_consistent(grid)
+        else:
+            party_size = rnd.randint(1, line_count)
+            requested = rnd.randrange(line_count) if party_size == 1 and rnd.random() < 0.4 else None
+            line_number, depth = grid.find_position(party_size, requested, best_fit=True)
+            grid.place(next_id, line_number, party_size, depth, requested is not None)
+            if requested is not None:
+                pinned_lines[next_id] = line_number
+            next_id += 1
@@ -0,0 +1,181 @@
+import pytest
+from kiosk_queue.queue_logic import _get_queue
+from kiosk_queue.read_model import public_view
+
+
+def join(client, name="a", **fields):
+    return client.post("/api/kiosk/join", json=dict(fields, name=name))
+
+
+def test_next_unknown_queue_is_404(client, admin):
+    response = client.post("/api/kiosk/q/999/admin/next", json={"line_number": 0}, headers=admin)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("line_number", ["0", 1.0, True, -1, 3])
+def test_next_rejects_invalid_line_number(client, admin, line_number):
+    join(client)
+    response = client.post("/api/kiosk/admin/next", json={"line_number": line_number}, headers=admin)
+    assert response.status_code == 400
+    assert len(client.get("/api/kiosk/queue").get_json()["queue"]) == 1
+
+
+def test_next_admits_head(client, admin):
+    join(client)
+    response = client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin)
+    assert response.status_code == 200
+    assert response.get_json() == {"message": "Line 0 advanced"}
+    assert client.get("/api/kiosk/queue").get_json()["queue"] == []
+
+
+@pytest.mark.parametrize("party_size", [0, -2, "2", 1.5, True, None])
+def test_join_rejects_invalid_party_size(client, party_size):
+    response = join(client, party_size=party_size)
+    assert response.status_code == 400
+    assert client.get("/api/kiosk/queue").get_json()["queue"] == []
+
+
+def test_join_batch_reports_invalid_party_size_per_item(client):
+    response = client.post("/api/kiosk/join/batch", json={"parties": [{"name": "a", "party_size": 0}, {"name": "b", "party_size": 2}]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [item["status"] for item in results] == [400, 201]
+    assert [party["name"] for party in client.get("/api/kiosk/queue").get_json()["queue"]] == ["b"]
+
+
+def test_join_batch_validates_each_item(client):
+    parties = [
+        {"name": "ok"},
+        "not a party",
+        {"name": ["a"]},
+        {"name": "e", "email": 5},
+        {"name": "l", "line_number": 3},
+        {"name": "t", "line_number": True},
+        {"name": "c", "email_consent": "yes"},
+        {"name": "ok2", "line_number": 2, "email_consent": True},
+    ]
+    response = client.post("/api/kiosk/join/batch", json={"parties": parties})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [item["status"] for item in results] == [201, 400, 400, 400, 400, 400, 400, 201]
+    assert all("error" in item for item in results[1:-1])
+    queue = client.get("/api/kiosk/queue").get_json()["queue"]
+    assert sorted(party["name"] for party in queue) == ["ok", "ok2"]
+
+
+def test_next_batch_rejects_bool_count(client, admin):
+    join(client)
+    response = client.post("/api/kiosk/admin/next/batch", json={"line_number": 0, "count": True}, headers=admin)
+    assert response.status_code == 400
+    assert len(client.get("/api/kiosk/queue").get_json()["queue"]) == 1
+
+
+def test_next_batch_skips_bool_line_numbers(client, admin):
+    join(client, line_number=1)
+    response = client.post("/api/kiosk/admin/next/batch", json={"line_numbers": [True]}, headers=admin)
+    assert response.status_code == 200
+    assert response.get_json()["results"][0]["user_id"] is None
+    assert len(client.get("/api/kiosk/queue").get_json()["queue"]) == 1
+
+
+@pytest.fixture
+def queued(client):
+    """Seven parties over the three lines (a party of 2 at index 4); the full list."""
+    for i in range(7):
+        join(client, name=str(i), party_size=2 if i == 4 else 1)
+    return client.get("/api/kiosk/queue").get_json()["queue"]
+
+
+def test_queue_etag_revalidates_until_change(client, admin, queued):
+    response = client.get("/api/kiosk/queue")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+    for _ in range(2):
+        response = client.get("/api/kiosk/queue", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+    client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin)
+    response = client.get("/api/kiosk/queue", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.get_json()["queue"]) == len(queued) - 1
+    assert client.get("/api/kiosk/queue", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_queue_etag_changes_on_join(client, queued):
+    etag = client.get("/api/kiosk/queue").headers["ETag"]
+    join(client, name="late")
+    assert client.get("/api/kiosk/queue").headers["ETag"] != etag
+
+
+def test_queue_summary(client, queued):
+    response = client.get("/api/kiosk/queue?summary=1")
+    summary = response.get_json()
+    assert "queue" not in summary
+    assert summary["size"] == 7
+    assert summary["people"] == 8
+    assert summary["line_depth"] == [3, 3, 2]
+    assert summary["seq"] == client.get("/api/kiosk/queue").get_json()["seq"]
+    assert len(summary["wait_detail"]["per_line_single"]) == 3
+    assert summary["wait_detail"]["per_span"].keys() == {"2", "3"}
+    assert client.get("/api/kiosk/queue?summary=1", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("limit=3", slice(0, 3)),
+    ("offset=2&limit=3", slice(2, 5)),
+    ("offset=5", slice(5, None)),
+    ("offset=9&limit=3", slice(7, 7)),
+    ("limit=0", slice(0, 0)),
+])
+def test_queue_page(client, queued, query, expected):
+    page = client.get(f"/api/kiosk/queue?{query}").get_json()
+    assert page["queue"] == queued[expected]
+    assert page["total"] == 7
+
+
+@pytest.mark.parametrize("query", ["limit=-1", "offset=x", "around=1&radius=-2"])
+def test_queue_rejects_bad_numbers(client, queued, query):
+    assert client.get(f"/api/kiosk/queue?{query}").status_code == 400
+
+
+@pytest.mark.parametrize("user_id, radius", [(1, 1), (3, 0), (5, 1), (7, 1), (7, 5), (6, 0)])
+def test_queue_window_around_party(client, queued, user_id, radius):
+    window = client.get(f"/api/kiosk/queue?around={user_id}&radius={radius}").get_json()
+    depth = next(party["place_in_queue"] for party in queued if party["id"] == user_id)
+    near = [party for party in queued if abs(party["place_in_queue"] - depth) <= radius]
+    assert sorted(window["queue"], key=lambda party: party["id"]) == sorted(near, key=lambda party: party["id"])
+    # Ordered by depth, so the party's own slot is in the middle and the edges are clipped
+    assert [party["place_in_queue"] for party in window["queue"]] == sorted(party["place_in_queue"] for party in near)
+    assert window["position"]["place_in_queue"] == depth
+    assert window["position"]["parties_ahead"] == sum(party["place_in_queue"] < depth for party in queued)
+    assert window["total"] == 7
+
+
+def test_queue_window_unknown_party(client, queued):
+    assert client.get("/api/kiosk/queue?around=99").status_code == 404
+
+
+@pytest.mark.parametrize("query", ["", "&offset=2&limit=3", "&around=5&radius=1"])
+def test_queue_columns_match_rows(client, queued, query):
+    rows = client.get(f"/api/kiosk/queue?{query}").get_json()
+    response = client.get(f"/api/kiosk/queue?format=columns{query}")
+    data = response.get_json()
+    assert "queue" not in data
+    assert set(data["columns"]) == {"id", "party_size", "place_in_queue", "line_number", "name"}
+    assert [dict(zip(data["columns"], values)) for values in zip(*data["columns"].values())] == rows["queue"]
+    del data["columns"], rows["queue"]
+    assert data == rows
+
+
+def test_queue_columns_etag_and_encoding_are_per_format(app, client, queued):
+    rows = client.get("/api/kiosk/queue")
+    columns = client.get("/api/kiosk/queue?format=columns")
+    assert columns.headers["ETag"] != rows.headers["ETag"]
+    assert client.get("/api/kiosk/queue?format=columns", headers={"If-None-Match": columns.headers["ETag"]}).status_code == 304
+    assert client.get("/api/kiosk/queue", headers={"If-None-Match": columns.headers["ETag"]}).status_code == 200
+    with app.app_context():
+        view = public_view(_get_queue())
+        assert view.body("columns") is view.body("columns")
+        assert view.body("columns") == columns.data
+    assert client.get("/api/kiosk/queue?format=xml").status_code == 400
@@ -0,0 +1,41 @@
+import random
+import pytest
+from kiosk_queue.occupancy import OccupancyGrid
+from kiosk_queue.service_stats import LineServiceStats, ServiceStats
+
+
+@pytest.mark.parametrize("samples", [1, 2, 3])
+def test_few_samples_keep_p90_apart_from_p50(samples):
+    stats = LineServiceStats(0.1, 480)
+    for _ in range(samples):
+        stats.add(480)
+    assert stats.p50() == pytest.approx(480)
+    assert stats.p90() > 1.5 * stats.p50()
+
+
+def test_p90_narrows_with_consistent_samples():
+    stats = LineServiceStats(0.1, 480)
+    for _ in range(100):
+        stats.add(300)
+    assert stats.p50() == pytest.approx(300, rel=0.01)
+    assert stats.p90() < 1.05 * stats.p50()
+
+
+def test_p90_follows_spread_samples():
+    rnd = random.Random(1)
+    stats = LineServiceStats(0.1, 480)
+    for _ in range(200):
+        stats.add(rnd.lognormvariate(6, 0.8))
+    assert 2 < stats.p90() / stats.p50() < 4
+
+
+def test_line_without_samples_uses_prior():
+    grid = OccupancyGrid(2)
+    grid.place(1, 0, 1, 1)
+    stats = ServiceStats(2, prior=480)
+    stats.touched(grid, [0], 1000)
+    grid.release(1)
+    stats.served(grid, [0], 1480)
+    p50, p90 = stats.quantiles()
+    assert p50[1] == 480 and p90[1] > 1.5 * 480
+    assert p90[0] > 1.5 * p50[0]
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import cors_helpers
+import pytest
+from flask_socketio import SocketIO
+from conftest import create_app
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    """Apps whose CORS was configured so far."""
+    calls = []
+    configure_cors = cors_helpers.configure_cors
+
+    def counting(app, **kwargs):
+        calls.append(app)
+        return configure_cors(app, **kwargs)
+
+    monkeypatch.setattr(cors_helpers, "configure_cors", counting)
+    return calls
+
+
+def test_eager_configures_cors_at_init(configured):
+    app = create_app()
+    assert configured == [app]
+
+
+def test_lazy_configures_cors_on_first_request(configured):
+    app = create_app(KIOSK_QUEUE_LAZY_INIT=True)
+    assert configured == []
+    client = app.test_client()
+    assert client.get("/api/kiosk/queue").status_code == 200
+    client.get("/api/kiosk/queue")
+    assert configured == [app]
+
+
+def test_socketio_checks_configured_origins(configured):
+    socketio = SocketIO(async_mode="threading", cors_allowed_origins="*")
+    app = create_app(socketio=socketio, KIOSK_QUEUE_LAZY_INIT=True,
+                     KIOSK_QUEUE_CORS_ORIGINS=["https://kiosk.example"])
+    allowed = socketio.server.eio.cors_allowed_origins
+    assert configured == []
+    assert allowed("https://kiosk.example") and not allowed("https://other.example")
+    assert configured == [app]
+
+
+def test_socketio_keeps_own_origins():
+    socketio = SocketIO(async_mode="threading", cors_allowed_origins=["https://own.example"])
+    create_app(socketio=socketio)
+    assert socketio.server.eio.cors_allowed_origins == ["https://own.example"]
+
+
+def test_cli_commands_run_and_list(app):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["kiosk-hash-password", "--password", "secret"])
+    assert result.exit_code == 0 and result.output.startswith(("scrypt:", "pbkdf2:"))
+    result = runner.invoke(args=["--help"])
+    assert "kiosk-hash-password" in result.output and "Print a hash of the admin password" in result.output
+    result = runner.invoke(args=["kiosk-create-queue", "--help"])
+    assert result.exit_code == 0 and "--lines" in result.output
+
+
+# Runs in a fresh interpreter: which optional modules init_app loaded
+CHILD = r"""
+import json, sys
+from flask import Flask
+import kiosk_queue
+app = Flask("startup")
+app.config.update(SECRET_KEY="test", SQLALCHEMY_DATABASE_URI="sqlite://", LINE_COUNT=3, SLOT_TIME=5, RESET_TIME=3,
+                  ADMIN_PASSWORD="admin", KIOSK_QUEUE_LAZY_INIT=True)
+kiosk_queue.KioskQueue().init_app(app)
+print(json.dumps(sorted(name for name in sys.modules if name.startswith(("kiosk_queue.", "cors_helpers", "flask_cors")))))
+"""
+
+
+def test_lazy_init_leaves_optional_modules_unloaded():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(__file__))] + sys.path))
+    output = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True).stdout
+    loaded = set(json.loads(output.splitlines()[-1]))
+    for name in ("kiosk_queue.cli", "kiosk_queue.archive", "kiosk_queue.notifications",
+                 "kiosk_queue.sockets", "kiosk_queue.broadcast", "cors_helpers"):
+        assert name not in loaded
@@ -0,0 +1,133 @@
+"""The queue endpoints against each QueueStore, including restarts of the durable ones."""
+import os
+import pytest
+from kiosk_queue.queue_logic import _get_grid, _get_queue
+from kiosk_queue.storage import MemoryStore, QueueStore, SQLAlchemyStore
+from conftest import create_app
+
+
+@pytest.fixture(params=["sqlalchemy", "memory"])
+def store_config(request, tmp_path):
+    # Both on disk, so an app created again on the same config is a restart
+    if request.param == "memory":
+        return {"KIOSK_QUEUE_STORE": "memory", "KIOSK_QUEUE_STORE_PATH": str(tmp_path / "store"),
+                "KIOSK_QUEUE_STORE_SNAPSHOT_EVERY": 4}
+    return {"KIOSK_QUEUE_STORE": "sqlalchemy", "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'queue.db'}"}
+
+
+@pytest.fixture
+def app(store_config):
+    app = create_app(**store_config)
+    yield app
+    app.extensions["kiosk_queue_store"].close()
+
+
+def restart(app, store_config):
+    app.extensions["kiosk_queue_store"].close()
+    return create_app(**store_config)
+
+
+def layout(client):
+    queue = client.get("/api/kiosk/queue").get_json()
+    return queue["seq"], sorted((p["name"], p["line_number"], p["place_in_queue"], p["party_size"]) for p in queue["queue"])
+
+
+def join(client, name, **fields):
+    response = client.post("/api/kiosk/join", json=dict(fields, name=name))
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_join_next_remove(client, admin):
+    a = join(client, "a", line_number=0)
+    b = join(client, "b", party_size=2)
+    join(client, "c", line_number=0)
+    assert (a["line_number"], a["place_in_queue"]) == (0, 1)
+    assert (b["line_number"], b["place_in_queue"]) == (1, 1)
+
+    assert client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin).status_code == 200
+    assert layout(client)[1] == [("b", 1, 1, 2), ("c", 0, 1, 1)]
+
+    client.post("/api/kiosk/admin/remove", json={"user_id": b["id"]}, headers=admin)
+    assert layout(client)[1] == [("c", 0, 1, 1)]
+    assert client.get(f"/api/kiosk/position/{b['token']}").status_code == 404
+
+
+def test_batches(client, admin):
+    response = client.post("/api/kiosk/join/batch", json={"parties": [{"name": n} for n in "abcdef"]})
+    ids = [item["id"] for item in response.get_json()["results"]]
+    assert layout(client)[1] == [("a", 0, 1, 1), ("b", 1, 1, 1), ("c", 2, 1, 1),
+                                 ("d", 0, 2, 1), ("e", 1, 2, 1), ("f", 2, 2, 1)]
+
+    response = client.post("/api/kiosk/admin/next/batch", json={"line_number": 0, "count": 2}, headers=admin)
+    assert [item["user_id"] for item in response.get_json()["results"]] == [ids[0], ids[3]]
+    client.post("/api/kiosk/admin/remove/batch", json={"user_ids": [ids[1], ids[5]]}, headers=admin)
+    assert layout(client)[1] == [("c", 2, 1, 1), ("e", 1, 1, 1)]
+
+
+def test_restart_restores_state(app, store_config, admin):
+    client = app.test_client()
+    tokens = [join(client, name, party_size=1 + i % 2)["token"] for i, name in enumerate("abcdefg")]
+    for line_number in (0, 2, 1):
+        client.post("/api/kiosk/admin/next", json={"line_number": line_number}, headers=admin)
+    before = layout(client)
+    positions = [client.get(f"/api/kiosk/position/{token}").status_code for token in tokens]
+
+    restarted = restart(app, store_config)
+    client = restarted.test_client()
+    assert layout(client) == before
+    assert [client.get(f"/api/kiosk/position/{token}").status_code for token in tokens] == positions
+    # and it keeps going from there
+    join(client, "h")
+    assert layout(client)[0] == before[0] + 1
+    restarted.extensions["kiosk_queue_store"].close()
+
+
+def test_torn_log_tail_is_ignored(store_config):
+    if store_config["KIOSK_QUEUE_STORE"] != "memory":
+        pytest.skip("only the memory store keeps a log")
+    # No snapshot in between, which would start a fresh log
+    store_config = dict(store_config, KIOSK_QUEUE_STORE_SNAPSHOT_EVERY=1000)
+    app = create_app(**store_config)
+    client = app.test_client()
+    for name in "abcdef":
+        join(client, name)
+    before = layout(client)
+    app.extensions["kiosk_queue_store"].close()
+    with open(os.path.join(store_config["KIOSK_QUEUE_STORE_PATH"], "queue.log"), "a", encoding="utf-8") as f:
+        f.write('{"seq":99,"ops":[["delete",[1')
+
+    restarted = create_app(**store_config)
+    client = restarted.test_client()
+    assert layout(client) == before
+    join(client, "g")
+    after = layout(client)
+    assert len(after[1]) == len(before[1]) + 1
+
+    # Commits after the torn line survive the next restart too
+    restarted = restart(restarted, store_config)
+    assert layout(restarted.test_client()) == after
+    restarted.extensions["kiosk_queue_store"].close()
+
+
+def test_pinned_parties_survive_restart(app, store_config):
+    client = app.test_client()
+    pinned = join(client, "a", line_number=2)["id"]
+    join(client, "b")
+    restarted = restart(app, store_config)
+    with restarted.app_context():
+        assert _get_grid(_get_queue())._pinned == {pinned}
+    restarted.extensions["kiosk_queue_store"].close()
+
+
+
+def test_store_must_implement_every_operation():
+    class Partial(QueueStore):
+        def get_queue(self, queue_id=None):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        Partial()
+    # The shipped stores implement them all
+    SQLAlchemyStore()
+    MemoryStore().close()
@@ -0,0 +1,101 @@
+import threading
+import pytest
+from flask_socketio import SocketIO
+from kiosk_queue.workers import after_db, run_db
+from conftest import create_app
+
+
+def pooled_app(tmp_path, socketio=None):
+    # A file DB, so every pool thread's connection sees the same tables
+    return create_app(socketio=socketio, KIOSK_QUEUE_DB_WORKERS=2,
+                      SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'queue.db'}",
+                      SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"timeout": 30}})
+
+
+def test_work_runs_on_pool_and_callbacks_on_caller(tmp_path):
+    app = pooled_app(tmp_path)
+    caller = threading.current_thread().name
+    ran = []
+
+    def work(value):
+        ran.append(threading.current_thread().name)
+        after_db(lambda: ran.append(threading.current_thread().name))
+        # Nested run_db stays on the same pool thread
+        return run_db(lambda: value * 2)
+
+    with app.app_context():
+        assert run_db(work, 21) == 42
+    assert ran[0].startswith("kiosk-queue-db") and ran[1] == caller
+
+
+def test_errors_propagate_to_caller(tmp_path):
+    app = pooled_app(tmp_path)
+    deferred = []
+
+    def fail():
+        after_db(deferred.append, "ran")
+        raise ValueError("boom")
+
+    with app.app_context():
+        with pytest.raises(ValueError, match="boom"):
+            run_db(fail)
+        # The pool is still usable and the failed work's callbacks were dropped
+        assert run_db(lambda: 1) == 1
+    assert deferred == []
+
+
+def test_results_and_broadcasts_in_order(tmp_path):
+    socketio = SocketIO(async_mode="threading")
+    app = pooled_app(tmp_path, socketio=socketio)
+    socket = socketio.test_client(app, namespace="/queue")
+    seq = socket.get_received("/queue")[-1]["args"][0]["seq"]
+    client = app.test_client()
+    token = client.post("/api/kiosk/admin/login", json={"password": "admin"}).get_json()["token"]
+    admin = {"Authorization": f"Bearer {token}"}
+
+    joined = [client.post("/api/kiosk/join", json={"name": f"p{i}"}).get_json() for i in range(6)]
+    assert [party["id"] for party in joined] == [1, 2, 3, 4, 5, 6]
+    assert [party["place_in_queue"] for party in joined] == [1, 1, 1, 2, 2, 2]
+    assert client.post("/api/kiosk/admin/next", json={"line_number": 0}, headers=admin).status_code == 200
+    assert client.post("/api/kiosk/admin/next", json={"line_number": 9}, headers=admin).status_code == 400
+
+    deltas = [m["args"][0] for m in socket.get_received("/queue") if m["name"] == "queue_delta"]
+    # One delta per change, each based on the one before
+    assert [delta["base_seq"] for delta in deltas] == list(range(seq, seq + 7))
+    assert [delta["seq"] for delta in deltas] == list(range(seq + 1, seq + 8))
+    assert [delta["added"][0]["id"] for delta in deltas[:6]] == [1, 2, 3, 4, 5, 6]
+    assert deltas[6]["removed"] == [1]
+    queued = client.get("/api/kiosk/queue").get_json()
+    assert queued["seq"] == deltas[-1]["seq"]
+    assert sorted(party["id"] for party in queued["queue"]) == [2, 3, 4, 5, 6]
+
+
+def test_concurrent_requests_through_pool(tmp_path):
+    socketio = SocketIO(async_mode="threading")
+    app = pooled_app(tmp_path, socketio=socketio)
+    socket = socketio.test_client(app, namespace="/queue")
+    seq = socket.get_received("/queue")[-1]["args"][0]["seq"]
+    statuses = []
+
+    def work(seed):
+        client = app.test_client()
+        for i in range(10):
+            statuses.append(client.post("/api/kiosk/join", json={"name": f"w{seed}-{i}", "party_size": 1 + (i + seed) % 3}).status_code)
+
+    threads = [threading.Thread(target=work, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [201] * 40
+
+    parties = app.test_client().get("/api/kiosk/queue").get_json()["queue"]
+    cells = [(line, party["place_in_queue"]) for party in parties
+             for line in range(party["line_number"], party["line_number"] + party["party_size"])]
+    assert len(parties) == 40 and len(cells) == len(set(cells))
+    deltas = [m["args"][0] for m in socket.get_received("/queue") if m["name"] == "queue_delta"]
+    # Coalesced flushes may cover several joins, but never out of order or with a gap
+    assert deltas[0]["base_seq"] == seq
+    assert all(later["base_seq"] == earlier["seq"] for earlier, later in zip(deltas, deltas[1:]))
+    assert deltas[-1]["seq"] == seq + 40
+    assert sum(len(delta["added"]) for delta in deltas) == 40